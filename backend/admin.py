@@ -0,0 +1,240 @@
+import argparse
+import datetime
+import sys
+
+from data import (
+    blooms,
+    export,
+    migrations,
+    partitions,
+    suggestions,
+    timelines,
+    trending,
+    user_stats,
+)
+from data.connection import connect, db_cursor
+from data.result_cache import ARCHIVE_TAG, result_cache
+
+from dotenv import load_dotenv
+
+
+def migrate(args: argparse.Namespace) -> None:
+    conn = connect()
+    try:
+        applied = migrations.migrate(conn)
+    finally:
+        conn.close()
+    print(f"Applied {len(applied)} migrations")
+
+
+def rebuild_timelines(args: argparse.Namespace) -> None:
+    with db_cursor() as cur:
+        cur.execute("SELECT id FROM users ORDER BY id")
+        user_ids = [row[0] for row in cur.fetchall()]
+    for user_id in user_ids:
+        with db_cursor() as cur:
+            timelines.rebuild(cur, user_id)
+    print(f"Rebuilt home timelines for {len(user_ids)} users")
+
+
+def recount_stats(args: argparse.Namespace) -> None:
+    with db_cursor() as cur:
+        user_stats.recount(cur)
+    print("Recounted user stats")
+
+
+def refresh_suggestions(args: argparse.Namespace) -> None:
+    with db_cursor() as cur:
+        cur.execute("SELECT id FROM users ORDER BY id")
+        user_ids = [row[0] for row in cur.fetchall()]
+    for user_id in user_ids:
+        with db_cursor() as cur:
+            suggestions.refresh_suggestions(cur, user_id)
+    print(f"Refreshed suggested follows for {len(user_ids)} users")
+
+
+def rebuild_trends(args: argparse.Namespace) -> None:
+    with db_cursor() as cur:
+        trending.rebuild(cur)
+    print("Recounted trending hashtags")
+
+
+def export_blooms(args: argparse.Namespace) -> None:
+    if args.user is not None:
+        exported = blooms.iter_blooms_for_user(args.user, fetch_size=args.fetch_size)
+    elif args.hashtag is not None:
+        exported = blooms.iter_blooms_with_hashtag(
+            args.hashtag.lstrip("#"), fetch_size=args.fetch_size
+        )
+    else:
+        exported = blooms.iter_all_blooms(fetch_size=args.fetch_size)
+
+    write_ndjson(exported, args.output)
+
+
+def write_ndjson(exported, output_path: str) -> None:
+    count = 0
+
+    def counted():
+        nonlocal count
+        for bloom in exported:
+            count += 1
+            yield bloom
+
+    output = sys.stdout.buffer if output_path == "-" else open(output_path, "wb")
+    try:
+        for chunk in export.ndjson_chunks(counted()):
+            output.write(chunk)
+    finally:
+        if output is not sys.stdout.buffer:
+            output.close()
+    print(f"Exported {count} blooms", file=sys.stderr)
+
+
+def create_partitions(args: argparse.Namespace) -> None:
+    with db_cursor() as cur:
+        created = partitions.create_partitions(cur)
+    print(f"Created {len(created)} partitions: {', '.join(created) or 'none needed'}")
+
+
+def archive_blooms(args: argparse.Namespace) -> None:
+    with db_cursor() as cur:
+        months = partitions.archivable_months(cur, after_months=args.after_months)
+    # One transaction per month, so a failure keeps every month archived before it.
+    for month in months:
+        with db_cursor() as cur:
+            archived = partitions.archive_month(cur, month, directory=args.directory)
+        result_cache().invalidate(ARCHIVE_TAG)
+        print(
+            f"Archived {archived.bloom_count} blooms and {archived.hashtag_count} hashtags from {month:%Y-%m}"
+        )
+    print(f"Archived {len(months)} months")
+
+
+def query_archive(args: argparse.Namespace) -> None:
+    archived = partitions.iter_archived_blooms(
+        args.start,
+        args.end,
+        sender=args.user,
+        hashtag=args.hashtag.lstrip("#") if args.hashtag is not None else None,
+        directory=args.directory,
+    )
+    write_ndjson(archived, args.output)
+
+
+def main():
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="PurpleForest maintenance commands")
+    subcommands = parser.add_subparsers(required=True)
+
+    migrate_parser = subcommands.add_parser(
+        "migrate",
+        help="Apply any database migrations in ../db/migrations which haven't been applied yet",
+    )
+    migrate_parser.set_defaults(func=migrate)
+
+    rebuild_timelines_parser = subcommands.add_parser(
+        "rebuild-timelines",
+        help="Refill every user's materialized home timeline from the blooms and follows tables",
+    )
+    rebuild_timelines_parser.set_defaults(func=rebuild_timelines)
+
+    recount_stats_parser = subcommands.add_parser(
+        "recount-stats",
+        help="Recompute every user's bloom and follow counts from scratch",
+    )
+    recount_stats_parser.set_defaults(func=recount_stats)
+
+    refresh_suggestions_parser = subcommands.add_parser(
+        "refresh-suggestions",
+        help="Recompute every user's suggested follows; run this periodically, e.g. from cron",
+    )
+    refresh_suggestions_parser.set_defaults(func=refresh_suggestions)
+
+    rebuild_trends_parser = subcommands.add_parser(
+        "rebuild-trends",
+        help="Recount the per-minute, hour and day hashtag counts behind /trending from the hashtags table",
+    )
+    rebuild_trends_parser.set_defaults(func=rebuild_trends)
+
+    export_parser = subcommands.add_parser(
+        "export",
+        help="Write blooms as newline-delimited JSON: one user's or hashtag's newest first, or every bloom oldest first",
+    )
+    export_scope = export_parser.add_mutually_exclusive_group()
+    export_scope.add_argument("--user", help="Only export blooms sent by this user")
+    export_scope.add_argument(
+        "--hashtag", help="Only export blooms tagged with this hashtag"
+    )
+    export_parser.add_argument(
+        "--output", default="-", help="File to write to (default standard output)"
+    )
+    export_parser.add_argument(
+        "--fetch-size",
+        type=int,
+        help="Rows to fetch from the database at a time (default POSTGRES_FETCH_SIZE, or 2000)",
+    )
+    export_parser.set_defaults(func=export_blooms)
+
+    create_partitions_parser = subcommands.add_parser(
+        "create-partitions",
+        help="Create the monthly blooms and hashtags partitions for the months ahead; run this daily, e.g. from cron",
+    )
+    create_partitions_parser.set_defaults(func=create_partitions)
+
+    archive_parser = subcommands.add_parser(
+        "archive-blooms",
+        help="Export old months of blooms and hashtags to compressed files, then drop them from the database",
+    )
+    archive_parser.add_argument(
+        "--after-months",
+        type=int,
+        help="Archive months older than this many months (default BLOOM_ARCHIVE_AFTER_MONTHS, or 12)",
+    )
+    archive_parser.add_argument(
+        "--directory",
+        help="Directory to write archive files to (default BLOOM_ARCHIVE_DIR)",
+    )
+    archive_parser.set_defaults(func=archive_blooms)
+
+    query_archive_parser = subcommands.add_parser(
+        "query-archive",
+        help="Write archived blooms sent between two dates as newline-delimited JSON, oldest first",
+    )
+    query_archive_parser.add_argument(
+        "--from",
+        dest="start",
+        required=True,
+        type=datetime.datetime.fromisoformat,
+        help="Earliest send time, e.g. 2024-01-01",
+    )
+    query_archive_parser.add_argument(
+        "--to",
+        dest="end",
+        required=True,
+        type=datetime.datetime.fromisoformat,
+        help="Send time to stop before, e.g. 2024-02-01",
+    )
+    query_archive_scope = query_archive_parser.add_mutually_exclusive_group()
+    query_archive_scope.add_argument(
+        "--user", help="Only write blooms sent by this user"
+    )
+    query_archive_scope.add_argument(
+        "--hashtag", help="Only write blooms tagged with this hashtag"
+    )
+    query_archive_parser.add_argument(
+        "--directory",
+        help="Directory holding the archive files (default BLOOM_ARCHIVE_DIR)",
+    )
+    query_archive_parser.add_argument(
+        "--output", default="-", help="File to write to (default standard output)"
+    )
+    query_archive_parser.set_defaults(func=query_archive)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Serves the app as ASGI: the endpoints in async_endpoints natively, and everything else through the Flask app.
+
+Run it with python3 main.py --asgi, which gives each worker process its own bloom id worker
+id (see server.post_fork). Under another ASGI server, each process must instead be given
+its own ID_WORKER_ID, so e.g. uvicorn must run a single worker per ID_WORKER_ID.
+"""
+
+from contextlib import asynccontextmanager
+import time
+from typing import Optional
+
+import async_endpoints
+from data import metrics, tracing
+from data.aio import connection as async_connection
+from data.connection import PoolTimeoutError
+from data.passwords import PasswordHashingBusyError
+from main import HASHING_BUSY_RETRY_AFTER, create_app
+
+from a2wsgi import WSGIMiddleware
+from dotenv import load_dotenv
+from flask import Flask
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.routing import Match, Route
+
+ROUTES = [
+    Route("/register", async_endpoints.register, methods=["POST"]),
+    Route("/login", async_endpoints.login, methods=["POST"]),
+    Route("/home", async_endpoints.home_timeline),
+    Route("/profile", async_endpoints.self_profile),
+    Route("/profile/{profile_username}", async_endpoints.other_profile),
+    Route("/profile/{profile_username}/followers", async_endpoints.profile_followers),
+    Route("/profile/{profile_username}/follows", async_endpoints.profile_follows),
+    Route("/profile/{profile_username}/mutuals", async_endpoints.profile_mutuals),
+    Route("/follow", async_endpoints.do_follow, methods=["POST"]),
+    Route(
+        "/unfollow/{unfollow_username}", async_endpoints.do_unfollow, methods=["POST"]
+    ),
+    Route("/bloom", async_endpoints.send_bloom, methods=["POST"]),
+    Route("/bloom/{id_str}", async_endpoints.get_bloom),
+    Route("/blooms/{profile_username}", async_endpoints.user_blooms),
+    Route("/hashtag/{hashtag}", async_endpoints.hashtag),
+]
+
+
+def database_busy(request: Request, error: PoolTimeoutError):
+    return async_endpoints.json_response(
+        request, {"success": False, "message": "Server busy, try again"}, 503
+    )
+
+
+def hashing_busy(request: Request, error: PasswordHashingBusyError):
+    response = async_endpoints.json_response(
+        request, {"success": False, "message": "Server busy, try again"}, 503
+    )
+    response.headers["Retry-After"] = HASHING_BUSY_RETRY_AFTER
+    return response
+
+
+@asynccontextmanager
+async def lifespan(app: Starlette):
+    # The pool belongs to the event loop, so it's opened in each worker process, not before forking.
+    await async_connection.open_pool()
+    try:
+        yield
+    finally:
+        await async_connection.close_pool()
+
+
+class AsgiApp:
+    """AsgiApp sends requests for the routes in ROUTES to the async endpoints, and all others to the Flask app.
+
+    Streams, exports, bulk sends and the other less common endpoints keep running on a thread pool.
+    """
+
+    def __init__(self, flask_app: Flask, *, wsgi_threads: int):
+        self.native = Starlette(
+            routes=ROUTES,
+            lifespan=lifespan,
+            exception_handlers={
+                PoolTimeoutError: database_busy,
+                PasswordHashingBusyError: hashing_busy,
+            },
+            # The same CORS policy main.create_app gives the Flask app.
+            middleware=[
+                Middleware(
+                    CORSMiddleware,
+                    allow_origins=["*"],
+                    allow_credentials=True,
+                    allow_headers=["Content-Type", "Authorization", "Last-Event-ID"],
+                    allow_methods=["GET", "POST", "OPTIONS"],
+                    expose_headers=["Next-Cursor", "X-Query-Count", "Server-Timing"],
+                )
+            ],
+        )
+        self.native.state.flask_app = flask_app
+        self.fallback = WSGIMiddleware(flask_app, workers=wsgi_threads)
+
+    def route_for(self, scope) -> Optional[Route]:
+        # A route which matches the path but not the method still handles it, e.g. for CORS preflights.
+        for route in ROUTES:
+            match, _ = route.matches(scope)
+            if match != Match.NONE:
+                return route
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.native(scope, receive, send)
+            return
+        route = self.route_for(scope)
+        if route is None:
+            await self.fallback(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_recording_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.native(scope, receive, send_recording_status)
+        finally:
+            # Labelled like the Flask app's requests, whose endpoint names are the view functions' names.
+            tracing.request_duration.observe(
+                time.perf_counter() - started,
+                endpoint=route.endpoint.__name__,
+                method=scope["method"],
+                status=str(status),
+            )
+            metrics.save_snapshot()
+
+
+def create_asgi_app(flask_app: Optional[Flask] = None, *, wsgi_threads: int = 4):
+    if flask_app is None:
+        load_dotenv()
+        flask_app = create_app()
+    return AsgiApp(flask_app, wsgi_threads=wsgi_threads)
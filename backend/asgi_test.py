@@ -0,0 +1,144 @@
+import datetime
+import os
+import unittest
+from unittest import mock
+
+from starlette.testclient import TestClient
+
+import asgi
+from data.blooms import Bloom
+from data.users import User
+from main import create_app
+
+
+class TestAsgiApp(unittest.TestCase):
+    """Checks the async endpoints answer exactly as the Flask ones do, for requests which don't reach the database."""
+
+    def setUp(self):
+        with mock.patch.dict(os.environ, {"JWT_SECRET_KEY": "test-secret"}):
+            self.flask_app = create_app()
+        self.flask_client = self.flask_app.test_client()
+        self.asgi_client = TestClient(asgi.create_asgi_app(self.flask_app))
+
+    def assertSameResponse(self, method, path, **kwargs):
+        expected = self.flask_client.open(path, method=method, **kwargs)
+        actual = self.asgi_client.request(method, path, **kwargs)
+        self.assertEqual(actual.status_code, expected.status_code)
+        self.assertEqual(actual.content, expected.data)
+        self.assertEqual(
+            actual.headers["Content-Type"].split(";")[0], expected.mimetype
+        )
+
+    def make_token(self, **kwargs):
+        from flask_jwt_extended import create_access_token
+
+        with self.flask_app.app_context():
+            return create_access_token(identity="sample", **kwargs)
+
+    def test_missing_token(self):
+        self.assertSameResponse("GET", "/home")
+
+    def test_malformed_authorization_header(self):
+        self.assertSameResponse("GET", "/home", headers={"Authorization": "Token x"})
+        self.assertSameResponse("GET", "/home", headers={"Authorization": "Bearer x y"})
+
+    def test_invalid_token(self):
+        self.assertSameResponse(
+            "GET", "/home", headers={"Authorization": "Bearer not.a.token"}
+        )
+
+    def test_expired_token(self):
+        token = self.make_token(expires_delta=datetime.timedelta(seconds=-10))
+        self.assertSameResponse(
+            "GET", "/home", headers={"Authorization": f"Bearer {token}"}
+        )
+
+    def test_invalid_arguments(self):
+        self.assertSameResponse("GET", "/blooms/sample?limit=0")
+        self.assertSameResponse("GET", "/hashtag/purple?before=!!!")
+        self.assertSameResponse("GET", "/bloom/not-a-number")
+
+    def test_missing_fields(self):
+        self.assertSameResponse("POST", "/login", json={"username": "sample"})
+        self.assertSameResponse(
+            "POST", "/register", json={"username": "sample", "password": 5}
+        )
+
+    def test_home_timeline(self):
+        user = User(id=1, username="sample", password_salt=b"", password_scrypt=b"")
+        page = [
+            Bloom(
+                id=2,
+                sender="sample",
+                content="Café #purple",
+                sent_timestamp=datetime.datetime(2025, 5, 1, 12, 30, 15, 123456),
+            )
+        ]
+        headers = {"Authorization": f"Bearer {self.make_token()}"}
+        with mock.patch(
+            "endpoints.blooms.get_home_timeline", return_value=page
+        ), mock.patch(
+            "async_endpoints.async_blooms.get_home_timeline", return_value=page
+        ), mock.patch(
+            "data.users.get_user", return_value=user
+        ), mock.patch(
+            "async_endpoints.get_user", return_value=user
+        ):
+            self.assertSameResponse("GET", "/home?limit=1", headers=headers)
+            response = self.asgi_client.get("/home?limit=1", headers=headers)
+        self.assertIn("Next-Cursor", response.headers)
+
+    def test_conditional_bloom_requests_check_the_bloom_exists(self):
+        bloom = Bloom(
+            id=2,
+            sender="sample",
+            content="Hello",
+            sent_timestamp=datetime.datetime(2025, 5, 1, 12, 30, 15),
+        )
+        headers = {"If-None-Match": '"bloom-2"'}
+        for found, status in [(None, 404), (bloom, 304)]:
+            with mock.patch(
+                "endpoints.blooms.get_bloom", return_value=found
+            ), mock.patch("async_endpoints.async_blooms.get_bloom", return_value=found):
+                expected = self.flask_client.get("/bloom/2", headers=headers)
+                actual = self.asgi_client.get("/bloom/2", headers=headers)
+            self.assertEqual(expected.status_code, status)
+            self.assertEqual(actual.status_code, status)
+
+    def test_unknown_token_user(self):
+        headers = {"Authorization": f"Bearer {self.make_token()}"}
+        with mock.patch("data.users.get_user", return_value=None), mock.patch(
+            "async_endpoints.get_user", return_value=None
+        ):
+            self.assertSameResponse("GET", "/home", headers=headers)
+
+    def test_unfollow(self):
+        user = User(id=1, username="sample", password_salt=b"", password_scrypt=b"")
+        headers = {"Authorization": f"Bearer {self.make_token()}"}
+        self.assertSameResponse("POST", "/unfollow/nobody")
+        with mock.patch("data.users.get_user", return_value=user), mock.patch(
+            "endpoints.get_user", return_value=None
+        ), mock.patch("async_endpoints.get_user", side_effect=[user, None]):
+            self.assertSameResponse("POST", "/unfollow/nobody", headers=headers)
+
+    def test_mutuals(self):
+        user = User(id=2, username="ada", password_salt=b"", password_scrypt=b"")
+        with mock.patch("endpoints.get_user", return_value=user), mock.patch(
+            "endpoints.get_mutual_follows", return_value=["bo", "cy"]
+        ), mock.patch("async_endpoints.get_user", return_value=user), mock.patch(
+            "async_endpoints.async_follows.get_mutual_follows",
+            return_value=["bo", "cy"],
+        ):
+            self.assertSameResponse("GET", "/profile/ada/mutuals?limit=2")
+            response = self.asgi_client.get("/profile/ada/mutuals?limit=2")
+        self.assertEqual(response.headers["Next-Cursor"], "cy")
+        self.assertSameResponse("GET", "/profile/ada/mutuals?limit=x")
+
+    def test_other_routes_are_served_by_flask(self):
+        response = self.asgi_client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["Content-Type"].startswith("text/plain"))
+
+
+if __name__ == "__main__":
+    unittest.main()
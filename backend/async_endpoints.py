@@ -0,0 +1,521 @@
+"""Async versions of the busiest endpoints in endpoints.py, for the ASGI app in asgi.py.
+
+They serve the same routes with the same JWT behaviour and the same JSON, so clients can't
+tell which app answered. Reads await the async data modules, so a worker serves other
+requests while queries run, and independent queries run concurrently. Writes, and password
+hashing, run the sync functions in a thread, so they keep all their side effects in one place.
+"""
+
+import asyncio
+import datetime
+from datetime import timedelta
+import json
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+
+from data.aio import blooms as async_blooms
+from data.aio import follows as async_follows
+from data.aio import partitions as async_partitions
+from data.aio.user_stats import get_user_stats
+from data.aio.users import get_user
+from data.blooms import Bloom, add_bloom
+from data.follows import follow, unfollow
+from data.users import (
+    User,
+    UserRegistrationError,
+    register_user,
+    rehash_password_if_outdated,
+)
+from endpoints import (
+    DEFAULT_PAGE_SIZE,
+    IMMUTABLE_CACHE_CONTROL,
+    MINIMUM_PASSWORD_LENGTH,
+    PRIVATE_REVALIDATE_CACHE_CONTROL,
+    PROFILE_RECENT_BLOOMS,
+    REVALIDATE_CACHE_CONTROL,
+    check_request_fields,
+    is_not_modified,
+    latest,
+    make_etag,
+    next_cursor,
+    parse_limit,
+    parse_page_args,
+    validator_headers,
+)
+
+import flask
+from flask_jwt_extended import create_access_token
+from flask_jwt_extended.config import config as jwt_config
+from flask_jwt_extended.exceptions import NoAuthorizationError, UserLookupError
+
+# What verify_jwt_in_request runs, short of its user lookup, which would block the event loop.
+from flask_jwt_extended.view_decorators import _decode_jwt_from_request
+from starlette.requests import Request
+from starlette.responses import HTMLResponse, Response
+
+
+def json_response(request: Request, obj: Any, status_code: int = 200) -> Response:
+    """json_response encodes obj exactly as Flask's jsonify would, with the Flask app's JSON provider."""
+    body = request.app.state.flask_app.json.dumps(obj, separators=(",", ":")) + "\n"
+    return Response(body, status_code=status_code, media_type="application/json")
+
+
+def text_response(message: str, status_code: int) -> Response:
+    # Flask sends bare strings as HTML.
+    return HTMLResponse(message, status_code=status_code)
+
+
+async def authenticate(
+    request: Request, *, optional: bool = False
+) -> Union[Response, Optional[User]]:
+    """authenticate returns the user whose access token authorizes the request, or the error the Flask app would send.
+
+    The token is checked by flask_jwt_extended itself, in a Flask request context made from
+    the request's headers, and its errors are answered by the Flask app's own handlers.
+    """
+    flask_app = request.app.state.flask_app
+    with flask_app.test_request_context(
+        request.url.path,
+        method=request.method,
+        headers=list(request.headers.items()),
+        query_string=request.url.query,
+    ):
+        try:
+            claims, jwt_header, _ = _decode_jwt_from_request(None, False)
+        except NoAuthorizationError as error:
+            if optional:
+                return None
+            return from_flask_response(flask_app.handle_user_exception(error))
+        except Exception as error:
+            # Raises again anything which isn't one of flask_jwt_extended's errors.
+            return from_flask_response(flask_app.handle_user_exception(error))
+
+        identity = claims[jwt_config.identity_claim_key]
+        user = await get_user(identity)
+        if user is None:
+            error = UserLookupError(
+                f"user_lookup returned None for {identity}", jwt_header, claims
+            )
+            return from_flask_response(flask_app.handle_user_exception(error))
+    return user
+
+
+def from_flask_response(flask_response: flask.Response) -> Response:
+    return Response(
+        flask_response.get_data(),
+        status_code=flask_response.status_code,
+        headers={
+            name: value
+            for name, value in flask_response.headers.items()
+            if name.lower() != "content-length"
+        },
+    )
+
+
+def make_access_token(request: Request, username: str) -> str:
+    with request.app.state.flask_app.app_context():
+        return create_access_token(identity=username, expires_delta=timedelta(days=1))
+
+
+async def login(request: Request) -> Response:
+    body = await read_request_fields(request, {"username": str, "password": str})
+    if isinstance(body, Response):
+        return body
+    user = await get_user(body["username"])
+    if user is None:
+        return json_response(
+            request, {"success": False, "message": "Unknown user"}, 403
+        )
+    # Hashing waits on the hashing pool, which would hold up every other request on the event loop.
+    if not await asyncio.to_thread(user.check_password, body["password"]):
+        return json_response(
+            request, {"success": False, "message": "Incorrect password"}, 403
+        )
+    await asyncio.to_thread(rehash_password_if_outdated, user, body["password"])
+    return json_response(
+        request,
+        {"success": True, "token": make_access_token(request, body["username"])},
+    )
+
+
+async def register(request: Request) -> Response:
+    body = await read_request_fields(request, {"username": str, "password": str})
+    if isinstance(body, Response):
+        return body
+    if len(body["password"]) < MINIMUM_PASSWORD_LENGTH:
+        return json_response(
+            request,
+            {
+                "success": False,
+                "message": f"Password must be at least {MINIMUM_PASSWORD_LENGTH} characters long",
+            },
+            400,
+        )
+    try:
+        await asyncio.to_thread(register_user, body["username"], body["password"])
+    except UserRegistrationError as error:
+        return json_response(request, {"success": False, "message": error.reason}, 400)
+    return json_response(
+        request,
+        {"success": True, "token": make_access_token(request, body["username"])},
+    )
+
+
+async def self_profile(request: Request) -> Response:
+    user = await authenticate(request)
+    if isinstance(user, Response):
+        return user
+
+    follows, followers = await asyncio.gather(
+        async_follows.get_followed_usernames(user),
+        async_follows.get_inverse_followed_usernames(user),
+    )
+    return json_response(
+        request,
+        {"username": user.username, "follows": follows, "followers": followers},
+    )
+
+
+async def other_profile(request: Request) -> Response:
+    profile_username = request.path_params["profile_username"]
+    current_user, profile_user = await asyncio.gather(
+        authenticate(request, optional=True), get_user(profile_username)
+    )
+    if isinstance(current_user, Response):
+        return current_user
+    if profile_user is None:
+        return json_response(
+            request,
+            {"success": False, "message": f"User {profile_username} not found"},
+            404,
+        )
+
+    stats, viewer_is_following = await asyncio.gather(
+        get_user_stats(profile_user),
+        (
+            async_follows.is_following(current_user, profile_user)
+            if current_user is not None
+            else as_awaitable(False)
+        ),
+    )
+    include = request.query_params.get("include", "").split(",")
+
+    async def build_profile() -> Response:
+        recent_blooms, followers, follows = await asyncio.gather(
+            async_blooms.get_blooms_for_user(
+                profile_username, limit=PROFILE_RECENT_BLOOMS
+            ),
+            (
+                async_follows.get_inverse_followed_usernames(
+                    profile_user, limit=DEFAULT_PAGE_SIZE
+                )
+                if "followers" in include
+                else as_awaitable(None)
+            ),
+            (
+                async_follows.get_followed_usernames(
+                    profile_user, limit=DEFAULT_PAGE_SIZE
+                )
+                if "follows" in include
+                else as_awaitable(None)
+            ),
+        )
+        profile = {
+            "username": profile_username,
+            "recent_blooms": recent_blooms,
+            "is_following": viewer_is_following,
+            "is_self": current_user is not None
+            and current_user.username == profile_username,
+            "total_blooms": stats.bloom_count,
+            "follower_count": stats.follower_count,
+            "following_count": stats.following_count,
+            "last_bloom_timestamp": stats.last_bloom_timestamp,
+        }
+        if followers is not None:
+            profile["followers"] = followers
+        if follows is not None:
+            profile["follows"] = follows
+
+        response = json_response(request, profile)
+        cursor = next_cursor(recent_blooms, PROFILE_RECENT_BLOOMS)
+        if cursor is not None:
+            response.headers["Next-Cursor"] = cursor
+        return response
+
+    return await conditional_response(
+        request,
+        build_profile,
+        etag=make_etag(
+            "profile",
+            profile_username,
+            stats,
+            current_user.username if current_user is not None else None,
+            viewer_is_following,
+            sorted(include),
+        ),
+        last_modified=None,
+        cache_control=PRIVATE_REVALIDATE_CACHE_CONTROL,
+        vary="Authorization",
+    )
+
+
+async def profile_followers(request: Request) -> Response:
+    return await username_page(request, async_follows.get_inverse_followed_usernames)
+
+
+async def profile_follows(request: Request) -> Response:
+    return await username_page(request, async_follows.get_followed_usernames)
+
+
+async def username_page(request: Request, get_usernames) -> Response:
+    limit = get_limit_arg(request)
+    if isinstance(limit, Response):
+        return limit
+
+    profile_username = request.path_params["profile_username"]
+    profile_user = await get_user(profile_username)
+    if profile_user is None:
+        return json_response(
+            request,
+            {"success": False, "message": f"User {profile_username} not found"},
+            404,
+        )
+
+    usernames = await get_usernames(
+        profile_user, after=request.query_params.get("after"), limit=limit
+    )
+    response = json_response(request, usernames)
+    if len(usernames) == limit:
+        response.headers["Next-Cursor"] = usernames[-1]
+    return response
+
+
+async def profile_mutuals(request: Request) -> Response:
+    return await username_page(request, async_follows.get_mutual_follows)
+
+
+async def do_follow(request: Request) -> Response:
+    current_user = await authenticate(request)
+    if isinstance(current_user, Response):
+        return current_user
+    body = await read_request_fields(request, {"follow_username": str})
+    if isinstance(body, Response):
+        return body
+
+    follow_username = body["follow_username"]
+    follow_user = await get_user(follow_username)
+    if follow_user is None:
+        return text_response(
+            f"Cannot follow {follow_username} - user does not exist", 404
+        )
+
+    await asyncio.to_thread(follow, current_user, follow_user)
+    return json_response(request, {"success": True})
+
+
+async def do_unfollow(request: Request) -> Response:
+    current_user = await authenticate(request)
+    if isinstance(current_user, Response):
+        return current_user
+
+    unfollow_username = request.path_params["unfollow_username"]
+    unfollow_user = await get_user(unfollow_username)
+    if unfollow_user is None:
+        return text_response(
+            f"Cannot unfollow {unfollow_username} - user does not exist", 404
+        )
+
+    await asyncio.to_thread(unfollow, current_user, unfollow_user)
+    return json_response(request, {"success": True})
+
+
+async def send_bloom(request: Request) -> Response:
+    user = await authenticate(request)
+    if isinstance(user, Response):
+        return user
+    body = await read_request_fields(request, {"content": str})
+    if isinstance(body, Response):
+        return body
+
+    await asyncio.to_thread(add_bloom, sender=user, content=body["content"])
+    return json_response(request, {"success": True})
+
+
+async def get_bloom(request: Request) -> Response:
+    try:
+        id_int = int(request.path_params["id_str"])
+    except ValueError:
+        return text_response("Invalid bloom id", 400)
+
+    # Blooms never change, but may be archived, so a cached copy is only valid while the bloom exists.
+    bloom = await async_blooms.get_bloom(id_int)
+    if bloom is None:
+        return text_response("Bloom not found", 404)
+    return await conditional_response(
+        request,
+        lambda: as_awaitable(json_response(request, bloom)),
+        etag=f"bloom-{id_int}",
+        last_modified=bloom.sent_timestamp,
+        cache_control=IMMUTABLE_CACHE_CONTROL,
+    )
+
+
+async def home_timeline(request: Request) -> Response:
+    current_user = await authenticate(request)
+    if isinstance(current_user, Response):
+        return current_user
+    page_args = get_page_args(request)
+    if isinstance(page_args, Response):
+        return page_args
+    before, limit = page_args
+
+    timeline = await async_blooms.get_home_timeline(
+        current_user, before=before, limit=limit
+    )
+    return paginated_response(request, timeline, limit)
+
+
+async def user_blooms(request: Request) -> Response:
+    page_args = get_page_args(request)
+    if isinstance(page_args, Response):
+        return page_args
+    before, limit = page_args
+    profile_username = request.path_params["profile_username"]
+
+    async def build_page() -> Response:
+        user_blooms = await async_blooms.get_blooms_for_user(
+            profile_username, before=before, limit=limit
+        )
+        return paginated_response(request, user_blooms, limit)
+
+    profile_user = await get_user(profile_username)
+    if profile_user is None:
+        return await build_page()
+
+    stats, archived_at = await asyncio.gather(
+        get_user_stats(profile_user), async_partitions.last_archived_at()
+    )
+    return await conditional_response(
+        request,
+        build_page,
+        etag=make_etag(
+            "blooms",
+            profile_username,
+            stats.bloom_count,
+            stats.last_bloom_timestamp,
+            archived_at,
+            before,
+            limit,
+        ),
+        last_modified=latest(stats.last_bloom_timestamp, archived_at),
+        cache_control=REVALIDATE_CACHE_CONTROL,
+    )
+
+
+async def hashtag(request: Request) -> Response:
+    page_args = get_page_args(request)
+    if isinstance(page_args, Response):
+        return page_args
+    before, limit = page_args
+    hashtag = request.path_params["hashtag"]
+
+    async def build_page() -> Response:
+        hashtag_blooms = await async_blooms.get_blooms_with_hashtag(
+            hashtag, before=before, limit=limit
+        )
+        return paginated_response(request, hashtag_blooms, limit)
+
+    version, archived_at = await asyncio.gather(
+        async_blooms.get_hashtag_version(hashtag),
+        async_partitions.last_archived_at(),
+    )
+    return await conditional_response(
+        request,
+        build_page,
+        etag=make_etag("hashtag", hashtag, version, archived_at, before, limit),
+        last_modified=latest(version.last_modified(), archived_at),
+        cache_control=REVALIDATE_CACHE_CONTROL,
+    )
+
+
+async def as_awaitable(value):
+    return value
+
+
+async def read_request_fields(
+    request: Request, names_to_types: Dict[str, type]
+) -> Union[Response, Dict[str, Any]]:
+    """read_request_fields parses the JSON body, checking it has each field with the expected type."""
+    try:
+        body = await request.json()
+    except json.JSONDecodeError:
+        return text_response("Failed to decode JSON object", 400)
+    error = check_request_fields(body, names_to_types)
+    if error is not None:
+        return text_response(error, 400)
+    return body
+
+
+def get_page_args(request: Request):
+    page_args = parse_page_args(
+        request.query_params.get("before"), request.query_params.get("limit")
+    )
+    if isinstance(page_args, str):
+        return text_response(page_args, 400)
+    return page_args
+
+
+def get_limit_arg(request: Request) -> Union[Response, int]:
+    limit = parse_limit(request.query_params.get("limit"))
+    if isinstance(limit, str):
+        return text_response(limit, 400)
+    return limit
+
+
+def paginated_response(request: Request, page: List[Bloom], limit: int) -> Response:
+    response = json_response(request, page)
+    cursor = next_cursor(page, limit)
+    if cursor is not None:
+        response.headers["Next-Cursor"] = cursor
+    return response
+
+
+def not_modified_response(
+    *, etag: str, last_modified: Optional[datetime.datetime], cache_control: str
+) -> Response:
+    return Response(
+        status_code=304,
+        headers=validator_headers(
+            etag=etag, last_modified=last_modified, cache_control=cache_control
+        ),
+    )
+
+
+async def conditional_response(
+    request: Request,
+    build: Callable[[], Awaitable[Response]],
+    *,
+    etag: str,
+    last_modified: Optional[datetime.datetime],
+    cache_control: str,
+    vary: Optional[str] = None,
+) -> Response:
+    """conditional_response answers 304 if the client's copy is current, only building the body otherwise."""
+    if is_not_modified(
+        etag,
+        last_modified,
+        if_none_match=request.headers.get("If-None-Match"),
+        if_modified_since=request.headers.get("If-Modified-Since"),
+    ):
+        response = not_modified_response(
+            etag=etag, last_modified=last_modified, cache_control=cache_control
+        )
+    else:
+        response = await build()
+        response.headers.update(
+            validator_headers(
+                etag=etag, last_modified=last_modified, cache_control=cache_control
+            )
+        )
+    if vary is not None:
+        response.headers.append("Vary", vary)
+    return response
@@ -0,0 +1,125 @@
+"""Compares requests per second served by the sync (gthread) and async (ASGI) servers at high concurrency.
+
+Start both against the same seeded database (see seed.py), e.g. on two ports:
+  WEB_BIND=0.0.0.0:3000 python3 main.py
+  WEB_BIND=0.0.0.0:3001 python3 main.py --asgi
+then run from the backend directory:
+  python3 -m benchmarks.async_serving --sync-url http://127.0.0.1:3000 --async-url http://127.0.0.1:3001
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from typing import List, Tuple
+
+from loadtest import percentile
+
+import httpx
+
+
+async def log_in(client: httpx.AsyncClient, options, rng: random.Random) -> List[str]:
+    tokens = []
+    for _ in range(options.logins):
+        response = await client.post(
+            "/login",
+            json={
+                "username": f"{options.prefix}{rng.randrange(options.users)}",
+                "password": options.password,
+            },
+        )
+        if response.status_code == 200:
+            tokens.append(response.json()["token"])
+    if not tokens:
+        raise SystemExit(f"Couldn't log in to {client.base_url}; is it seeded?")
+    return tokens
+
+
+def random_request(options, rng: random.Random, tokens: List[str]) -> Tuple[str, dict]:
+    username = f"{options.prefix}{rng.randrange(options.users)}"
+    choice = rng.random()
+    if choice < 0.4:
+        return "/home", {"Authorization": f"Bearer {rng.choice(tokens)}"}
+    if choice < 0.7:
+        return f"/profile/{username}", {}
+    if choice < 0.85:
+        return f"/blooms/{username}", {}
+    return f"/hashtag/topic{rng.randint(1, 50)}", {}
+
+
+async def run_stack(name: str, url: str, options) -> None:
+    rng = random.Random(options.random_seed)
+    limits = httpx.Limits(
+        max_connections=options.concurrency,
+        max_keepalive_connections=options.concurrency,
+    )
+    async with httpx.AsyncClient(
+        base_url=url, limits=limits, timeout=options.timeout
+    ) as client:
+        tokens = await log_in(client, options, rng)
+        latencies: List[float] = []
+        errors = 0
+        deadline = time.monotonic() + options.duration
+
+        async def worker(seed: int):
+            nonlocal errors
+            worker_rng = random.Random(seed)
+            while time.monotonic() < deadline:
+                path, headers = random_request(options, worker_rng, tokens)
+                started = time.perf_counter()
+                try:
+                    response = await client.get(path, headers=headers)
+                    ok = response.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                latencies.append(time.perf_counter() - started)
+                if not ok:
+                    errors += 1
+
+        started = time.monotonic()
+        await asyncio.gather(
+            *(worker(options.random_seed + i) for i in range(options.concurrency))
+        )
+        elapsed = time.monotonic() - started
+
+    latencies.sort()
+    print(
+        f"{name:<6} {len(latencies) / elapsed:>9.1f} req/s  {errors:>6} errors  "
+        + "  ".join(
+            f"p{int(fraction * 100)} {percentile(latencies, fraction) * 1000:>7.1f} ms"
+            for fraction in (0.5, 0.95, 0.99)
+        )
+    )
+
+
+async def run(options) -> None:
+    print(
+        f"{options.concurrency} concurrent clients for {options.duration:g}s per server:"
+    )
+    await run_stack("sync", options.sync_url, options)
+    await run_stack("async", options.async_url, options)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--sync-url", default="http://127.0.0.1:3000")
+    parser.add_argument("--async-url", default="http://127.0.0.1:3001")
+    parser.add_argument("--concurrency", type=int, default=256)
+    parser.add_argument("--duration", type=float, default=30, help="Seconds per server")
+    parser.add_argument(
+        "--users", type=int, default=1000, help="How many users seed.py created"
+    )
+    parser.add_argument(
+        "--logins", type=int, default=20, help="How many users to log in as for /home"
+    )
+    parser.add_argument("--prefix", default="seed")
+    parser.add_argument("--password", default="password")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--random-seed", type=int, default=0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
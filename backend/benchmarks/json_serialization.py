@@ -0,0 +1,73 @@
+"""Compares serializing a large bloom list with CustomJsonProvider's fast path against Flask's default provider.
+
+Run from the backend directory: python3 -m benchmarks.json_serialization
+"""
+
+import argparse
+import datetime
+import timeit
+from unittest import mock
+
+import custom_json_provider
+from custom_json_provider import CustomJsonProvider
+from data.blooms import Bloom
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+
+def make_blooms(count: int):
+    start = datetime.datetime(2025, 1, 1)
+    return [
+        Bloom(
+            id=1735689600000000 + i,
+            sender=f"user{i % 100}",
+            content=f"Bloom number {i} about #topic{i % 50} and some more words to make it realistic",
+            sent_timestamp=start + datetime.timedelta(seconds=i),
+        )
+        for i in range(count)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--blooms", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    app = Flask("Benchmark")
+    blooms = make_blooms(args.blooms)
+
+    # Flask's own provider, with the datetime handling the backend has always used.
+    default = DefaultJSONProvider(app)
+    fast = CustomJsonProvider(app)
+    default.default = fast.default
+
+    compact = {"separators": (",", ":")}
+    expected = DefaultJSONProvider.dumps(default, blooms, **compact)
+    assert fast.dumps(blooms, **compact) == expected
+
+    def measure(name, dumps):
+        seconds = min(timeit.repeat(dumps, number=1, repeat=args.repeat))
+        print(f"{name:<28} {seconds * 1000:8.2f} ms")
+        return seconds
+
+    print(f"Serializing {args.blooms} blooms (best of {args.repeat}):")
+    baseline = measure(
+        "default provider",
+        lambda: DefaultJSONProvider.dumps(default, blooms, **compact),
+    )
+    with mock.patch.object(custom_json_provider, "orjson", None):
+        pure_python = measure(
+            "fast path (pure Python)", lambda: fast.dumps(blooms, **compact)
+        )
+    print(f"  {baseline / pure_python:.1f}x faster")
+    if custom_json_provider.orjson is not None:
+        native = measure("fast path (orjson)", lambda: fast.dumps(blooms, **compact))
+        print(f"  {baseline / native:.1f}x faster")
+    else:
+        print("orjson is not installed; pip install orjson to compare the native path")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Measures /home latency on its own, then during a storm of concurrent logins.
+
+With hashing on its bounded pool, the storm's extra logins are refused with 503 rather
+than taking every CPU, so timeline latency should barely change. Seed the database first
+(see seed.py), start the server, then run from the backend directory, e.g.:
+  python3 -m benchmarks.login_storm --url http://127.0.0.1:3000 --logins 64
+"""
+
+import argparse
+import collections
+import threading
+import time
+from typing import Dict, List
+
+from loadtest import percentile
+
+import requests
+
+
+def log_in(session: requests.Session, options, username: str) -> requests.Response:
+    return session.post(
+        options.url + "/login",
+        json={"username": username, "password": options.password},
+        timeout=options.timeout,
+    )
+
+
+def read_timelines(options, token: str, deadline: float, latencies: List[float]):
+    session = requests.Session()
+    headers = {"Authorization": f"Bearer {token}"}
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        session.get(options.url + "/home", headers=headers, timeout=options.timeout)
+        latencies.append(time.perf_counter() - started)
+
+
+def storm_logins(
+    options, seed: int, deadline: float, outcomes: Dict[int, int], lock: threading.Lock
+):
+    session = requests.Session()
+    i = seed
+    while time.monotonic() < deadline:
+        try:
+            status = log_in(
+                session, options, f"{options.prefix}{i % options.users}"
+            ).status_code
+        except requests.RequestException:
+            status = 0
+        with lock:
+            outcomes[status] += 1
+        i += options.logins
+
+
+def run_phase(name: str, options, tokens: List[str], *, logins: int):
+    deadline = time.monotonic() + options.duration
+    latencies: List[float] = []
+    outcomes: Dict[int, int] = collections.defaultdict(int)
+    lock = threading.Lock()
+    threads = [
+        threading.Thread(
+            target=read_timelines,
+            args=(options, tokens[i % len(tokens)], deadline, latencies),
+        )
+        for i in range(options.readers)
+    ] + [
+        threading.Thread(
+            target=storm_logins, args=(options, i, deadline, outcomes, lock)
+        )
+        for i in range(logins)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    print(
+        f"{name:<10} /home {len(latencies) / options.duration:>7.1f} req/s  "
+        + "  ".join(
+            f"p{int(fraction * 100)} {percentile(latencies, fraction) * 1000:>7.1f} ms"
+            for fraction in (0.5, 0.95, 0.99)
+        )
+    )
+    if outcomes:
+        print(
+            f"{'':<10} /login "
+            + ", ".join(
+                f"{count} {'failed' if status == 0 else status}"
+                for status, count in sorted(outcomes.items())
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--url", default="http://127.0.0.1:3000")
+    parser.add_argument(
+        "--readers", type=int, default=8, help="Clients reading /home throughout"
+    )
+    parser.add_argument(
+        "--logins", type=int, default=64, help="Clients logging in during the storm"
+    )
+    parser.add_argument("--duration", type=float, default=20, help="Seconds per phase")
+    parser.add_argument(
+        "--users", type=int, default=1000, help="How many users seed.py created"
+    )
+    parser.add_argument("--prefix", default="seed")
+    parser.add_argument("--password", default="password")
+    parser.add_argument("--timeout", type=float, default=30)
+    options = parser.parse_args()
+
+    session = requests.Session()
+    tokens = []
+    for i in range(options.readers):
+        response = log_in(session, options, f"{options.prefix}{i % options.users}")
+        if response.status_code != 200:
+            raise SystemExit(f"Couldn't log in to {options.url}; is it seeded?")
+        tokens.append(response.json()["token"])
+
+    run_phase("baseline", options, tokens, logins=0)
+    run_phase("storm", options, tokens, logins=options.logins)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,39 @@
 import datetime
+import json
 import unittest
+from unittest import mock
 
 from flask import Flask
+from flask.json.provider import DefaultJSONProvider
 
+import custom_json_provider
 from custom_json_provider import CustomJsonProvider
+from data.blooms import Bloom
+
+
+def make_blooms():
+    return [
+        Bloom(
+            id=1746102615123456,
+            sender="sample",
+            content='Hi there #blessed "quoted" \\ tab\t',
+            sent_timestamp=datetime.datetime(2025, 5, 1, 12, 30, 15, 123456),
+        ),
+        Bloom(
+            id=2,
+            sender="Swiz",
+            content="New album dropping at midnight! #SwizBiz",
+            sent_timestamp=datetime.datetime(
+                2025, 5, 1, 12, 30, 15, tzinfo=datetime.UTC
+            ),
+        ),
+        Bloom(
+            id=3,
+            sender="AS",
+            content="Caf\u00e9 \U0001f338 marshmallows",
+            sent_timestamp=datetime.datetime(2025, 5, 1, 12, 30, 16),
+        ),
+    ]
 
 
 class TestCustomJsonProvider(unittest.TestCase):
@@ -23,6 +53,54 @@ class TestCustomJsonProvider(unittest.TestCase):
         )
         self.assertEqual(serialised, """{"timestamp": "2020-03-04T14:15:16+00:00"}""")
 
+    def assert_blooms_serialised_like_default(self, blooms):
+        app = Flask("Dummy")
+        fast = CustomJsonProvider(app)
+        default = DefaultJSONProvider(app)
+        default.default = fast.default
+        for kwargs in [{}, {"separators": (",", ":")}, {"indent": 2}]:
+            self.assertEqual(
+                fast.dumps(blooms, **kwargs),
+                DefaultJSONProvider.dumps(default, blooms, **kwargs),
+            )
+
+    def test_bloom_list_matches_default_provider(self):
+        self.assert_blooms_serialised_like_default(make_blooms())
+        self.assert_blooms_serialised_like_default(make_blooms()[:2])
+        self.assert_blooms_serialised_like_default([])
+
+    def test_control_characters_match_default_provider(self):
+        blooms = make_blooms()[:1]
+        blooms[0].content = "a\x7fb"
+        self.assert_blooms_serialised_like_default(blooms)
+
+    def test_bloom_list_matches_default_provider_without_orjson(self):
+        with mock.patch.object(custom_json_provider, "orjson", None):
+            self.assert_blooms_serialised_like_default(make_blooms())
+
+    def test_bloom_response(self):
+        app = Flask("Dummy")
+        app.json = CustomJsonProvider(app)
+        with app.app_context():
+            response = app.json.response(make_blooms())
+        self.assertEqual(
+            json.loads(response.get_data())[:2],
+            [
+                {
+                    "content": make_blooms()[0].content,
+                    "id": 1746102615123456,
+                    "sender": "sample",
+                    "sent_timestamp": "2025-05-01T12:30:15.123456",
+                },
+                {
+                    "content": make_blooms()[1].content,
+                    "id": 2,
+                    "sender": "Swiz",
+                    "sent_timestamp": "2025-05-01T12:30:15+00:00",
+                },
+            ],
+        )
+
 
 if __name__ == "__main__":
     unittest.main()
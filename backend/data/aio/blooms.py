@@ -0,0 +1,69 @@
+from typing import List, Optional
+
+from data import blooms, timelines
+from data.aio.connection import db_cursor
+from data.blooms import Bloom, Cursor, HashtagVersion
+from data.users import User
+
+
+async def get_blooms_for_user(
+    username: str, *, before: Optional[Cursor] = None, limit: Optional[int] = None
+) -> List[Bloom]:
+    """get_blooms_for_user returns a page of blooms sent by username, newest first."""
+    statement, kwargs = blooms.blooms_for_user_query(
+        username, before=before, limit=limit
+    )
+    return await fetch_blooms(statement, kwargs)
+
+
+async def get_home_timeline(
+    user: User, *, before: Optional[Cursor] = None, limit: int
+) -> List[Bloom]:
+    """get_home_timeline returns a page of blooms sent by user or anyone they follow, newest first."""
+    if timelines.fanout_enabled():
+        statement, kwargs = blooms.materialized_home_timeline_query(
+            user, before=before, limit=limit
+        )
+        page = await fetch_blooms(statement, kwargs)
+        # A short page may mean the materialized timeline was trimmed, so only trust full pages.
+        if len(page) == limit:
+            return page
+    statement, kwargs = blooms.merged_home_timeline_query(
+        user, before=before, limit=limit
+    )
+    return await fetch_blooms(statement, kwargs)
+
+
+async def get_bloom(bloom_id: int) -> Optional[Bloom]:
+    async with db_cursor() as cur:
+        await cur.execute(blooms.BLOOM_QUERY, (bloom_id,))
+        row = await cur.fetchone()
+    if row is None:
+        return None
+    return blooms.row_to_bloom(row)
+
+
+async def get_blooms_with_hashtag(
+    hashtag_without_leading_hash: str,
+    *,
+    before: Optional[Cursor] = None,
+    limit: Optional[int] = None,
+) -> List[Bloom]:
+    """get_blooms_with_hashtag returns a page of blooms tagged with the hashtag, newest first."""
+    statement, kwargs = blooms.blooms_with_hashtag_query(
+        hashtag_without_leading_hash, before=before, limit=limit
+    )
+    return await fetch_blooms(statement, kwargs)
+
+
+async def get_hashtag_version(hashtag_without_leading_hash: str) -> HashtagVersion:
+    """get_hashtag_version returns what identifies the current list of blooms with the hashtag."""
+    async with db_cursor() as cur:
+        await cur.execute(blooms.HASHTAG_VERSION_QUERY, (hashtag_without_leading_hash,))
+        return blooms.row_to_hashtag_version(await cur.fetchone())
+
+
+async def fetch_blooms(statement: str, kwargs) -> List[Bloom]:
+    async with db_cursor() as cur:
+        await cur.execute(statement, kwargs)
+        return blooms.rows_to_blooms(await cur.fetchall())
@@ -0,0 +1,80 @@
+"""Async database access for the ASGI app, on psycopg 3's asyncio driver.
+
+Queries use the same SQL, with the same %(name)s placeholders, as the sync data modules.
+Each query checks out its own connection, so queries awaited together run concurrently.
+"""
+
+from contextlib import asynccontextmanager
+import os
+import time
+from typing import Optional
+
+from data import connection, tracing
+
+import psycopg
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
+
+_pool: Optional[AsyncConnectionPool] = None
+
+
+def conninfo() -> str:
+    return psycopg.conninfo.make_conninfo(
+        dbname=os.getenv("POSTGRES_DB"),
+        user=os.getenv("POSTGRES_USER"),
+        password=os.environ["POSTGRES_PASSWORD"],
+        host=os.getenv("POSTGRES_HOST", "127.0.0.1"),
+        port=os.getenv("POSTGRES_PORT"),
+    )
+
+
+async def open_pool():
+    """open_pool creates this process's pool; it must be called from the event loop which will use it."""
+    global _pool
+    if _pool is not None:
+        return
+    pool = AsyncConnectionPool(
+        conninfo(),
+        min_size=int(os.getenv("POSTGRES_POOL_MIN_SIZE", "1")),
+        max_size=int(
+            os.getenv(
+                "POSTGRES_ASYNC_POOL_MAX_SIZE",
+                os.getenv("POSTGRES_POOL_MAX_SIZE", "10"),
+            )
+        ),
+        timeout=float(os.getenv("POSTGRES_POOL_TIMEOUT", "30")),
+        max_lifetime=float(os.getenv("POSTGRES_POOL_MAX_LIFETIME", "3600")),
+        open=False,
+    )
+    # Don't wait for min_size connections, so a database which is down doesn't stop the app starting.
+    await pool.open(wait=False)
+    _pool = pool
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        pool, _pool = _pool, None
+        await pool.close()
+
+
+def get_pool() -> AsyncConnectionPool:
+    if _pool is None:
+        raise RuntimeError("The async connection pool hasn't been opened")
+    return _pool
+
+
+@asynccontextmanager
+async def db_cursor():
+    """db_cursor yields an async cursor in a transaction, which commits if the block finishes without raising.
+
+    Raises connection.PoolTimeoutError if no connection became free in time, like the sync db_cursor.
+    """
+    started = time.perf_counter()
+    try:
+        # The pool's connection context manager commits on success and rolls back on error.
+        async with get_pool().connection() as conn:
+            tracing.record_connection_acquire(time.perf_counter() - started)
+            async with conn.cursor() as cur:
+                yield cur
+    except PoolTimeout as error:
+        raise connection.PoolTimeoutError(str(error)) from error
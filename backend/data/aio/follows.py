@@ -0,0 +1,57 @@
+from typing import List, Optional
+
+from data import follow_graph, follows
+from data.aio.connection import db_cursor
+from data.users import User
+
+
+async def is_following(follower: User, followee: User) -> bool:
+    graph = follow_graph.current_graph()
+    if graph is not None:
+        return graph.is_following(follower.id, followee.id)
+    async with db_cursor() as cur:
+        await cur.execute(follows.IS_FOLLOWING_QUERY, (follower.id, followee.id))
+        return (await cur.fetchone())[0]
+
+
+async def get_followed_usernames(
+    follower: User, *, after: Optional[str] = None, limit: Optional[int] = None
+) -> List[str]:
+    """get_followed_usernames returns a list of usernames follower follows, in username order."""
+    graph = follow_graph.current_graph()
+    if graph is not None:
+        return graph.follows(follower.id, after=after, limit=limit)
+    statement, kwargs = follows.followed_usernames_query(
+        follower, after=after, limit=limit
+    )
+    return await fetch_usernames(statement, kwargs)
+
+
+async def get_inverse_followed_usernames(
+    followee: User, *, after: Optional[str] = None, limit: Optional[int] = None
+) -> List[str]:
+    """get_inverse_followed_usernames returns a list of usernames following followee, in username order."""
+    graph = follow_graph.current_graph()
+    if graph is not None:
+        return graph.followers(followee.id, after=after, limit=limit)
+    statement, kwargs = follows.inverse_followed_usernames_query(
+        followee, after=after, limit=limit
+    )
+    return await fetch_usernames(statement, kwargs)
+
+
+async def get_mutual_follows(
+    user: User, *, after: Optional[str] = None, limit: Optional[int] = None
+) -> List[str]:
+    """get_mutual_follows returns a list of usernames which user follows and which follow user back, in username order."""
+    graph = follow_graph.current_graph()
+    if graph is not None:
+        return graph.mutuals(user.id, after=after, limit=limit)
+    statement, kwargs = follows.mutual_follows_query(user, after=after, limit=limit)
+    return await fetch_usernames(statement, kwargs)
+
+
+async def fetch_usernames(statement: str, kwargs) -> List[str]:
+    async with db_cursor() as cur:
+        await cur.execute(statement, kwargs)
+        return [row[0] for row in await cur.fetchall()]
@@ -0,0 +1,11 @@
+import datetime
+from typing import Optional
+
+from data import partitions
+from data.aio.connection import db_cursor
+
+
+async def last_archived_at() -> Optional[datetime.datetime]:
+    async with db_cursor() as cur:
+        await cur.execute(partitions.LAST_ARCHIVED_QUERY)
+        return (await cur.fetchone())[0]
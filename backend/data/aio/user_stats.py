@@ -0,0 +1,10 @@
+from data import user_stats
+from data.aio.connection import db_cursor
+from data.user_stats import UserStats
+from data.users import User
+
+
+async def get_user_stats(user: User) -> UserStats:
+    async with db_cursor() as cur:
+        await cur.execute(user_stats.USER_STATS_QUERY, (user.id,))
+        return user_stats.row_to_user_stats(await cur.fetchone())
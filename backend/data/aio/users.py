@@ -0,0 +1,22 @@
+from typing import Optional
+
+from data.aio.connection import db_cursor
+from data.cache import MISSING
+from data.users import USER_COLUMNS, User, cache_user, row_to_user, user_cache
+
+
+async def get_user(username: str) -> Optional[User]:
+    # Shares the sync module's cache, so both stacks see the same invalidations.
+    cached = user_cache().get(f"username:{username}")
+    if cached is not MISSING:
+        return cached
+    async with db_cursor() as cur:
+        await cur.execute(
+            f"SELECT {USER_COLUMNS} FROM users WHERE username = %s", (username,)
+        )
+        row = await cur.fetchone()
+    if row is None:
+        return None
+    user = row_to_user(row)
+    cache_user(user)
+    return user
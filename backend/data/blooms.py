@@ -1,13 +1,29 @@
+import base64
+import binascii
 import datetime
 
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
-from data.connection import db_cursor
+from psycopg2.extras import execute_values
+
+from data import ids, live, timelines, trending, user_stats
+from data.cache import cacheable
+from data.connection import db_cursor, db_server_cursor, default_fetch_size
+from data.result_cache import (
+    ARCHIVE_TAG,
+    cached,
+    hashtag_tag,
+    result_cache,
+    user_tag,
+)
 from data.users import User
 
+BLOOM_QUERY = "SELECT blooms.id, users.username, content, send_timestamp FROM blooms INNER JOIN users ON users.id = blooms.sender_id WHERE blooms.id = %s"
 
-@dataclass
+
+@cacheable
+@dataclass(slots=True)
 class Bloom:
     id: int
     sender: User
@@ -15,11 +31,68 @@ class Bloom:
     sent_timestamp: datetime.datetime
 
 
-def add_bloom(*, sender: User, content: str) -> Bloom:
+@dataclass
+class NewBloom:
+    sender: User
+    content: str
+    sent_timestamp: Optional[datetime.datetime] = None
+
+
+@dataclass
+class BulkResult:
+    bloom_id: Optional[int]
+    error: Optional[str] = None
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+@cacheable
+@dataclass(frozen=True)
+class Cursor:
+    """Cursor marks a position in a newest-first list of blooms.
+
+    Pages fetched with before=cursor contain only blooms strictly older than the position.
+    """
+
+    send_timestamp: datetime.datetime
+    bloom_id: int
+
+    @staticmethod
+    def after(bloom: Bloom) -> "Cursor":
+        return Cursor(send_timestamp=bloom.sent_timestamp, bloom_id=bloom.id)
+
+    def encode(self) -> str:
+        raw = f"{self.send_timestamp.isoformat()}|{self.bloom_id}".encode("utf-8")
+        return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+    @staticmethod
+    def decode(encoded: str) -> "Cursor":
+        try:
+            padded = encoded + "=" * (-len(encoded) % 4)
+            raw = base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8")
+            timestamp_str, bloom_id_str = raw.split("|")
+            return Cursor(
+                send_timestamp=datetime.datetime.fromisoformat(timestamp_str),
+                bloom_id=int(bloom_id_str),
+            )
+        except (binascii.Error, UnicodeError, ValueError):
+            raise InvalidCursorError(f"Invalid cursor: {encoded}")
+
+
+def extract_hashtags(content: str) -> List[str]:
+    """extract_hashtags returns the distinct hashtags in content, without their leading #."""
     hashtags = [word[1:] for word in content.split(" ") if word.startswith("#")]
+    return list(dict.fromkeys(hashtags))
 
-    now = datetime.datetime.now(tz=datetime.UTC)
-    bloom_id = int(now.timestamp() * 1000000)
+
+def add_bloom(*, sender: User, content: str) -> Bloom:
+    hashtags = extract_hashtags(content)
+
+    bloom_id = ids.next_id()
+    # Taking the timestamp from the id keeps id order and send order the same.
+    now = ids.timestamp_of(bloom_id)
     with db_cursor() as cur:
         cur.execute(
             "INSERT INTO blooms (id, sender_id, content, send_timestamp) VALUES (%(bloom_id)s, %(sender_id)s, %(content)s, %(timestamp)s)",
@@ -27,110 +100,472 @@ def add_bloom(*, sender: User, content: str) -> Bloom:
                 bloom_id=bloom_id,
                 sender_id=sender.id,
                 content=content,
-                timestamp=datetime.datetime.now(datetime.UTC),
+                timestamp=now,
             ),
         )
-        for hashtag in hashtags:
-            cur.execute(
-                "INSERT INTO hashtags (hashtag, bloom_id) VALUES (%(hashtag)s, %(bloom_id)s)",
-                dict(hashtag=hashtag, bloom_id=bloom_id),
+        if hashtags:
+            execute_values(
+                cur,
+                "INSERT INTO hashtags (hashtag, bloom_id, send_timestamp) VALUES %s",
+                [(hashtag, bloom_id, now) for hashtag in hashtags],
+            )
+        user_stats.record_bloom(cur, sender_id=sender.id, send_timestamp=now)
+        live.publish(cur, [(bloom_id, sender.username)])
+        if timelines.fanout_enabled():
+            timelines.fan_out_bloom(
+                cur, bloom_id=bloom_id, sender_id=sender.id, send_timestamp=now
             )
+    trending.record_hashtags([(hashtag, now) for hashtag in hashtags])
+    result_cache().invalidate(
+        user_tag(sender.username), *[hashtag_tag(hashtag) for hashtag in hashtags]
+    )
+    return Bloom(
+        id=bloom_id,
+        sender=sender.username,
+        content=content,
+        sent_timestamp=now,
+    )
+
+
+def add_blooms_bulk(new_blooms: List[NewBloom]) -> List[BulkResult]:
+    """add_blooms_bulk inserts many blooms in one transaction, using multi-row inserts.
 
+    It returns one result per bloom, in order. A bloom which can't be inserted gets an
+    error rather than failing the rest of the batch.
+    """
+    now = datetime.datetime.now(tz=datetime.UTC)
+    bloom_rows = []
+    hashtag_rows = []
+    for new_bloom in new_blooms:
+        bloom_id = ids.next_id()
+        sent_timestamp = new_bloom.sent_timestamp or now
+        bloom_rows.append(
+            (bloom_id, new_bloom.sender.id, new_bloom.content, sent_timestamp)
+        )
+        for hashtag in extract_hashtags(new_bloom.content):
+            hashtag_rows.append((hashtag, bloom_id, sent_timestamp))
 
+    with db_cursor() as cur:
+        # Ids only collide if two processes share a worker id; those rows are skipped and reported.
+        # Uniqueness can only be enforced per partition, so only collisions sent at the same time are caught.
+        inserted = execute_values(
+            cur,
+            """INSERT INTO blooms (id, sender_id, content, send_timestamp) VALUES %s
+            ON CONFLICT (id, send_timestamp) DO NOTHING
+            RETURNING id""",
+            bloom_rows,
+            page_size=1000,
+            fetch=True,
+        )
+        inserted_ids = {row[0] for row in inserted}
+
+        inserted_hashtag_rows = [row for row in hashtag_rows if row[1] in inserted_ids]
+        if inserted_hashtag_rows:
+            execute_values(
+                cur,
+                "INSERT INTO hashtags (hashtag, bloom_id, send_timestamp) VALUES %s",
+                inserted_hashtag_rows,
+                page_size=1000,
+            )
+
+        user_stats.record_blooms(
+            cur,
+            [
+                (sender_id, sent_timestamp)
+                for bloom_id, sender_id, _, sent_timestamp in bloom_rows
+                if bloom_id in inserted_ids
+            ],
+        )
+        live.publish(
+            cur,
+            [
+                (bloom_id, new_bloom.sender.username)
+                for (bloom_id, *_), new_bloom in zip(bloom_rows, new_blooms)
+                if bloom_id in inserted_ids
+            ],
+        )
+        if timelines.fanout_enabled() and inserted_ids:
+            timelines.fan_out_blooms(cur, list(inserted_ids))
+
+    trending.record_hashtags(
+        (hashtag, sent_timestamp)
+        for hashtag, _, sent_timestamp in inserted_hashtag_rows
+    )
+    result_cache().invalidate(
+        *{user_tag(new_bloom.sender.username) for new_bloom in new_blooms},
+        *{hashtag_tag(row[0]) for row in inserted_hashtag_rows},
+    )
+    return [
+        (
+            BulkResult(bloom_id=row[0])
+            if row[0] in inserted_ids
+            else BulkResult(bloom_id=None, error="Bloom id collided, please retry")
+        )
+        for row in bloom_rows
+    ]
+
+
+@cached(lambda username, **kwargs: [user_tag(username), ARCHIVE_TAG])
 def get_blooms_for_user(
-    username: str, *, before: Optional[int] = None, limit: Optional[int] = None
+    username: str, *, before: Optional[Cursor] = None, limit: Optional[int] = None
 ) -> List[Bloom]:
-    with db_cursor() as cur:
-        kwargs = {
-            "sender_username": username,
-        }
-        if before is not None:
-            before_clause = "AND send_timestamp < %(before_limit)s"
-            kwargs["before_limit"] = before
-        else:
-            before_clause = ""
+    """get_blooms_for_user returns a page of blooms sent by username, newest first."""
+    statement, kwargs = blooms_for_user_query(username, before=before, limit=limit)
+    with db_cursor(read_only=True) as cur:
+        cur.execute(statement, kwargs)
+        return rows_to_blooms(cur.fetchall())
 
-        limit_clause = make_limit_clause(limit, kwargs)
 
-        cur.execute(
-            f"""SELECT
+def iter_blooms_for_user(
+    username: str, *, fetch_size: Optional[int] = None
+) -> Iterator[Bloom]:
+    """iter_blooms_for_user yields every bloom sent by username, newest first, fetching fetch_size at a time.
+
+    Each page is read in its own short transaction, starting after the last bloom of the one
+    before, so a slow reader holds neither a connection nor an old snapshot between pages.
+    """
+    limit = fetch_size or default_fetch_size()
+    before = None
+    while True:
+        statement, kwargs = blooms_for_user_query(username, before=before, limit=limit)
+        with db_cursor(read_only=True) as cur:
+            cur.execute(statement, kwargs)
+            page = rows_to_blooms(cur.fetchall())
+        yield from page
+        if len(page) < limit:
+            return
+        before = Cursor.after(page[-1])
+
+
+def blooms_for_user_query(
+    username: str, *, before: Optional[Cursor], limit: Optional[int]
+) -> Tuple[str, Dict[str, Any]]:
+    kwargs = {
+        "sender_username": username,
+    }
+    before_clause = make_before_clause(before, kwargs)
+    limit_clause = make_limit_clause(limit, kwargs)
+    statement = f"""SELECT
               blooms.id, users.username, content, send_timestamp
             FROM
               blooms INNER JOIN users ON users.id = blooms.sender_id
             WHERE
               username = %(sender_username)s
               {before_clause}
-            ORDER BY send_timestamp DESC
+            ORDER BY send_timestamp DESC, blooms.id DESC
             {limit_clause}
-            """,
-            kwargs,
-        )
-        rows = cur.fetchall()
-        blooms = []
-        for row in rows:
-            bloom_id, sender_username, content, timestamp = row
-            blooms.append(
-                Bloom(
-                    id=bloom_id,
-                    sender=sender_username,
-                    content=content,
-                    sent_timestamp=timestamp,
+            """
+    return statement, kwargs
+
+
+def get_home_timeline(
+    user: User, *, before: Optional[Cursor] = None, limit: int
+) -> List[Bloom]:
+    """get_home_timeline returns a page of blooms sent by user or anyone they follow, newest first."""
+    if timelines.fanout_enabled():
+        page = get_materialized_home_timeline(user, before=before, limit=limit)
+        # A short page may mean the materialized timeline was trimmed, so only trust full pages.
+        if len(page) == limit:
+            return page
+    return get_merged_home_timeline(user, before=before, limit=limit)
+
+
+def get_merged_home_timeline(
+    user: User, *, before: Optional[Cursor] = None, limit: int
+) -> List[Bloom]:
+    """get_merged_home_timeline builds a home timeline page from the blooms and follows tables."""
+    statement, kwargs = merged_home_timeline_query(user, before=before, limit=limit)
+    with db_cursor(read_only=True) as cur:
+        cur.execute(statement, kwargs)
+        return rows_to_blooms(cur.fetchall())
+
+
+def merged_home_timeline_query(
+    user: User, *, before: Optional[Cursor], limit: int
+) -> Tuple[str, Dict[str, Any]]:
+    kwargs = {
+        "user_id": user.id,
+    }
+    before_clause = make_before_clause(before, kwargs)
+    limit_clause = make_limit_clause(limit, kwargs)
+    # Only the page's senders are looked up, rather than every sender's blooms being joined to users.
+    statement = f"""SELECT
+              page.id, users.username, content, send_timestamp
+            FROM
+              (
+                SELECT id, sender_id, content, send_timestamp FROM blooms
+                WHERE
+                  sender_id = ANY(
+                    ARRAY(SELECT followee FROM follows WHERE follower = %(user_id)s) || %(user_id)s
+                  )
+                  {before_clause}
+                ORDER BY send_timestamp DESC, id DESC
+                {limit_clause}
+              ) AS page
+              INNER JOIN users ON users.id = page.sender_id
+            ORDER BY send_timestamp DESC, page.id DESC
+            """
+    return statement, kwargs
+
+
+def get_materialized_home_timeline(
+    user: User, *, before: Optional[Cursor] = None, limit: int
+) -> List[Bloom]:
+    """get_materialized_home_timeline reads a home timeline page from the fan-out-on-write store.
+
+    Blooms from followed users who have too many followers to fan out to are merged in here.
+    """
+    statement, kwargs = materialized_home_timeline_query(
+        user, before=before, limit=limit
+    )
+    with db_cursor(read_only=True) as cur:
+        cur.execute(statement, kwargs)
+        return rows_to_blooms(cur.fetchall())
+
+
+def materialized_home_timeline_query(
+    user: User, *, before: Optional[Cursor], limit: int
+) -> Tuple[str, Dict[str, Any]]:
+    kwargs = {
+        "user_id": user.id,
+        "max_followers": timelines.fanout_max_followers(),
+    }
+    timeline_before_clause = make_before_clause(
+        before, kwargs, columns="send_timestamp, bloom_id"
+    )
+    before_clause = make_before_clause(before, kwargs)
+    limit_clause = make_limit_clause(limit, kwargs)
+    # Joining on send_timestamp as well as id lets each bloom be read from just its own partition.
+    statement = f"""SELECT
+              blooms.id, users.username, content, blooms.send_timestamp
+            FROM
+              (
+                (
+                  SELECT bloom_id, send_timestamp FROM home_timeline
+                  WHERE user_id = %(user_id)s {timeline_before_clause}
+                  ORDER BY send_timestamp DESC, bloom_id DESC
+                  {limit_clause}
                 )
-            )
-    return blooms
+                UNION
+                (
+                  SELECT blooms.id, blooms.send_timestamp FROM blooms
+                  WHERE
+                    sender_id IN (
+                      SELECT followee FROM follows
+                      WHERE
+                        follower = %(user_id)s
+                        AND followee IN (SELECT user_id FROM user_stats WHERE follower_count > %(max_followers)s)
+                    )
+                    {before_clause}
+                  ORDER BY send_timestamp DESC, blooms.id DESC
+                  {limit_clause}
+                )
+              ) AS page (bloom_id, send_timestamp)
+              INNER JOIN blooms ON blooms.id = page.bloom_id AND blooms.send_timestamp = page.send_timestamp
+              INNER JOIN users ON users.id = blooms.sender_id
+            ORDER BY blooms.send_timestamp DESC, blooms.id DESC
+            {limit_clause}
+            """
+    return statement, kwargs
 
 
 def get_bloom(bloom_id: int) -> Optional[Bloom]:
-    with db_cursor() as cur:
-        cur.execute(
-            "SELECT blooms.id, users.username, content, send_timestamp FROM blooms INNER JOIN users ON users.id = blooms.sender_id WHERE blooms.id = %s",
-            (bloom_id,),
-        )
+    with db_cursor(read_only=True) as cur:
+        cur.execute(BLOOM_QUERY, (bloom_id,))
         row = cur.fetchone()
         if row is None:
             return None
-        bloom_id, sender_username, content, timestamp = row
-        return Bloom(
-            id=bloom_id,
-            sender=sender_username,
-            content=content,
-            sent_timestamp=timestamp,
+        return row_to_bloom(row)
+
+
+def get_blooms_by_id(bloom_ids: List[int]) -> List[Bloom]:
+    """get_blooms_by_id returns the blooms with the given ids which exist, in id order."""
+    with db_cursor() as cur:
+        cur.execute(
+            "SELECT blooms.id, users.username, content, send_timestamp FROM blooms INNER JOIN users ON users.id = blooms.sender_id WHERE blooms.id = ANY(%s) ORDER BY blooms.id",
+            (bloom_ids,),
+        )
+        return rows_to_blooms(cur.fetchall())
+
+
+def get_home_blooms_after(user: User, after_id: int, *, limit: int) -> List[Bloom]:
+    """get_home_blooms_after returns blooms for user's home timeline with ids after after_id, oldest first.
+
+    Ids increase as blooms are sent, so this is everything sent since the bloom after_id.
+    """
+    with db_cursor() as cur:
+        cur.execute(
+            """SELECT
+              blooms.id, users.username, content, send_timestamp
+            FROM
+              blooms INNER JOIN users ON users.id = blooms.sender_id
+            WHERE
+              blooms.sender_id = ANY(ARRAY(SELECT followee FROM follows WHERE follower = %(user_id)s) || %(user_id)s)
+              AND blooms.id > %(after_id)s
+            ORDER BY blooms.id
+            LIMIT %(limit)s
+            """,
+            dict(user_id=user.id, after_id=after_id, limit=limit),
         )
+        return rows_to_blooms(cur.fetchall())
 
 
+@cached(
+    lambda hashtag_without_leading_hash, **kwargs: [
+        hashtag_tag(hashtag_without_leading_hash),
+        ARCHIVE_TAG,
+    ]
+)
 def get_blooms_with_hashtag(
-    hashtag_without_leading_hash: str, *, limit: int = None
+    hashtag_without_leading_hash: str,
+    *,
+    before: Optional[Cursor] = None,
+    limit: Optional[int] = None,
 ) -> List[Bloom]:
+    """get_blooms_with_hashtag returns a page of blooms tagged with the hashtag, newest first."""
+    statement, kwargs = blooms_with_hashtag_query(
+        hashtag_without_leading_hash, before=before, limit=limit
+    )
+    with db_cursor(read_only=True) as cur:
+        cur.execute(statement, kwargs)
+        return rows_to_blooms(cur.fetchall())
+
+
+def iter_blooms_with_hashtag(
+    hashtag_without_leading_hash: str, *, fetch_size: Optional[int] = None
+) -> Iterator[Bloom]:
+    """iter_blooms_with_hashtag yields every bloom tagged with the hashtag, newest first, fetching fetch_size at a time."""
+    statement, kwargs = blooms_with_hashtag_query(
+        hashtag_without_leading_hash, before=None, limit=None
+    )
+    with db_server_cursor(read_only=True, fetch_size=fetch_size) as cur:
+        cur.execute(statement, kwargs)
+        for row in cur:
+            yield row_to_bloom(row)
+
+
+def blooms_with_hashtag_query(
+    hashtag_without_leading_hash: str,
+    *,
+    before: Optional[Cursor],
+    limit: Optional[int],
+) -> Tuple[str, Dict[str, Any]]:
     kwargs = {
         "hashtag_without_leading_hash": hashtag_without_leading_hash,
     }
+    before_clause = make_before_clause(
+        before, kwargs, columns="send_timestamp, bloom_id"
+    )
     limit_clause = make_limit_clause(limit, kwargs)
-    with db_cursor() as cur:
-        cur.execute(
-            f"""SELECT
+    # Taking the page from the hashtags index before joining means only its blooms are read,
+    # rather than joining every bloom and sorting.
+    statement = f"""SELECT
+              blooms.id, users.username, content, blooms.send_timestamp
+            FROM
+              (
+                SELECT bloom_id, send_timestamp FROM hashtags
+                WHERE hashtag = %(hashtag_without_leading_hash)s {before_clause}
+                ORDER BY send_timestamp DESC, bloom_id DESC
+                {limit_clause}
+              ) AS page
+              INNER JOIN blooms ON blooms.id = page.bloom_id AND blooms.send_timestamp = page.send_timestamp
+              INNER JOIN users ON users.id = blooms.sender_id
+            ORDER BY page.send_timestamp DESC, page.bloom_id DESC
+            """
+    return statement, kwargs
+
+
+def iter_all_blooms(*, fetch_size: Optional[int] = None) -> Iterator[Bloom]:
+    """iter_all_blooms yields every bloom, oldest first, fetching fetch_size at a time."""
+    with db_server_cursor(read_only=True, fetch_size=fetch_size) as cur:
+        cur.execute("""SELECT
               blooms.id, users.username, content, send_timestamp
             FROM
-              blooms INNER JOIN hashtags ON blooms.id = hashtags.bloom_id INNER JOIN users ON blooms.sender_id = users.id
-            WHERE
-              hashtag = %(hashtag_without_leading_hash)s
-            ORDER BY send_timestamp DESC
-            {limit_clause}
-            """,
-            kwargs,
+              blooms INNER JOIN users ON users.id = blooms.sender_id
+            ORDER BY blooms.id
+            """)
+        for row in cur:
+            yield row_to_bloom(row)
+
+
+HASHTAG_VERSION_QUERY = """SELECT count(*), max(send_timestamp), max(bloom_id) FROM hashtags
+            WHERE hashtag = %s"""
+
+
+@cacheable
+@dataclass(frozen=True)
+class HashtagVersion:
+    """HashtagVersion identifies the current list of blooms with a hashtag, for conditional requests.
+
+    Backdated blooms are added below the newest, so the count is needed as well.
+    """
+
+    bloom_count: int
+    newest_timestamp: Optional[datetime.datetime]
+    # Ids are generated when blooms are added, so the largest is the latest added, however backdated.
+    last_bloom_id: Optional[int]
+
+    def last_modified(self) -> Optional[datetime.datetime]:
+        if self.last_bloom_id is None:
+            return None
+        return max(
+            self.newest_timestamp.replace(tzinfo=datetime.UTC),
+            ids.timestamp_of(self.last_bloom_id),
         )
-        rows = cur.fetchall()
-        blooms = []
-        for row in rows:
-            bloom_id, sender_username, content, timestamp = row
-            blooms.append(
-                Bloom(
-                    id=bloom_id,
-                    sender=sender_username,
-                    content=content,
-                    sent_timestamp=timestamp,
-                )
-            )
-    return blooms
+
+
+def row_to_hashtag_version(row) -> HashtagVersion:
+    bloom_count, newest_timestamp, last_bloom_id = row
+    return HashtagVersion(
+        bloom_count=bloom_count,
+        newest_timestamp=newest_timestamp,
+        last_bloom_id=last_bloom_id,
+    )
+
+
+@cached(
+    lambda hashtag_without_leading_hash: [
+        hashtag_tag(hashtag_without_leading_hash),
+        ARCHIVE_TAG,
+    ]
+)
+def get_hashtag_version(hashtag_without_leading_hash: str) -> HashtagVersion:
+    """get_hashtag_version returns what identifies the current list of blooms with the hashtag."""
+    with db_cursor(read_only=True) as cur:
+        cur.execute(HASHTAG_VERSION_QUERY, (hashtag_without_leading_hash,))
+        return row_to_hashtag_version(cur.fetchone())
+
+
+def rows_to_blooms(rows) -> List[Bloom]:
+    return [row_to_bloom(row) for row in rows]
+
+
+def row_to_bloom(row) -> Bloom:
+    bloom_id, sender_username, content, timestamp = row
+    return Bloom(
+        id=bloom_id,
+        sender=sender_username,
+        content=content,
+        sent_timestamp=timestamp,
+    )
+
+
+def make_before_clause(
+    before: Optional[Cursor],
+    kwargs: Dict[Any, Any],
+    *,
+    columns: str = "send_timestamp, blooms.id",
+) -> str:
+    """make_before_clause filters to rows whose (timestamp, id) columns sort before the cursor."""
+    if before is not None:
+        # The planner can't prune partitions using the row comparison alone.
+        timestamp_column = columns.split(",")[0]
+        before_clause = f"AND {timestamp_column} <= %(before_timestamp)s AND ({columns}) < (%(before_timestamp)s, %(before_id)s)"
+        kwargs["before_timestamp"] = before.send_timestamp
+        kwargs["before_id"] = before.bloom_id
+    else:
+        before_clause = ""
+    return before_clause
 
 
 def make_limit_clause(limit: Optional[int], kwargs: Dict[Any, Any]) -> str:
@@ -0,0 +1,81 @@
+from contextlib import contextmanager
+import datetime
+import unittest
+from unittest import mock
+
+from data import blooms
+from data.blooms import Cursor, InvalidCursorError, extract_hashtags
+
+
+class TestCursor(unittest.TestCase):
+    def test_round_trip(self):
+        cursor = Cursor(
+            send_timestamp=datetime.datetime(2025, 5, 1, 12, 30, 15, 123456),
+            bloom_id=1746102615123456,
+        )
+        self.assertEqual(Cursor.decode(cursor.encode()), cursor)
+
+    def test_encoding_is_url_safe(self):
+        encoded = Cursor(
+            send_timestamp=datetime.datetime(2025, 5, 1), bloom_id=42
+        ).encode()
+        self.assertRegex(encoded, r"^[A-Za-z0-9_-]+$")
+
+    def test_rejects_garbage(self):
+        for encoded in ["", "not a cursor", "bm9waXBl"]:
+            with self.assertRaises(InvalidCursorError):
+                Cursor.decode(encoded)
+
+
+class TestExtractHashtags(unittest.TestCase):
+    def test_extracts_distinct_hashtags_in_order(self):
+        self.assertEqual(
+            extract_hashtags("#purple is #great, #purple #forest"),
+            ["purple", "great,", "forest"],
+        )
+
+    def test_no_hashtags(self):
+        self.assertEqual(extract_hashtags("no tags here"), [])
+
+
+class PagingCursor:
+    """PagingCursor answers each query with the next page of rows, remembering the queries' arguments."""
+
+    def __init__(self, pages):
+        self.pages = list(pages)
+        self.args = []
+
+    def execute(self, query, args=None):
+        self.args.append(args)
+
+    def fetchall(self):
+        return self.pages.pop(0)
+
+
+class TestIterBloomsForUser(unittest.TestCase):
+    def test_pages_in_separate_transactions(self):
+        sent = datetime.datetime(2025, 5, 1)
+        rows = [
+            (bloom_id, "ada", "Hello", sent - datetime.timedelta(minutes=bloom_id))
+            for bloom_id in range(1, 6)
+        ]
+        cursor = PagingCursor([rows[:2], rows[2:4], rows[4:]])
+        transactions = []
+
+        @contextmanager
+        def fake_db_cursor(*, read_only=False):
+            transactions.append(read_only)
+            yield cursor
+
+        with mock.patch.object(blooms, "db_cursor", fake_db_cursor):
+            exported = list(blooms.iter_blooms_for_user("ada", fetch_size=2))
+
+        self.assertEqual([bloom.id for bloom in exported], [1, 2, 3, 4, 5])
+        self.assertEqual(transactions, [True, True, True])
+        self.assertNotIn("before_id", cursor.args[0])
+        self.assertEqual(cursor.args[1]["before_id"], 2)
+        self.assertEqual(cursor.args[2]["before_id"], 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
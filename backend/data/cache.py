@@ -0,0 +1,195 @@
+import base64
+from collections import OrderedDict
+import dataclasses
+from dataclasses import dataclass
+import datetime
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+# MISSING is returned by cache lookups which found nothing, so that None can be cached.
+MISSING = object()
+
+# The dataclasses shared caches can store, by name. Decoding an entry can only ever build these.
+_CACHEABLE_TYPES: Dict[str, type] = {}
+
+
+def cacheable(cls):
+    """cacheable registers a dataclass as one whose instances shared caches can store."""
+    _CACHEABLE_TYPES[cls.__name__] = cls
+    return cls
+
+
+def encode_entry(value: Any) -> bytes:
+    """encode_entry serializes a cache entry to JSON, raising TypeError for types it doesn't know."""
+    return json.dumps(_to_json(value), separators=(",", ":")).encode("utf-8")
+
+
+def decode_entry(raw: bytes) -> Any:
+    return _from_json(json.loads(raw))
+
+
+def _to_json(value: Any) -> Any:
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, list):
+        return [_to_json(item) for item in value]
+    if isinstance(value, tuple):
+        return {"tuple": [_to_json(item) for item in value]}
+    if isinstance(value, datetime.datetime):
+        return {"datetime": value.isoformat()}
+    if isinstance(value, bytes):
+        return {"bytes": base64.b64encode(value).decode("ascii")}
+    name = type(value).__name__
+    if _CACHEABLE_TYPES.get(name) is type(value):
+        return {
+            "type": name,
+            "fields": {
+                field.name: _to_json(getattr(value, field.name))
+                for field in dataclasses.fields(value)
+            },
+        }
+    raise TypeError(f"{name} values can't be cached; see data.cache.cacheable")
+
+
+def _from_json(value: Any) -> Any:
+    if isinstance(value, list):
+        return [_from_json(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if "tuple" in value:
+        return tuple(_from_json(item) for item in value["tuple"])
+    if "datetime" in value:
+        return datetime.datetime.fromisoformat(value["datetime"])
+    if "bytes" in value:
+        return base64.b64decode(value["bytes"])
+    fields = {name: _from_json(field) for name, field in value["fields"].items()}
+    return _CACHEABLE_TYPES[value["type"]](**fields)
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class LocalCache:
+    """LocalCache is a thread-safe, in-process LRU cache whose entries expire after ttl seconds."""
+
+    def __init__(
+        self,
+        *,
+        max_entries: int,
+        ttl: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        # Maps key to (expires_at, value), least recently used first.
+        self._entries = OrderedDict()
+        self._stats = CacheStats()
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats.misses += 1
+                return MISSING
+            expires_at, value = entry
+            if expires_at <= self._clock():
+                del self._entries[key]
+                self._stats.misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self._stats.hits += 1
+            return value
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(
+                hits=self._stats.hits,
+                misses=self._stats.misses,
+                evictions=self._stats.evictions,
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+class RedisCache:
+    """RedisCache stores entries in Redis, so that every worker process shares them.
+
+    Entries are stored as JSON rather than pickled, so anyone able to write to Redis can't
+    make workers run code; only the types marked cacheable can be stored. Eviction is left to Redis' own maxmemory policy, so evictions are not counted.
+    """
+
+    def __init__(self, *, url: str, prefix: str, ttl: float):
+        # redis is only needed when a shared cache is configured.
+        import redis
+
+        self._client = redis.Redis.from_url(url)
+        self._prefix = prefix
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._stats = CacheStats()
+
+    def get(self, key: str) -> Any:
+        raw = self._client.get(self._prefix + key)
+        with self._lock:
+            if raw is None:
+                self._stats.misses += 1
+                return MISSING
+            self._stats.hits += 1
+        return decode_entry(raw)
+
+    def set(self, key: str, value: Any):
+        self._client.set(
+            self._prefix + key, encode_entry(value), px=int(self.ttl * 1000)
+        )
+
+    def delete(self, key: str):
+        self._client.delete(self._prefix + key)
+
+    def clear(self):
+        keys = list(self._client.scan_iter(match=self._prefix + "*"))
+        if keys:
+            self._client.delete(*keys)
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(hits=self._stats.hits, misses=self._stats.misses)
+
+
+def make_cache(name: str, *, max_entries: int, ttl: float):
+    """make_cache returns a cache shared between processes if CACHE_REDIS_URL is set, or an in-process one otherwise."""
+    redis_url: Optional[str] = os.getenv("CACHE_REDIS_URL")
+    if redis_url:
+        return RedisCache(url=redis_url, prefix=f"purpleforest:{name}:", ttl=ttl)
+    return LocalCache(max_entries=max_entries, ttl=ttl)
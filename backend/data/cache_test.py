@@ -0,0 +1,97 @@
+import datetime
+import unittest
+
+from data.blooms import Bloom, Cursor
+from data.cache import MISSING, LocalCache, decode_entry, encode_entry
+from data.passwords import ScryptParams
+from data.user_stats import UserStats
+from data.users import User
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestLocalCache(unittest.TestCase):
+    def test_get_and_set(self):
+        cache = LocalCache(max_entries=10, ttl=60)
+        self.assertIs(cache.get("a"), MISSING)
+        cache.set("a", None)
+        self.assertIsNone(cache.get("a"))
+        stats = cache.stats()
+        self.assertEqual((stats.hits, stats.misses), (1, 1))
+        self.assertEqual(stats.hit_rate, 0.5)
+
+    def test_evicts_least_recently_used(self):
+        cache = LocalCache(max_entries=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIs(cache.get("b"), MISSING)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.stats().evictions, 1)
+
+    def test_entries_expire(self):
+        clock = FakeClock()
+        cache = LocalCache(max_entries=10, ttl=5, clock=clock)
+        cache.set("a", 1)
+        clock.now = 4.9
+        self.assertEqual(cache.get("a"), 1)
+        clock.now = 5
+        self.assertIs(cache.get("a"), MISSING)
+        self.assertEqual(len(cache), 0)
+
+    def test_delete(self):
+        cache = LocalCache(max_entries=10, ttl=60)
+        cache.set("a", 1)
+        cache.delete("a")
+        cache.delete("missing")
+        self.assertIs(cache.get("a"), MISSING)
+
+
+class TestEntryEncoding(unittest.TestCase):
+    def round_trip(self, value):
+        return decode_entry(encode_entry(value))
+
+    def test_cached_types_round_trip(self):
+        sent = datetime.datetime(2025, 5, 1, 12, 30, 15, 123456)
+        values = [
+            None,
+            True,
+            "version:abc",
+            ["ada", "bo"],
+            (1, "two"),
+            User(
+                id=1,
+                username="ada",
+                password_salt=b"\x00\xff",
+                password_scrypt=b"hash",
+                password_params=ScryptParams(n=2**15, r=8, p=1),
+            ),
+            [Bloom(id=42, sender="ada", content="Hello #purple", sent_timestamp=sent)],
+            Cursor(send_timestamp=sent, bloom_id=42),
+            UserStats(
+                bloom_count=3,
+                follower_count=2,
+                following_count=1,
+                last_bloom_timestamp=None,
+            ),
+        ]
+        for value in values:
+            self.assertEqual(self.round_trip(value), value)
+
+    def test_refuses_unregistered_types(self):
+        with self.assertRaises(TypeError):
+            encode_entry(object())
+        with self.assertRaises(TypeError):
+            encode_entry({"a": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
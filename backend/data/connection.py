@@ -1,16 +1,521 @@
+from collections import deque
 from contextlib import contextmanager
+import functools
+import itertools
+import math
 import os
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+from data import tracing
+
+from flask import Flask, Response, g, has_app_context, has_request_context, request
 import psycopg2
+import psycopg2.extensions
 
+STICKY_COOKIE = "read_primary_until"
 
-@contextmanager
-def db_cursor():
-    with psycopg2.connect(
+
+class PoolTimeoutError(Exception):
+    """PoolTimeoutError is raised when no connection became free within the pool's timeout."""
+
+
+class ConnectionPool:
+    """ConnectionPool is a thread-safe pool of reusable database connections.
+
+    Idle connections which haven't been used for health_check_after seconds are
+    pinged before being handed out, and connections older than max_lifetime
+    seconds are closed rather than reused.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], psycopg2.extensions.connection],
+        *,
+        min_size: int = 1,
+        max_size: int = 10,
+        timeout: float = 30.0,
+        max_lifetime: float = 3600.0,
+        health_check_after: float = 30.0,
+    ):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(
+                f"Invalid pool size: min_size={min_size}, max_size={max_size}"
+            )
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.health_check_after = health_check_after
+
+        self._condition = threading.Condition()
+        # Each idle entry is (connection, created_at, last_used_at).
+        self._idle = deque()
+        self._created_at = {}
+        self._size = 0
+        self._closed = False
+
+        for _ in range(min_size):
+            conn = self._open()
+            self._idle.append((conn, self._created_at[id(conn)], time.monotonic()))
+
+    def getconn(self) -> psycopg2.extensions.connection:
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._condition:
+                while not self._idle and self._size >= self.max_size:
+                    if self._closed:
+                        raise PoolTimeoutError("Connection pool is closed")
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeoutError(
+                            f"No database connection became available within {self.timeout}s"
+                        )
+                    self._condition.wait(remaining)
+                if self._closed:
+                    raise PoolTimeoutError("Connection pool is closed")
+                if self._idle:
+                    conn, created_at, last_used = self._idle.pop()
+                else:
+                    conn = None
+                    # Reserve the slot before connecting outside the lock.
+                    self._size += 1
+
+            if conn is None:
+                try:
+                    return self._open(reserved=True)
+                except Exception:
+                    self._release_slot()
+                    raise
+
+            if self._is_usable(conn, created_at, last_used):
+                return conn
+            self._discard(conn)
+
+    def putconn(self, conn: psycopg2.extensions.connection, *, discard: bool = False):
+        if not discard and not conn.closed:
+            try:
+                if (
+                    conn.get_transaction_status()
+                    != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+                ):
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+        created_at = self._created_at.get(id(conn), 0.0)
+        now = time.monotonic()
+        if (
+            discard
+            or conn.closed
+            or self._closed
+            or now - created_at > self.max_lifetime
+        ):
+            self._discard(conn)
+            return
+        with self._condition:
+            self._idle.append((conn, created_at, now))
+            self._condition.notify()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._condition.notify_all()
+        for conn, _, _ in idle:
+            self._discard(conn)
+
+    @property
+    def size(self) -> int:
+        with self._condition:
+            return self._size
+
+    @property
+    def idle_count(self) -> int:
+        with self._condition:
+            return len(self._idle)
+
+    def _open(self, *, reserved: bool = False) -> psycopg2.extensions.connection:
+        if not reserved:
+            with self._condition:
+                self._size += 1
+        try:
+            conn = self._connect()
+        except Exception:
+            if not reserved:
+                self._release_slot()
+            raise
+        self._created_at[id(conn)] = time.monotonic()
+        return conn
+
+    def _is_usable(self, conn, created_at: float, last_used: float) -> bool:
+        now = time.monotonic()
+        if conn.closed or now - created_at > self.max_lifetime:
+            return False
+        if now - last_used > self.health_check_after:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+            except psycopg2.Error:
+                return False
+        return True
+
+    def _discard(self, conn):
+        self._created_at.pop(id(conn), None)
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        self._release_slot()
+
+    def _release_slot(self):
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def connect() -> psycopg2.extensions.connection:
+    return psycopg2.connect(
         dbname=os.getenv("POSTGRES_DB"),
         user=os.getenv("POSTGRES_USER"),
         password=os.environ["POSTGRES_PASSWORD"],
         host=os.getenv("POSTGRES_HOST", "127.0.0.1"),
         port=os.getenv("POSTGRES_PORT"),
-    ) as conn:
-        with conn.cursor() as cur:
-            yield cur
+    )
+
+
+def make_pool(
+    connect: Callable[[], psycopg2.extensions.connection], *, min_size: int
+) -> ConnectionPool:
+    return ConnectionPool(
+        connect,
+        min_size=min_size,
+        max_size=int(os.getenv("POSTGRES_POOL_MAX_SIZE", "10")),
+        timeout=float(os.getenv("POSTGRES_POOL_TIMEOUT", "30")),
+        max_lifetime=float(os.getenv("POSTGRES_POOL_MAX_LIFETIME", "3600")),
+        health_check_after=float(os.getenv("POSTGRES_POOL_HEALTH_CHECK_AFTER", "30")),
+    )
+
+
+def get_pool() -> ConnectionPool:
+    """get_pool returns the process-wide pool of connections to the primary, creating it from the environment on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = make_pool(
+                    connect, min_size=int(os.getenv("POSTGRES_POOL_MIN_SIZE", "1"))
+                )
+    return _pool
+
+
+# How far behind the primary a replica is, in seconds, or NULL if it isn't a replica at all.
+# It's zero only while the replica is streaming and has replayed all it received; a replica
+# whose WAL receiver is down has nothing left to replay however far behind it is. Reading the
+# receiver's status needs pg_read_all_stats; without it, lag is measured by replay time.
+REPLICA_LAG_QUERY = """
+    SELECT CASE
+      WHEN NOT pg_is_in_recovery() THEN NULL
+      WHEN
+        (SELECT status FROM pg_stat_wal_receiver) = 'streaming'
+        AND pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+      THEN 0
+      ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+"""
+
+
+class Replica:
+    """Replica is a read-only copy of the database, with its own pool, which is only used while healthy.
+
+    It's unhealthy for retry_after seconds after failing, or while more than max_lag seconds behind.
+    """
+
+    def __init__(
+        self,
+        dsn: str,
+        pool: ConnectionPool,
+        *,
+        max_lag: float,
+        check_interval: float,
+        retry_after: float,
+    ):
+        self.dsn = dsn
+        self.pool = pool
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.retry_after = retry_after
+        self.lag = 0.0
+        self._checked_at = -math.inf
+        self._down_until = -math.inf
+        self._check_lock = threading.Lock()
+
+    def is_healthy(self) -> bool:
+        now = time.monotonic()
+        if now < self._down_until:
+            return False
+        # Only one thread re-checks; the others go by the last check meanwhile.
+        if now - self._checked_at >= self.check_interval and self._check_lock.acquire(
+            blocking=False
+        ):
+            try:
+                self._check_lag()
+            finally:
+                self._check_lock.release()
+        return time.monotonic() >= self._down_until and self.lag <= self.max_lag
+
+    def mark_down(self):
+        self._down_until = time.monotonic() + self.retry_after
+
+    def _check_lag(self):
+        self._checked_at = time.monotonic()
+        try:
+            conn = self.pool.getconn()
+        except (psycopg2.Error, PoolTimeoutError):
+            self.mark_down()
+            return
+        try:
+            with conn.cursor() as cur:
+                cur.execute(REPLICA_LAG_QUERY)
+                lag = cur.fetchone()[0]
+                # Not a replica, or one which has never replayed anything, can't be trusted.
+                self.lag = float(lag) if lag is not None else math.inf
+            conn.rollback()
+        except psycopg2.Error:
+            self.pool.putconn(conn, discard=True)
+            self.mark_down()
+            return
+        self.pool.putconn(conn)
+
+
+_replicas: Optional[List[Replica]] = None
+_replica_turn = itertools.count()
+_server_cursor_names = itertools.count()
+
+
+def replica_dsns() -> List[str]:
+    return [
+        dsn.strip()
+        for dsn in os.getenv("POSTGRES_REPLICA_DSNS", "").split(",")
+        if dsn.strip()
+    ]
+
+
+def replica_max_lag() -> float:
+    return float(os.getenv("POSTGRES_REPLICA_MAX_LAG", "5"))
+
+
+def get_replicas() -> List[Replica]:
+    """get_replicas returns the read replicas configured by POSTGRES_REPLICA_DSNS, which may be none."""
+    global _replicas
+    if _replicas is None:
+        with _pool_lock:
+            if _replicas is None:
+                _replicas = [
+                    Replica(
+                        dsn,
+                        # Empty to begin with, so a replica which is down doesn't stop the app starting.
+                        make_pool(functools.partial(psycopg2.connect, dsn), min_size=0),
+                        max_lag=replica_max_lag(),
+                        check_interval=float(
+                            os.getenv("POSTGRES_REPLICA_CHECK_INTERVAL", "2")
+                        ),
+                        retry_after=float(
+                            os.getenv("POSTGRES_REPLICA_RETRY_AFTER", "30")
+                        ),
+                    )
+                    for dsn in replica_dsns()
+                ]
+    return _replicas
+
+
+def forget_pool():
+    """forget_pool drops the pools without closing their connections, for use in a freshly forked process.
+
+    Closing them would also close them for the parent process, which shares their sockets.
+    """
+    global _pool, _replicas
+    with _pool_lock:
+        _pool = None
+        _replicas = None
+
+
+def close_pool():
+    global _pool, _replicas
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+        for replica in _replicas or []:
+            replica.pool.close()
+        _replicas = None
+
+
+def env_flag(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _reuse_per_request() -> bool:
+    return has_app_context() and env_flag("POSTGRES_CONNECTION_PER_REQUEST", True)
+
+
+def sticky_seconds() -> float:
+    return float(os.getenv("POSTGRES_READ_YOUR_WRITES_SECONDS", "10"))
+
+
+def _reads_must_see_writes() -> bool:
+    """_reads_must_see_writes is whether this request's client wrote recently, so must read from the primary."""
+    if not has_request_context():
+        return False
+    if g.get("_wrote"):
+        return True
+    try:
+        until = float(request.cookies.get(STICKY_COOKIE, ""))
+    except ValueError:
+        return False
+    now = time.time()
+    # Ignore cookies claiming more than a window, so clients can't pin themselves to the primary.
+    return now < until <= now + sticky_seconds()
+
+
+def _acquire(pool: ConnectionPool) -> psycopg2.extensions.connection:
+    started = time.perf_counter()
+    conn = pool.getconn()
+    tracing.record_connection_acquire(time.perf_counter() - started)
+    return conn
+
+
+def _acquire_from_replica() -> (
+    Optional[Tuple[ConnectionPool, psycopg2.extensions.connection]]
+):
+    """_acquire_from_replica takes a connection from the next healthy replica in turn, if there is one."""
+    replicas = get_replicas()
+    if not replicas:
+        return None
+    start = next(_replica_turn)
+    for offset in range(len(replicas)):
+        replica = replicas[(start + offset) % len(replicas)]
+        if not replica.is_healthy():
+            continue
+        try:
+            return replica.pool, _acquire(replica.pool)
+        except psycopg2.OperationalError:
+            replica.mark_down()
+        except PoolTimeoutError:
+            continue
+    return None
+
+
+@contextmanager
+def _checkout(read_only: bool):
+    if not read_only and has_request_context():
+        g._wrote = True
+    use_replica = read_only and not _reads_must_see_writes()
+
+    if _reuse_per_request():
+        # A request keeps the same replica throughout, so its reads are consistent with each other.
+        held = g.get("_db_replica_connection") if use_replica else None
+        if held is None and use_replica:
+            held = _acquire_from_replica()
+            g._db_replica_connection = held
+        if held is not None:
+            yield held[1]
+            return
+        conn = g.get("_db_connection")
+        if conn is None:
+            conn = _acquire(get_pool())
+            g._db_connection = conn
+        yield conn
+        return
+
+    held = _acquire_from_replica() if use_replica else None
+    if held is not None:
+        pool, conn = held
+    else:
+        pool = get_pool()
+        conn = _acquire(pool)
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        pool.putconn(conn, discard=True)
+        raise
+    except BaseException:
+        pool.putconn(conn)
+        raise
+    else:
+        pool.putconn(conn)
+
+
+def release_request_connection(exception: Optional[BaseException] = None):
+    """release_request_connection returns the connections used by the current request to their pools."""
+    discard = isinstance(
+        exception, (psycopg2.OperationalError, psycopg2.InterfaceError)
+    )
+    conn = g.pop("_db_connection", None)
+    if conn is not None:
+        get_pool().putconn(conn, discard=discard)
+    held = g.pop("_db_replica_connection", None)
+    if held is not None:
+        pool, conn = held
+        pool.putconn(conn, discard=discard)
+
+
+def remember_writes(response: Response) -> Response:
+    """remember_writes tells a client which just wrote to read from the primary for a while, wherever its next request goes."""
+    if g.get("_wrote") and get_replicas():
+        until = time.time() + sticky_seconds()
+        response.set_cookie(
+            STICKY_COOKIE,
+            f"{until:.3f}",
+            max_age=math.ceil(sticky_seconds()),
+            httponly=True,
+            samesite="Lax",
+        )
+    return response
+
+
+def init_app(app: Flask):
+    app.after_request(remember_writes)
+    app.teardown_appcontext(release_request_connection)
+
+
+@contextmanager
+def db_cursor(*, read_only: bool = False):
+    """db_cursor yields a cursor in a transaction, which commits if the block finishes without raising.
+
+    Pass read_only=True for reads which may be served by a replica, a few seconds behind the primary.
+    """
+    with _checkout(read_only) as conn:
+        # The connection context manager commits on success and rolls back on error.
+        with conn:
+            with conn.cursor(cursor_factory=tracing.TracingCursor) as cur:
+                yield cur
+
+
+def default_fetch_size() -> int:
+    return int(os.getenv("POSTGRES_FETCH_SIZE", "2000"))
+
+
+@contextmanager
+def db_server_cursor(*, read_only: bool = False, fetch_size: Optional[int] = None):
+    """db_server_cursor yields a named (server-side) cursor in a transaction, like db_cursor.
+
+    Iterating over it fetches fetch_size rows at a time (POSTGRES_FETCH_SIZE by default),
+    so results of any size can be processed in constant memory.
+    """
+    name = f"server_cursor_{next(_server_cursor_names)}"
+    with _checkout(read_only) as conn:
+        with conn:
+            with conn.cursor(name, cursor_factory=tracing.TracingCursor) as cur:
+                cur.itersize = fetch_size or default_fetch_size()
+                yield cur
@@ -0,0 +1,223 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from flask import Flask, g
+import psycopg2
+import psycopg2.extensions
+
+from data import connection
+from data.connection import ConnectionPool, PoolTimeoutError, Replica
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, args=None):
+        if self.conn.broken:
+            raise psycopg2.OperationalError("server closed the connection")
+
+    def fetchone(self):
+        return (self.conn.lag,)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.broken = False
+        self.lag = 0.0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def get_transaction_status(self):
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+class TestConnectionPool(unittest.TestCase):
+    def make_pool(self, **kwargs):
+        self.opened = []
+
+        def connect():
+            conn = FakeConnection()
+            self.opened.append(conn)
+            return conn
+
+        return ConnectionPool(connect, **kwargs)
+
+    def test_reuses_connections(self):
+        pool = self.make_pool(min_size=0, max_size=2)
+        conn = pool.getconn()
+        pool.putconn(conn)
+        self.assertIs(pool.getconn(), conn)
+        self.assertEqual(len(self.opened), 1)
+
+    def test_prefills_min_size(self):
+        pool = self.make_pool(min_size=2, max_size=4)
+        self.assertEqual(pool.size, 2)
+        self.assertEqual(pool.idle_count, 2)
+
+    def test_times_out_when_exhausted(self):
+        pool = self.make_pool(min_size=0, max_size=1, timeout=0.05)
+        pool.getconn()
+        with self.assertRaises(PoolTimeoutError):
+            pool.getconn()
+
+    def test_waiter_gets_returned_connection(self):
+        pool = self.make_pool(min_size=0, max_size=1, timeout=5)
+        conn = pool.getconn()
+        received = []
+        waiter = threading.Thread(target=lambda: received.append(pool.getconn()))
+        waiter.start()
+        pool.putconn(conn)
+        waiter.join()
+        self.assertEqual(received, [conn])
+
+    def test_replaces_unhealthy_connection(self):
+        pool = self.make_pool(min_size=0, max_size=1, health_check_after=0)
+        conn = pool.getconn()
+        pool.putconn(conn)
+        conn.broken = True
+        replacement = pool.getconn()
+        self.assertIsNot(replacement, conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.size, 1)
+
+    def test_retires_connections_past_max_lifetime(self):
+        pool = self.make_pool(min_size=0, max_size=1, max_lifetime=0)
+        conn = pool.getconn()
+        pool.putconn(conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.size, 0)
+        self.assertIsNot(pool.getconn(), conn)
+
+
+class TestReplicas(unittest.TestCase):
+    def make_replica(self, name, **kwargs):
+        opened = []
+
+        def connect():
+            conn = FakeConnection()
+            conn.replica = name
+            opened.append(conn)
+            return conn
+
+        settings = {"max_lag": 5, "check_interval": 0, "retry_after": 30}
+        settings.update(kwargs)
+        replica = Replica(name, ConnectionPool(connect, min_size=0), **settings)
+        replica.opened = opened
+        return replica
+
+    def use_replicas(self, *replicas):
+        patcher = mock.patch.object(connection, "_replicas", list(replicas))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def acquire(self):
+        held = connection._acquire_from_replica()
+        if held is None:
+            return None
+        pool, conn = held
+        pool.putconn(conn)
+        return conn.replica
+
+    def test_round_robin_between_replicas(self):
+        self.use_replicas(self.make_replica("a"), self.make_replica("b"))
+        chosen = [self.acquire() for _ in range(4)]
+        self.assertEqual(sorted(chosen), ["a", "a", "b", "b"])
+        self.assertNotEqual(chosen[0], chosen[1])
+
+    def test_skips_lagging_replica(self):
+        lagging = self.make_replica("a")
+        self.use_replicas(lagging, self.make_replica("b"))
+        self.acquire()
+        self.acquire()
+        lagging.opened[0].lag = 60.0
+        self.assertEqual({self.acquire() for _ in range(4)}, {"b"})
+        lagging.opened[0].lag = 0.0
+        self.assertEqual({self.acquire() for _ in range(4)}, {"a", "b"})
+
+    def test_skips_server_which_is_not_a_replica(self):
+        # The lag query answers NULL on a server which isn't in recovery, e.g. a promoted replica.
+        promoted = self.make_replica("a")
+        self.use_replicas(promoted, self.make_replica("b"))
+        self.acquire()
+        self.acquire()
+        promoted.opened[0].lag = None
+        self.assertEqual({self.acquire() for _ in range(4)}, {"b"})
+
+    def test_failed_replica_is_down_until_retry(self):
+        failing = self.make_replica("a", retry_after=60)
+        self.use_replicas(failing)
+        self.assertEqual(self.acquire(), "a")
+        failing.opened[0].broken = True
+        self.assertIsNone(self.acquire())
+        self.assertFalse(failing.is_healthy())
+
+    def test_no_replicas(self):
+        self.use_replicas()
+        self.assertIsNone(connection._acquire_from_replica())
+
+
+class TestReadYourWrites(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        patcher = mock.patch.dict(
+            "os.environ", {"POSTGRES_READ_YOUR_WRITES_SECONDS": "10"}
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def cookie(self, until):
+        return {"Cookie": f"{connection.STICKY_COOKIE}={until}"}
+
+    def test_fresh_client_may_read_replica(self):
+        with self.app.test_request_context("/"):
+            self.assertFalse(connection._reads_must_see_writes())
+
+    def test_write_in_request_pins_to_primary(self):
+        with self.app.test_request_context("/"):
+            g._wrote = True
+            self.assertTrue(connection._reads_must_see_writes())
+
+    def test_recent_write_cookie_pins_to_primary(self):
+        headers = self.cookie(time.time() + 5)
+        with self.app.test_request_context("/", headers=headers):
+            self.assertTrue(connection._reads_must_see_writes())
+
+    def test_expired_or_implausible_cookie_is_ignored(self):
+        for until in (time.time() - 1, time.time() + 3600, "soon"):
+            with self.app.test_request_context("/", headers=self.cookie(until)):
+                self.assertFalse(connection._reads_must_see_writes())
+
+    def test_writes_set_cookie_when_replicas_configured(self):
+        with mock.patch.object(connection, "_replicas", [object()]):
+            with self.app.test_request_context("/"):
+                g._wrote = True
+                response = connection.remember_writes(self.app.make_response("ok"))
+        self.assertIn(connection.STICKY_COOKIE, response.headers["Set-Cookie"])
+
+    def test_no_cookie_without_replicas(self):
+        with mock.patch.object(connection, "_replicas", []):
+            with self.app.test_request_context("/"):
+                g._wrote = True
+                response = connection.remember_writes(self.app.make_response("ok"))
+        self.assertNotIn("Set-Cookie", response.headers)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+"""Writes blooms as newline-delimited JSON (NDJSON), one bloom per line, in constant memory.
+
+Lines are grouped into chunks of roughly CHUNK_SIZE bytes, so a streamed response isn't
+sent as one tiny chunk per bloom, and a file isn't written one line at a time.
+
+A streamed export holds one of a worker's threads for as long as its client takes to read
+it, so each worker serves at most EXPORT_MAX_CONCURRENT at once.
+"""
+
+import json
+import os
+import threading
+from typing import Iterable, Iterator
+
+from data.blooms import Bloom
+
+CHUNK_SIZE = 64 * 1024
+
+MIMETYPE = "application/x-ndjson"
+
+
+def max_concurrent_exports() -> int:
+    # Leave most of a worker's threads for other requests.
+    default = max(1, int(os.getenv("WEB_THREADS", "4")) // 4)
+    return int(os.getenv("EXPORT_MAX_CONCURRENT", str(default)))
+
+
+_export_slots = None
+_export_slots_lock = threading.Lock()
+
+
+def export_slots() -> threading.BoundedSemaphore:
+    """export_slots returns this worker's semaphore of concurrent streamed exports."""
+    global _export_slots
+    if _export_slots is None:
+        with _export_slots_lock:
+            if _export_slots is None:
+                _export_slots = threading.BoundedSemaphore(max_concurrent_exports())
+    return _export_slots
+
+
+def bloom_line(bloom: Bloom) -> str:
+    """bloom_line returns bloom as one line of JSON, with the same fields as the API's bloom objects."""
+    return (
+        json.dumps(
+            {
+                "content": bloom.content,
+                "id": bloom.id,
+                "sender": bloom.sender,
+                "sent_timestamp": bloom.sent_timestamp.isoformat(),
+            },
+            separators=(",", ":"),
+        )
+        + "\n"
+    )
+
+
+def ndjson_chunks(
+    blooms: Iterable[Bloom], *, chunk_size: int = CHUNK_SIZE
+) -> Iterator[bytes]:
+    """ndjson_chunks yields blooms as NDJSON, a chunk of whole lines at a time."""
+    lines = []
+    size = 0
+    for bloom in blooms:
+        line = bloom_line(bloom)
+        lines.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield "".join(lines).encode("utf-8")
+            lines = []
+            size = 0
+    if lines:
+        yield "".join(lines).encode("utf-8")
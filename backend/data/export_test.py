@@ -0,0 +1,59 @@
+import datetime
+import json
+import unittest
+
+from data.blooms import Bloom
+from data.export import bloom_line, ndjson_chunks
+
+
+def make_bloom(bloom_id: int, content: str = "Hello") -> Bloom:
+    return Bloom(
+        id=bloom_id,
+        sender="ada",
+        content=content,
+        sent_timestamp=datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=datetime.UTC),
+    )
+
+
+class TestExport(unittest.TestCase):
+    def test_bloom_line(self):
+        line = bloom_line(make_bloom(7, "Hi\nthere ☺"))
+        self.assertTrue(line.endswith("\n"))
+        self.assertEqual(line.count("\n"), 1)
+        self.assertEqual(
+            json.loads(line),
+            {
+                "content": "Hi\nthere ☺",
+                "id": 7,
+                "sender": "ada",
+                "sent_timestamp": "2024-01-02T03:04:05+00:00",
+            },
+        )
+
+    def test_chunks_hold_whole_lines(self):
+        blooms = [make_bloom(i) for i in range(100)]
+        chunks = list(ndjson_chunks(blooms, chunk_size=500))
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertTrue(chunk.endswith(b"\n"))
+        lines = b"".join(chunks).decode("utf-8").splitlines()
+        self.assertEqual([json.loads(line)["id"] for line in lines], list(range(100)))
+
+    def test_consumes_lazily(self):
+        consumed = []
+
+        def blooms():
+            for i in range(1000):
+                consumed.append(i)
+                yield make_bloom(i)
+
+        chunks = ndjson_chunks(blooms(), chunk_size=1000)
+        next(chunks)
+        self.assertLess(len(consumed), 100)
+
+    def test_no_blooms(self):
+        self.assertEqual(list(ndjson_chunks([])), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,20 @@
+"""Stand-ins for database cursors, for tests of code which queries through one."""
+
+
+class RecordingCursor:
+    """RecordingCursor records every query it's given, and answers them from canned results, in order."""
+
+    def __init__(self, results=()):
+        self.queries = []
+        self._results = list(results)
+        self._current = None
+
+    def execute(self, query, args=None):
+        self.queries.append((" ".join(query.split()), args))
+        self._current = self._results.pop(0) if self._results else []
+
+    def fetchall(self):
+        return self._current
+
+    def fetchone(self):
+        return self._current[0] if self._current else None
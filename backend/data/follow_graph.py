@@ -0,0 +1,467 @@
+"""Keeps who follows whom in memory, so follow lists and checks don't need the database.
+
+Each process loads the follows table into compressed sparse row arrays: users are numbered
+in username order, and each user's follows (and followers) are a sorted run of those numbers
+in one shared array, found through an array of offsets. A user's list is therefore already
+in username order, is-following is a binary search, and counts are a subtraction.
+
+Following or unfollowing NOTIFYs the follows_changed channel in the same transaction. Each
+process's graph thread LISTENs on a dedicated connection and applies the changes to a small
+overlay of added and removed follows. Only that thread applies changes, so they're applied
+in commit order; the request which made a change waits for it to be applied, so the user
+sees their own follows straight away. Every FOLLOW_GRAPH_RESYNC_SECONDS, and whenever it
+reconnects, it reloads everything, folding the overlay back into the arrays and repairing
+anything missed.
+
+Set FOLLOW_GRAPH=true to use it. Until a process has loaded the graph, and whenever it's
+switched off, follows are queried from the database as before.
+"""
+
+from array import array
+import bisect
+from dataclasses import dataclass, field
+import json
+import logging
+import os
+import select
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from data import connection
+
+import psycopg2
+import psycopg2.extensions
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "follows_changed"
+
+
+def follow_graph_enabled() -> bool:
+    return connection.env_flag("FOLLOW_GRAPH", False)
+
+
+def resync_interval() -> float:
+    return float(os.getenv("FOLLOW_GRAPH_RESYNC_SECONDS", "300"))
+
+
+# How long a request waits for its own change to be applied, e.g. while reconnecting.
+APPLY_TIMEOUT_SECONDS = 1.0
+
+# How many applied changes are remembered, for requests which start waiting after theirs arrived.
+RECENT_CHANGES = 10000
+
+
+@dataclass(frozen=True)
+class FollowChange:
+    follower_id: int
+    follower_username: str
+    followee_id: int
+    followee_username: str
+    following: bool
+    # Identifies the change, so the request which made it can wait for it to be applied.
+    token: str = ""
+
+
+def publish(cur, change: FollowChange):
+    """publish announces a follow or unfollow to every process's graph, once the transaction commits."""
+    if not follow_graph_enabled():
+        return
+    cur.execute(
+        "SELECT pg_notify(%s, %s)",
+        (
+            CHANNEL,
+            json.dumps(
+                [
+                    change.follower_id,
+                    change.follower_username,
+                    change.followee_id,
+                    change.followee_username,
+                    change.following,
+                    change.token,
+                ]
+            ),
+        ),
+    )
+
+
+def parse_change(payload: str) -> FollowChange:
+    # Processes from before changes had tokens send five fields.
+    (
+        follower_id,
+        follower_username,
+        followee_id,
+        followee_username,
+        following,
+        *token,
+    ) = json.loads(payload)
+    return FollowChange(
+        follower_id=int(follower_id),
+        follower_username=follower_username,
+        followee_id=int(followee_id),
+        followee_username=followee_username,
+        following=bool(following),
+        token=str(token[0]) if token else "",
+    )
+
+
+class Adjacency:
+    """Adjacency holds every user's neighbours as sorted runs of user numbers in one array."""
+
+    def __init__(self, size: int, sources: array, targets: array):
+        offsets = array("q", bytes(8 * (size + 1)))
+        for source in sources:
+            offsets[source + 1] += 1
+        for number in range(size):
+            offsets[number + 1] += offsets[number]
+        runs = array("i", bytes(4 * len(targets)))
+        filled = array("q", offsets)
+        for source, target in zip(sources, targets):
+            runs[filled[source]] = target
+            filled[source] += 1
+        for number in range(size):
+            start, end = offsets[number], offsets[number + 1]
+            if end - start > 1:
+                runs[start:end] = array("i", sorted(runs[start:end]))
+        self.offsets = offsets
+        self.runs = runs
+
+    def bounds(self, number: Optional[int]) -> Tuple[int, int]:
+        if number is None:
+            return 0, 0
+        return self.offsets[number], self.offsets[number + 1]
+
+    def contains(self, number: Optional[int], other: Optional[int]) -> bool:
+        if number is None or other is None:
+            return False
+        start, end = self.bounds(number)
+        position = bisect.bisect_left(self.runs, other, start, end)
+        return position < end and self.runs[position] == other
+
+
+class Snapshot:
+    """Snapshot is the follow graph as loaded from the database."""
+
+    def __init__(
+        self, users: Iterable[Tuple[int, str]], edges: Iterable[Tuple[int, int]]
+    ):
+        ordered = sorted(users, key=lambda user: user[1])
+        self.usernames = [username for _, username in ordered]
+        self.ids = array("q", (user_id for user_id, _ in ordered))
+        self.number_by_id = {user_id: number for number, user_id in enumerate(self.ids)}
+        followers = array("i")
+        followees = array("i")
+        for follower_id, followee_id in edges:
+            follower = self.number_by_id.get(follower_id)
+            followee = self.number_by_id.get(followee_id)
+            # Follows of users created since the users were read arrive as changes instead.
+            if follower is not None and followee is not None:
+                followers.append(follower)
+                followees.append(followee)
+        self.follows = Adjacency(len(ordered), followers, followees)
+        self.followers = Adjacency(len(ordered), followees, followers)
+
+
+@dataclass
+class Overlay:
+    """Overlay holds the follows added and removed, by user id, since the snapshot was loaded."""
+
+    added: Dict[int, Set[int]] = field(default_factory=dict)
+    removed: Dict[int, Set[int]] = field(default_factory=dict)
+
+    def change(self, user_id: int, other_id: int, *, present: bool, in_snapshot: bool):
+        self.added.get(user_id, set()).discard(other_id)
+        self.removed.get(user_id, set()).discard(other_id)
+        if present and not in_snapshot:
+            self.added.setdefault(user_id, set()).add(other_id)
+        elif in_snapshot and not present:
+            self.removed.setdefault(user_id, set()).add(other_id)
+
+
+class FollowGraph:
+    """FollowGraph answers follow queries by user id from a Snapshot plus the changes made since."""
+
+    def __init__(self, snapshot: Snapshot):
+        self._lock = threading.Lock()
+        self._replace(snapshot)
+
+    def replace(self, snapshot: Snapshot):
+        with self._lock:
+            self._replace(snapshot)
+
+    def _replace(self, snapshot: Snapshot):
+        self._snapshot = snapshot
+        self._follows = Overlay()
+        self._followers = Overlay()
+        # Usernames of users who joined since the snapshot, learned from their follows.
+        self._new_usernames: Dict[int, str] = {}
+
+    def apply(self, change: FollowChange):
+        """apply records a follow or unfollow; applying the same change again does nothing."""
+        with self._lock:
+            snapshot = self._snapshot
+            for user_id, username in (
+                (change.follower_id, change.follower_username),
+                (change.followee_id, change.followee_username),
+            ):
+                if user_id not in snapshot.number_by_id:
+                    self._new_usernames[user_id] = username
+            follower = snapshot.number_by_id.get(change.follower_id)
+            followee = snapshot.number_by_id.get(change.followee_id)
+            in_snapshot = snapshot.follows.contains(follower, followee)
+            self._follows.change(
+                change.follower_id,
+                change.followee_id,
+                present=change.following,
+                in_snapshot=in_snapshot,
+            )
+            self._followers.change(
+                change.followee_id,
+                change.follower_id,
+                present=change.following,
+                in_snapshot=in_snapshot,
+            )
+
+    def is_following(self, follower_id: int, followee_id: int) -> bool:
+        with self._lock:
+            if followee_id in self._follows.added.get(follower_id, ()):
+                return True
+            if followee_id in self._follows.removed.get(follower_id, ()):
+                return False
+            snapshot = self._snapshot
+        return snapshot.follows.contains(
+            snapshot.number_by_id.get(follower_id),
+            snapshot.number_by_id.get(followee_id),
+        )
+
+    def follows(
+        self, user_id: int, *, after: Optional[str] = None, limit: Optional[int] = None
+    ) -> List[str]:
+        """follows returns the usernames user_id follows, in username order, starting after after."""
+        return self._neighbours(user_id, followers=False, after=after, limit=limit)
+
+    def followers(
+        self, user_id: int, *, after: Optional[str] = None, limit: Optional[int] = None
+    ) -> List[str]:
+        """followers returns the usernames following user_id, in username order, starting after after."""
+        return self._neighbours(user_id, followers=True, after=after, limit=limit)
+
+    def mutuals(
+        self, user_id: int, *, after: Optional[str] = None, limit: Optional[int] = None
+    ) -> List[str]:
+        """mutuals returns the usernames which both follow and are followed by user_id, in username order."""
+        followers = set(self.followers(user_id, after=after))
+        mutuals = [
+            username
+            for username in self.follows(user_id, after=after)
+            if username in followers
+        ]
+        return mutuals if limit is None else mutuals[:limit]
+
+    def follows_count(self, user_id: int) -> int:
+        return self._count(user_id, followers=False)
+
+    def followers_count(self, user_id: int) -> int:
+        return self._count(user_id, followers=True)
+
+    def _count(self, user_id: int, *, followers: bool) -> int:
+        with self._lock:
+            snapshot = self._snapshot
+            overlay = self._followers if followers else self._follows
+            changed = len(overlay.added.get(user_id, ())) - len(
+                overlay.removed.get(user_id, ())
+            )
+        adjacency = snapshot.followers if followers else snapshot.follows
+        start, end = adjacency.bounds(snapshot.number_by_id.get(user_id))
+        return end - start + changed
+
+    def _neighbours(
+        self,
+        user_id: int,
+        *,
+        followers: bool,
+        after: Optional[str],
+        limit: Optional[int],
+    ) -> List[str]:
+        with self._lock:
+            snapshot = self._snapshot
+            overlay = self._followers if followers else self._follows
+            added = set(overlay.added.get(user_id, ()))
+            removed = set(overlay.removed.get(user_id, ()))
+            new_usernames = {
+                other_id: self._new_usernames[other_id]
+                for other_id in added
+                if other_id in self._new_usernames
+            }
+        adjacency = snapshot.followers if followers else snapshot.follows
+        start, end = adjacency.bounds(snapshot.number_by_id.get(user_id))
+        if after is not None:
+            start = bisect.bisect_right(
+                adjacency.runs, after, start, end, key=snapshot.usernames.__getitem__
+            )
+
+        if not added and not removed:
+            # The usual case: a slice of the run is the page.
+            if limit is not None:
+                end = min(end, start + limit)
+            return [snapshot.usernames[number] for number in adjacency.runs[start:end]]
+
+        usernames = [
+            snapshot.usernames[number]
+            for number in adjacency.runs[start:end]
+            if snapshot.ids[number] not in removed
+        ]
+        for other_id in added:
+            number = snapshot.number_by_id.get(other_id)
+            username = (
+                snapshot.usernames[number]
+                if number is not None
+                else new_usernames.get(other_id)
+            )
+            if username is not None and (after is None or username > after):
+                usernames.append(username)
+        usernames.sort()
+        return usernames if limit is None else usernames[:limit]
+
+
+def load_snapshot() -> Snapshot:
+    """load_snapshot reads every user and follow from the primary."""
+    with connection.db_cursor() as cur:
+        cur.execute("SELECT id, username FROM users")
+        users = cur.fetchall()
+    # Follows are streamed, so the whole table is never held as Python tuples at once.
+    with connection.db_server_cursor() as cur:
+        cur.execute("SELECT follower, followee FROM follows")
+        return Snapshot(users, cur)
+
+
+class GraphSync:
+    """GraphSync keeps one process's FollowGraph up to date, on a thread of its own."""
+
+    def __init__(
+        self,
+        connect: Callable[[], psycopg2.extensions.connection],
+        load: Callable[[], Snapshot],
+    ):
+        self._connect = connect
+        self._load = load
+        self._lock = threading.Lock()
+        self.graph: Optional[FollowGraph] = None
+        self._thread: Optional[threading.Thread] = None
+        self._applied_lock = threading.Lock()
+        # Tokens of recently applied changes, oldest first, and of changes requests are waiting for.
+        self._applied: Dict[str, None] = {}
+        self._waiting: Dict[str, threading.Event] = {}
+
+    def ensure_running(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="follow-graph", daemon=True
+            )
+            self._thread.start()
+
+    def apply(self, change: FollowChange):
+        """apply applies a notified change to the graph, and wakes the request waiting for it."""
+        self.graph.apply(change)
+        if not change.token:
+            return
+        with self._applied_lock:
+            self._applied[change.token] = None
+            if len(self._applied) > RECENT_CHANGES:
+                del self._applied[next(iter(self._applied))]
+            waiting = self._waiting.pop(change.token, None)
+        if waiting is not None:
+            waiting.set()
+
+    def wait_until_applied(self, token: str, timeout: float) -> bool:
+        """wait_until_applied waits up to timeout seconds for the change with token to be applied."""
+        with self._applied_lock:
+            if token in self._applied:
+                return True
+            waiting = self._waiting.setdefault(token, threading.Event())
+        applied = waiting.wait(timeout)
+        if not applied:
+            with self._applied_lock:
+                self._waiting.pop(token, None)
+        return applied
+
+    def reload(self):
+        started = time.perf_counter()
+        snapshot = self._load()
+        if self.graph is None:
+            self.graph = FollowGraph(snapshot)
+        else:
+            self.graph.replace(snapshot)
+        logger.info(
+            "Loaded follow graph of %d users in %.1fs",
+            len(snapshot.usernames),
+            time.perf_counter() - started,
+        )
+
+    def _run(self):
+        backoff = 1.0
+        while True:
+            conn = None
+            try:
+                conn = self._connect()
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {CHANNEL}")
+                # Listening first, so changes made while loading are applied afterwards.
+                self.reload()
+                backoff = 1.0
+                next_resync = time.monotonic() + resync_interval()
+                while True:
+                    wait = max(0.0, min(5.0, next_resync - time.monotonic()))
+                    if select.select([conn], [], [], wait) != ([], [], []):
+                        conn.poll()
+                        while conn.notifies:
+                            notify = conn.notifies.pop(0)
+                            try:
+                                change = parse_change(notify.payload)
+                            except (ValueError, TypeError):
+                                continue
+                            self.apply(change)
+                    if time.monotonic() >= next_resync:
+                        self.reload()
+                        next_resync = time.monotonic() + resync_interval()
+            except (psycopg2.Error, connection.PoolTimeoutError):
+                # Queries fall back to the database if the graph was never loaded; reconnecting reloads it.
+                logger.exception("Follow graph lost its connection")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+
+_sync: Optional[GraphSync] = None
+_sync_lock = threading.Lock()
+
+
+def graph_sync() -> GraphSync:
+    global _sync
+    if _sync is None:
+        with _sync_lock:
+            if _sync is None:
+                _sync = GraphSync(connection.connect, load_snapshot)
+    return _sync
+
+
+def wait_until_applied(change: FollowChange):
+    """wait_until_applied waits for this process's graph to apply a committed change, if it's in use."""
+    if current_graph() is None:
+        return
+    graph_sync().wait_until_applied(change.token, APPLY_TIMEOUT_SECONDS)
+
+
+def current_graph() -> Optional[FollowGraph]:
+    """current_graph returns this process's graph, or None if follows should be queried from the database."""
+    if not follow_graph_enabled():
+        return None
+    sync = graph_sync()
+    sync.ensure_running()
+    return sync.graph
@@ -0,0 +1,129 @@
+import threading
+import unittest
+
+from data.follow_graph import (
+    FollowChange,
+    FollowGraph,
+    GraphSync,
+    Snapshot,
+    parse_change,
+)
+
+USERS = [(1, "dana"), (2, "ada"), (3, "cy"), (4, "bo")]
+NAMES = dict(USERS)
+
+
+def change(follower_id: int, followee_id: int, following: bool = True, token: str = ""):
+    return FollowChange(
+        follower_id=follower_id,
+        follower_username=NAMES.get(follower_id, f"user{follower_id}"),
+        followee_id=followee_id,
+        followee_username=NAMES.get(followee_id, f"user{followee_id}"),
+        following=following,
+        token=token,
+    )
+
+
+class TestFollowGraph(unittest.TestCase):
+    def setUp(self):
+        # dana follows ada, cy and bo; ada and bo follow dana back; cy follows ada.
+        self.graph = FollowGraph(
+            Snapshot(USERS, [(1, 2), (1, 3), (1, 4), (2, 1), (4, 1), (3, 2)])
+        )
+
+    def test_lists_in_username_order(self):
+        self.assertEqual(self.graph.follows(1), ["ada", "bo", "cy"])
+        self.assertEqual(self.graph.followers(2), ["cy", "dana"])
+        self.assertEqual(self.graph.followers(3), ["dana"])
+        self.assertEqual(self.graph.follows(3), ["ada"])
+        self.assertEqual(self.graph.mutuals(1), ["ada", "bo"])
+
+    def test_pages(self):
+        self.assertEqual(self.graph.follows(1, limit=2), ["ada", "bo"])
+        self.assertEqual(self.graph.follows(1, after="bo", limit=2), ["cy"])
+        self.assertEqual(self.graph.follows(1, after="b"), ["bo", "cy"])
+        self.assertEqual(self.graph.follows(1, after="cy"), [])
+        self.assertEqual(self.graph.mutuals(1, after="ada"), ["bo"])
+
+    def test_is_following_and_counts(self):
+        self.assertTrue(self.graph.is_following(1, 2))
+        self.assertFalse(self.graph.is_following(2, 3))
+        self.assertFalse(self.graph.is_following(99, 1))
+        self.assertEqual(self.graph.follows_count(1), 3)
+        self.assertEqual(self.graph.followers_count(1), 2)
+        self.assertEqual(self.graph.followers_count(99), 0)
+
+    def test_applies_changes(self):
+        self.graph.apply(change(2, 3))
+        self.graph.apply(change(1, 3, following=False))
+        self.assertTrue(self.graph.is_following(2, 3))
+        self.assertFalse(self.graph.is_following(1, 3))
+        self.assertEqual(self.graph.follows(2), ["cy", "dana"])
+        self.assertEqual(self.graph.follows(1), ["ada", "bo"])
+        self.assertEqual(self.graph.followers(3), ["ada"])
+        self.assertEqual(self.graph.follows_count(1), 2)
+        self.assertEqual(self.graph.followers_count(3), 1)
+
+        # Changes are idempotent, and undoing one leaves the snapshot's answer.
+        self.graph.apply(change(2, 3))
+        self.assertEqual(self.graph.follows_count(2), 2)
+        self.graph.apply(change(1, 3))
+        self.assertEqual(self.graph.follows(1), ["ada", "bo", "cy"])
+        self.assertEqual(self.graph.follows_count(1), 3)
+
+    def test_users_newer_than_snapshot(self):
+        self.graph.apply(change(5, 1))
+        self.graph.apply(change(1, 5))
+        self.assertEqual(self.graph.followers(1), ["ada", "bo", "user5"])
+        self.assertEqual(self.graph.follows(1, after="bo"), ["cy", "user5"])
+        self.assertEqual(self.graph.mutuals(5), ["dana"])
+        self.assertTrue(self.graph.is_following(5, 1))
+
+    def test_replace_drops_changes(self):
+        self.graph.apply(change(2, 3))
+        self.graph.replace(Snapshot(USERS, [(2, 3)]))
+        self.assertEqual(self.graph.follows(2), ["cy"])
+        self.assertEqual(self.graph.follows(1), [])
+
+    def test_parse_change(self):
+        self.assertEqual(
+            parse_change('[1, "dana", 2, "ada", false, "abc"]'),
+            change(1, 2, following=False, token="abc"),
+        )
+        self.assertEqual(
+            parse_change('[1, "dana", 2, "ada", false]'),
+            change(1, 2, following=False),
+        )
+
+
+class TestGraphSync(unittest.TestCase):
+    def setUp(self):
+        self.sync = GraphSync(connect=None, load=lambda: Snapshot(USERS, []))
+        self.sync.reload()
+
+    def test_waits_for_change_to_be_applied(self):
+        waited = []
+        waiter = threading.Thread(
+            target=lambda: waited.append(self.sync.wait_until_applied("abc", 5))
+        )
+        waiter.start()
+        self.sync.apply(change(1, 2, token="abc"))
+        waiter.join()
+        self.assertEqual(waited, [True])
+        self.assertTrue(self.sync.graph.is_following(1, 2))
+
+    def test_change_applied_before_waiting(self):
+        self.sync.apply(change(1, 2, token="abc"))
+        self.assertTrue(self.sync.wait_until_applied("abc", 0))
+        self.assertFalse(self.sync.wait_until_applied("other", 0))
+
+    def test_changes_apply_in_notified_order(self):
+        # However late the follow's request finishes, the unfollow committed after it stands.
+        self.sync.apply(change(1, 2, token="follow"))
+        self.sync.apply(change(1, 2, following=False, token="unfollow"))
+        self.assertTrue(self.sync.wait_until_applied("follow", 0))
+        self.assertFalse(self.sync.graph.is_following(1, 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,12 +1,20 @@
-from typing import List
+from typing import Any, Dict, List, Optional, Tuple
+import uuid
 
+from data import follow_graph, suggestions, timelines, user_stats
 from data.connection import db_cursor
+from data.result_cache import cached, result_cache, user_tag
 from data.users import User
 
 from psycopg2.errors import UniqueViolation
 
+IS_FOLLOWING_QUERY = (
+    "SELECT EXISTS (SELECT 1 FROM follows WHERE follower = %s AND followee = %s)"
+)
+
 
 def follow(follower: User, followee: User):
+    change = follow_change(follower, followee, following=True)
     with db_cursor() as cur:
         try:
             cur.execute(
@@ -18,26 +26,203 @@ def follow(follower: User, followee: User):
             )
         except UniqueViolation:
             # Already following - treat as idempotent request.
-            pass
+            return
+        user_stats.record_follow(cur, follower_id=follower.id, followee_id=followee.id)
+        suggestions.record_follow(cur, follower_id=follower.id, followee_id=followee.id)
+        if timelines.fanout_enabled():
+            timelines.backfill(cur, follower_id=follower.id, followee_id=followee.id)
+        follow_graph.publish(cur, change)
+    record_change(change)
+
 
+def unfollow(follower: User, followee: User):
+    """unfollow stops follower following followee.
 
-def get_followed_usernames(follower: User) -> List[str]:
-    """get_followed_usernames returns a list of usernames followee follows."""
+    Suggestions aren't adjusted; the next refresh-suggestions recomputes them.
+    """
+    change = follow_change(follower, followee, following=False)
     with db_cursor() as cur:
         cur.execute(
-            "SELECT users.username FROM follows INNER JOIN users ON follows.followee = users.id WHERE follower = %s",
-            (follower.id,),
+            "DELETE FROM follows WHERE follower = %(follower_id)s AND followee = %(followee_id)s",
+            dict(
+                follower_id=follower.id,
+                followee_id=followee.id,
+            ),
+        )
+        if cur.rowcount == 0:
+            # Not following - treat as idempotent request.
+            return
+        follower_count = user_stats.record_follow(
+            cur, follower_id=follower.id, followee_id=followee.id, delta=-1
         )
+        if timelines.fanout_enabled():
+            timelines.record_unfollow(
+                cur,
+                follower_id=follower.id,
+                followee_id=followee.id,
+                follower_count=follower_count,
+            )
+        follow_graph.publish(cur, change)
+    record_change(change)
+
+
+def follow_change(
+    follower: User, followee: User, *, following: bool
+) -> follow_graph.FollowChange:
+    return follow_graph.FollowChange(
+        follower_id=follower.id,
+        follower_username=follower.username,
+        followee_id=followee.id,
+        followee_username=followee.username,
+        following=following,
+        token=uuid.uuid4().hex,
+    )
+
+
+def record_change(change: follow_graph.FollowChange):
+    """record_change updates this process's caches once a follow or unfollow has committed."""
+    # Applied by the graph thread, in commit order with everyone else's changes.
+    follow_graph.wait_until_applied(change)
+    result_cache().invalidate(
+        user_tag(change.follower_username), user_tag(change.followee_username)
+    )
+
+
+def is_following(follower: User, followee: User) -> bool:
+    graph = follow_graph.current_graph()
+    if graph is not None:
+        return graph.is_following(follower.id, followee.id)
+    return _query_is_following(follower, followee)
+
+
+def get_followed_usernames(
+    follower: User, *, after: Optional[str] = None, limit: Optional[int] = None
+) -> List[str]:
+    """get_followed_usernames returns a list of usernames follower follows, in username order.
+
+    Pass the last username of a page as after to get the next page.
+    """
+    graph = follow_graph.current_graph()
+    if graph is not None:
+        return graph.follows(follower.id, after=after, limit=limit)
+    return _query_followed_usernames(follower, after=after, limit=limit)
+
+
+def get_inverse_followed_usernames(
+    followee: User, *, after: Optional[str] = None, limit: Optional[int] = None
+) -> List[str]:
+    """get_inverse_followed_usernames returns a list of usernames following followee, in username order.
+
+    Pass the last username of a page as after to get the next page.
+    """
+    graph = follow_graph.current_graph()
+    if graph is not None:
+        return graph.followers(followee.id, after=after, limit=limit)
+    return _query_inverse_followed_usernames(followee, after=after, limit=limit)
+
+
+def get_mutual_follows(
+    user: User, *, after: Optional[str] = None, limit: Optional[int] = None
+) -> List[str]:
+    """get_mutual_follows returns a list of usernames which user follows and which follow user back, in username order.
+
+    Pass the last username of a page as after to get the next page.
+    """
+    graph = follow_graph.current_graph()
+    if graph is not None:
+        return graph.mutuals(user.id, after=after, limit=limit)
+    return _query_mutual_follows(user, after=after, limit=limit)
+
+
+@cached(
+    lambda follower, followee: [
+        user_tag(follower.username),
+        user_tag(followee.username),
+    ]
+)
+def _query_is_following(follower: User, followee: User) -> bool:
+    with db_cursor(read_only=True) as cur:
+        cur.execute(IS_FOLLOWING_QUERY, (follower.id, followee.id))
+        return cur.fetchone()[0]
+
+
+@cached(lambda follower, **kwargs: [user_tag(follower.username)])
+def _query_followed_usernames(
+    follower: User, *, after: Optional[str], limit: Optional[int]
+) -> List[str]:
+    statement, kwargs = followed_usernames_query(follower, after=after, limit=limit)
+    with db_cursor(read_only=True) as cur:
+        cur.execute(statement, kwargs)
         rows = cur.fetchall()
         return [row[0] for row in rows]
 
 
-def get_inverse_followed_usernames(followee: User) -> List[str]:
-    """get_followed_usernames returns a list of usernames followed by follower."""
-    with db_cursor() as cur:
-        cur.execute(
-            "SELECT users.username FROM follows INNER JOIN users ON follows.follower = users.id WHERE followee = %s",
-            (followee.id,),
-        )
+@cached(lambda followee, **kwargs: [user_tag(followee.username)])
+def _query_inverse_followed_usernames(
+    followee: User, *, after: Optional[str], limit: Optional[int]
+) -> List[str]:
+    statement, kwargs = inverse_followed_usernames_query(
+        followee, after=after, limit=limit
+    )
+    with db_cursor(read_only=True) as cur:
+        cur.execute(statement, kwargs)
         rows = cur.fetchall()
         return [row[0] for row in rows]
+
+
+@cached(lambda user, **kwargs: [user_tag(user.username)])
+def _query_mutual_follows(
+    user: User, *, after: Optional[str], limit: Optional[int]
+) -> List[str]:
+    statement, kwargs = mutual_follows_query(user, after=after, limit=limit)
+    with db_cursor(read_only=True) as cur:
+        cur.execute(statement, kwargs)
+        rows = cur.fetchall()
+        return [row[0] for row in rows]
+
+
+def followed_usernames_query(
+    follower: User, *, after: Optional[str], limit: Optional[int]
+) -> Tuple[str, Dict[str, Any]]:
+    kwargs = {
+        "user_id": follower.id,
+    }
+    page_clause = make_username_page_clause(after, limit, kwargs)
+    statement = f"SELECT users.username FROM follows INNER JOIN users ON follows.followee = users.id WHERE follower = %(user_id)s {page_clause}"
+    return statement, kwargs
+
+
+def inverse_followed_usernames_query(
+    followee: User, *, after: Optional[str], limit: Optional[int]
+) -> Tuple[str, Dict[str, Any]]:
+    kwargs = {
+        "user_id": followee.id,
+    }
+    page_clause = make_username_page_clause(after, limit, kwargs)
+    statement = f"SELECT users.username FROM follows INNER JOIN users ON follows.follower = users.id WHERE followee = %(user_id)s {page_clause}"
+    return statement, kwargs
+
+
+def mutual_follows_query(
+    user: User, *, after: Optional[str], limit: Optional[int]
+) -> Tuple[str, Dict[str, Any]]:
+    kwargs = {
+        "user_id": user.id,
+    }
+    page_clause = make_username_page_clause(after, limit, kwargs)
+    statement = f"SELECT users.username FROM follows AS outgoing INNER JOIN follows AS incoming ON incoming.follower = outgoing.followee AND incoming.followee = outgoing.follower INNER JOIN users ON outgoing.followee = users.id WHERE outgoing.follower = %(user_id)s {page_clause}"
+    return statement, kwargs
+
+
+def make_username_page_clause(
+    after: Optional[str], limit: Optional[int], kwargs: Dict[Any, Any]
+) -> str:
+    clause = ""
+    if after is not None:
+        clause += "AND users.username > %(after_username)s "
+        kwargs["after_username"] = after
+    clause += "ORDER BY users.username"
+    if limit is not None:
+        clause += " LIMIT %(limit)s"
+        kwargs["limit"] = limit
+    return clause
@@ -0,0 +1,96 @@
+import datetime
+import multiprocessing
+import threading
+import unittest
+
+from data.ids import (
+    EPOCH_MS,
+    MAX_SEQUENCE,
+    IdGenerator,
+    timestamp_of,
+    worker_id_of,
+)
+
+PROCESSES = 8
+THREADS_PER_PROCESS = 4
+IDS_PER_THREAD = 25000
+
+
+class FakeClock:
+    def __init__(self, ms: int):
+        self.ms = ms
+
+    def __call__(self) -> int:
+        return (EPOCH_MS + self.ms) * 1_000_000
+
+
+def generate_ids(worker_id: int):
+    generator = IdGenerator(worker_id)
+    per_thread = [[] for _ in range(THREADS_PER_PROCESS)]
+
+    def generate(into):
+        for _ in range(IDS_PER_THREAD):
+            into.append(generator.next_id())
+
+    threads = [threading.Thread(target=generate, args=(into,)) for into in per_thread]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return per_thread
+
+
+class TestIdGenerator(unittest.TestCase):
+    def test_increases_within_and_across_milliseconds(self):
+        clock = FakeClock(1000)
+        generator = IdGenerator(5, clock=clock)
+        generated = [generator.next_id() for _ in range(3)]
+        clock.ms += 1
+        generated += [generator.next_id() for _ in range(3)]
+        self.assertEqual(generated, sorted(set(generated)))
+
+    def test_encodes_timestamp_and_worker(self):
+        generator = IdGenerator(7, clock=FakeClock(1500))
+        id = generator.next_id()
+        self.assertEqual(worker_id_of(id), 7)
+        self.assertEqual(
+            timestamp_of(id),
+            datetime.datetime(2020, 1, 1, 0, 0, 1, 500000, tzinfo=datetime.UTC),
+        )
+
+    def test_clock_going_backwards(self):
+        clock = FakeClock(1000)
+        generator = IdGenerator(1, clock=clock)
+        before = generator.next_id()
+        clock.ms -= 500
+        after = generator.next_id()
+        self.assertGreater(after, before)
+
+    def test_sequence_exhausted(self):
+        generator = IdGenerator(1, clock=FakeClock(1000))
+        generated = [generator.next_id() for _ in range(MAX_SEQUENCE + 2)]
+        self.assertEqual(generated, sorted(set(generated)))
+        self.assertEqual(
+            timestamp_of(generated[-1]) - timestamp_of(generated[0]),
+            datetime.timedelta(milliseconds=1),
+        )
+
+    def test_rejects_out_of_range_worker_id(self):
+        with self.assertRaises(ValueError):
+            IdGenerator(1024)
+
+    def test_no_duplicates_across_processes_and_threads(self):
+        with multiprocessing.Pool(PROCESSES) as pool:
+            results = pool.map(generate_ids, range(PROCESSES))
+
+        all_ids = set()
+        for per_thread in results:
+            for ids in per_thread:
+                # Each thread sees its worker's ids strictly increase.
+                self.assertEqual(ids, sorted(set(ids)))
+                all_ids.update(ids)
+        self.assertEqual(len(all_ids), PROCESSES * THREADS_PER_PROCESS * IDS_PER_THREAD)
+
+
+if __name__ == "__main__":
+    unittest.main()
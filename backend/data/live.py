@@ -0,0 +1,212 @@
+"""Pushes new blooms to connected clients as they are sent.
+
+Sending a bloom NOTIFYs the new_blooms channel, in the same transaction, so the
+notification is only delivered once the bloom is committed. Each process has one
+Broker, whose thread LISTENs on a dedicated connection, loads the new blooms with a
+single query, and hands each to the Subscriptions interested in its sender.
+
+Every Subscription has a bounded queue. A subscriber which falls too far behind is
+marked as overflowed and stops receiving blooms, rather than holding up delivery to
+everyone else; its client is expected to reconnect and resume from its last bloom id.
+"""
+
+import json
+import os
+import queue
+import select
+import threading
+import time
+from typing import Callable, Iterator, List, Optional, Set, Tuple
+
+from data import blooms, connection
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.extras import execute_values
+
+CHANNEL = "new_blooms"
+
+
+def live_updates_enabled() -> bool:
+    return connection.env_flag("LIVE_UPDATES", True)
+
+
+def queue_size() -> int:
+    return int(os.getenv("STREAM_QUEUE_SIZE", "100"))
+
+
+def max_subscribers() -> int:
+    # Each stream holds one of a worker's threads, so leave at least half for other requests.
+    # Deployments with many streams should serve them from a dedicated instance (see the README).
+    default = max(1, int(os.getenv("WEB_THREADS", "4")) // 2)
+    return int(os.getenv("STREAM_MAX_SUBSCRIBERS", str(default)))
+
+
+def publish(cur, sent: List[Tuple[int, str]]):
+    """publish announces new blooms, given as (bloom_id, sender_username) pairs, once the transaction commits."""
+    if not sent or not live_updates_enabled():
+        return
+    execute_values(
+        cur,
+        f"SELECT pg_notify('{CHANNEL}', payload) FROM (VALUES %s) AS sent (payload)",
+        [
+            (json.dumps({"id": bloom_id, "sender": sender}),)
+            for bloom_id, sender in sent
+        ],
+    )
+
+
+class TooManySubscribersError(Exception):
+    pass
+
+
+class Subscription:
+    def __init__(self, senders: Callable[[], Set[str]], max_queued: int):
+        self._senders = senders
+        self.interested_in = senders()
+        self.queue: "queue.Queue[blooms.Bloom]" = queue.Queue(maxsize=max_queued)
+        self.overflowed = False
+
+    def refresh(self):
+        """refresh re-reads which senders the subscriber wants, e.g. after they follow someone."""
+        self.interested_in = self._senders()
+
+    def offer(self, bloom: "blooms.Bloom"):
+        if self.overflowed or bloom.sender not in self.interested_in:
+            return
+        try:
+            self.queue.put_nowait(bloom)
+        except queue.Full:
+            self.overflowed = True
+
+
+class Broker:
+    """Broker shares one LISTENing database connection between every subscriber in the process."""
+
+    def __init__(self, connect: Callable[[], psycopg2.extensions.connection]):
+        self._connect = connect
+        self._lock = threading.Lock()
+        self._subscriptions: Set[Subscription] = set()
+        self._thread: Optional[threading.Thread] = None
+
+    def subscribe(self, senders: Callable[[], Set[str]]) -> Subscription:
+        subscription = Subscription(senders, queue_size())
+        with self._lock:
+            if len(self._subscriptions) >= max_subscribers():
+                raise TooManySubscribersError()
+            self._subscriptions.add(subscription)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._listen, name="live-updates", daemon=True
+                )
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def deliver(self, bloom_ids: List[int]):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        if not subscriptions:
+            return
+        for bloom in blooms.get_blooms_by_id(bloom_ids):
+            for subscription in subscriptions:
+                subscription.offer(bloom)
+
+    def _listen(self):
+        backoff = 1.0
+        while True:
+            conn = None
+            try:
+                conn = self._connect()
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {CHANNEL}")
+                backoff = 1.0
+                while True:
+                    if select.select([conn], [], [], 5.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    bloom_ids = []
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        try:
+                            bloom_ids.append(int(json.loads(notify.payload)["id"]))
+                        except (ValueError, KeyError, TypeError):
+                            continue
+                    if bloom_ids:
+                        try:
+                            self.deliver(bloom_ids)
+                        except connection.PoolTimeoutError:
+                            # Dropped, as if the subscribers were slow; they'll resume from their last id.
+                            pass
+            except psycopg2.Error:
+                # Subscribers catch up on anything missed while reconnecting by resuming from their last id.
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+
+def heartbeat_interval() -> float:
+    return float(os.getenv("STREAM_HEARTBEAT_SECONDS", "15"))
+
+
+def format_event(bloom: "blooms.Bloom", dumps: Callable[[object], str]) -> str:
+    return f"id: {bloom.id}\nevent: bloom\ndata: {dumps(bloom)}\n\n"
+
+
+def event_stream(
+    subscription: Subscription,
+    replay: List["blooms.Bloom"],
+    *,
+    replay_complete: bool,
+    dumps: Callable[[object], str],
+) -> Iterator[str]:
+    """event_stream yields a subscription's Server-Sent Events, after first replaying any blooms the client missed.
+
+    A "reset" event means too much was missed to replay, so the client should reload its timeline.
+    An "overflow" event, after which the stream ends, means the client fell behind; it should reconnect.
+    """
+    try:
+        yield "retry: 5000\n\n"
+        if not replay_complete:
+            yield "event: reset\ndata: {}\n\n"
+        replayed = set()
+        for bloom in replay:
+            replayed.add(bloom.id)
+            yield format_event(bloom, dumps)
+        next_refresh = time.monotonic() + heartbeat_interval()
+        while True:
+            try:
+                bloom = subscription.queue.get(timeout=heartbeat_interval())
+            except queue.Empty:
+                # Comments keep proxies from closing the idle connection, and reveal disconnected clients.
+                yield ": heartbeat\n\n"
+            else:
+                if bloom.id not in replayed:
+                    yield format_event(bloom, dumps)
+            if subscription.overflowed and subscription.queue.empty():
+                yield "event: overflow\ndata: {}\n\n"
+                return
+            if time.monotonic() >= next_refresh:
+                subscription.refresh()
+                next_refresh = time.monotonic() + heartbeat_interval()
+    finally:
+        broker().unsubscribe(subscription)
+
+
+_broker: Optional[Broker] = None
+_broker_lock = threading.Lock()
+
+
+def broker() -> Broker:
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = Broker(connection.connect)
+    return _broker
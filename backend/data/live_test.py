@@ -0,0 +1,79 @@
+import datetime
+import os
+import unittest
+from unittest import mock
+
+from data.blooms import Bloom
+from data.live import Subscription, event_stream
+
+
+def make_bloom(bloom_id: int, sender: str) -> Bloom:
+    return Bloom(
+        id=bloom_id,
+        sender=sender,
+        content=f"Bloom {bloom_id}",
+        sent_timestamp=datetime.datetime(2025, 1, 1),
+    )
+
+
+class TestSubscription(unittest.TestCase):
+    def test_only_queues_interesting_senders(self):
+        subscription = Subscription(lambda: {"alice"}, max_queued=10)
+        subscription.offer(make_bloom(1, "alice"))
+        subscription.offer(make_bloom(2, "bob"))
+        self.assertEqual(subscription.queue.get_nowait().id, 1)
+        self.assertTrue(subscription.queue.empty())
+
+    def test_overflows_instead_of_blocking(self):
+        subscription = Subscription(lambda: {"alice"}, max_queued=2)
+        for bloom_id in range(5):
+            subscription.offer(make_bloom(bloom_id, "alice"))
+        self.assertTrue(subscription.overflowed)
+        self.assertEqual(subscription.queue.qsize(), 2)
+
+
+class TestEventStream(unittest.TestCase):
+    def setUp(self):
+        environment = mock.patch.dict(os.environ, {"STREAM_HEARTBEAT_SECONDS": "0.01"})
+        environment.start()
+        self.addCleanup(environment.stop)
+
+    def test_replays_then_streams_until_overflow(self):
+        subscription = Subscription(lambda: {"alice"}, max_queued=2)
+        for bloom_id in [2, 3, 4]:
+            subscription.offer(make_bloom(bloom_id, "alice"))
+
+        events = list(
+            event_stream(
+                subscription,
+                [make_bloom(1, "alice"), make_bloom(2, "alice")],
+                replay_complete=True,
+                dumps=lambda bloom: str(bloom.id),
+            )
+        )
+
+        self.assertEqual(
+            events,
+            [
+                "retry: 5000\n\n",
+                "id: 1\nevent: bloom\ndata: 1\n\n",
+                "id: 2\nevent: bloom\ndata: 2\n\n",
+                # 2 was already replayed, and 4 didn't fit in the queue.
+                "id: 3\nevent: bloom\ndata: 3\n\n",
+                "event: overflow\ndata: {}\n\n",
+            ],
+        )
+
+    def test_heartbeats_while_idle(self):
+        subscription = Subscription(lambda: {"alice"}, max_queued=2)
+        stream = event_stream(
+            subscription, [], replay_complete=False, dumps=lambda bloom: ""
+        )
+        self.assertEqual(next(stream), "retry: 5000\n\n")
+        self.assertEqual(next(stream), "event: reset\ndata: {}\n\n")
+        self.assertEqual(next(stream), ": heartbeat\n\n")
+        stream.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
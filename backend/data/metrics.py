@@ -0,0 +1,229 @@
+"""Counters and histograms, exposed in the Prometheus text format.
+
+Each process keeps its own metrics. Under gunicorn every worker also saves a snapshot of
+its metrics into METRICS_DIR now and then, and whichever worker serves /metrics adds up
+the snapshots of all of them, so a scrape sees the whole server rather than one worker.
+"""
+
+import bisect
+import json
+import math
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+SNAPSHOT_INTERVAL = 1.0
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = label_values(self.labels, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def snapshot(self) -> Dict[LabelValues, float]:
+        with self._lock:
+            return dict(self._values)
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # Each value is [count per bucket (not cumulative), ..., count above the last bucket, sum].
+        self._values: Dict[LabelValues, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = label_values(self.labels, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = [0.0] * (len(self.buckets) + 2)
+                self._values[key] = counts
+            counts[index] += 1
+            counts[-1] += value
+
+    def snapshot(self) -> Dict[LabelValues, List[float]]:
+        with self._lock:
+            return {key: list(counts) for key, counts in self._values.items()}
+
+
+def label_values(names: Tuple[str, ...], labels: Dict[str, str]) -> LabelValues:
+    if labels.keys() != set(names):
+        raise ValueError(f"Expected labels {names}, got {tuple(labels)}")
+    return tuple(str(labels[name]) for name in names)
+
+
+_metrics: List = []
+_metrics_lock = threading.Lock()
+_last_snapshot = 0.0
+
+
+def counter(name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+    return register(Counter(name, help, labels))
+
+
+def histogram(
+    name: str,
+    help: str,
+    labels: Sequence[str] = (),
+    buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS,
+) -> Histogram:
+    return register(Histogram(name, help, labels, buckets))
+
+
+def register(metric):
+    with _metrics_lock:
+        _metrics.append(metric)
+    return metric
+
+
+def metrics_dir() -> Optional[str]:
+    return os.getenv("METRICS_DIR") or None
+
+
+def snapshot() -> Dict[str, Dict[str, List]]:
+    """snapshot returns this process's metrics as JSON-compatible data."""
+    with _metrics_lock:
+        metrics = list(_metrics)
+    return {
+        metric.name: {
+            json.dumps(key): value for key, value in metric.snapshot().items()
+        }
+        for metric in metrics
+    }
+
+
+def save_snapshot(*, force: bool = False):
+    """save_snapshot writes this process's metrics into METRICS_DIR, at most once a SNAPSHOT_INTERVAL unless forced."""
+    global _last_snapshot
+    directory = metrics_dir()
+    if directory is None:
+        return
+    now = time.monotonic()
+    if not force and now - _last_snapshot < SNAPSHOT_INTERVAL:
+        return
+    _last_snapshot = now
+    path = os.path.join(directory, f"{os.getpid()}.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(snapshot(), f)
+    # Renaming is atomic, so readers never see a half-written snapshot.
+    os.replace(path + ".tmp", path)
+
+
+def collect() -> Dict[str, Dict[str, List]]:
+    """collect returns the sum of the metrics of every process sharing METRICS_DIR, or just this one's."""
+    own = snapshot()
+    directory = metrics_dir()
+    if directory is None:
+        return own
+    totals = {name: {} for name in own}
+    snapshots = [own]
+    own_filename = f"{os.getpid()}.json"
+    for filename in os.listdir(directory):
+        if not filename.endswith(".json") or filename == own_filename:
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    for other in snapshots:
+        for name, values in other.items():
+            if name not in totals:
+                continue
+            for key, value in values.items():
+                totals[name][key] = add_values(totals[name].get(key), value)
+    return totals
+
+
+def add_values(total, value):
+    if total is None:
+        return value
+    if isinstance(value, list):
+        return [a + b for a, b in zip(total, value)]
+    return total + value
+
+
+def render() -> str:
+    """render returns every metric in the Prometheus text exposition format."""
+    values = collect()
+    with _metrics_lock:
+        metrics = list(_metrics)
+    lines = []
+    for metric in metrics:
+        kind = "counter" if isinstance(metric, Counter) else "histogram"
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {kind}")
+        for key, value in sorted(values.get(metric.name, {}).items()):
+            labels = list(zip(metric.labels, json.loads(key)))
+            if kind == "counter":
+                lines.append(
+                    f"{metric.name}{format_labels(labels)} {format_number(value)}"
+                )
+                continue
+            cumulative = 0.0
+            for bound, count in zip(metric.buckets + (math.inf,), value[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else repr(bound)
+                lines.append(
+                    f"{metric.name}_bucket{format_labels(labels + [('le', le)])} {format_number(cumulative)}"
+                )
+            lines.append(
+                f"{metric.name}_sum{format_labels(labels)} {format_number(value[-1])}"
+            )
+            lines.append(
+                f"{metric.name}_count{format_labels(labels)} {format_number(cumulative)}"
+            )
+    return "\n".join(lines) + "\n"
+
+
+def format_number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def format_labels(labels: List[Tuple[str, str]]) -> str:
+    if not labels:
+        return ""
+    escaped = [
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    ]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
@@ -0,0 +1,55 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from data import metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(metrics, "_metrics", [])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_renders_histogram(self):
+        latency = metrics.histogram(
+            "test_latency_seconds", "Latency", ["endpoint"], buckets=(0.1, 1.0)
+        )
+        latency.observe(0.05, endpoint="home")
+        latency.observe(0.5, endpoint="home")
+        latency.observe(5, endpoint="home")
+        rendered = metrics.render()
+        self.assertIn("# TYPE test_latency_seconds histogram", rendered)
+        self.assertIn(
+            'test_latency_seconds_bucket{endpoint="home",le="0.1"} 1\n', rendered
+        )
+        self.assertIn(
+            'test_latency_seconds_bucket{endpoint="home",le="1.0"} 2\n', rendered
+        )
+        self.assertIn(
+            'test_latency_seconds_bucket{endpoint="home",le="+Inf"} 3\n', rendered
+        )
+        self.assertIn('test_latency_seconds_sum{endpoint="home"} 5.55\n', rendered)
+        self.assertIn('test_latency_seconds_count{endpoint="home"} 3\n', rendered)
+
+    def test_rejects_wrong_labels(self):
+        requests = metrics.counter("test_requests_total", "Requests", ["endpoint"])
+        with self.assertRaises(ValueError):
+            requests.inc(status="200")
+
+    def test_sums_snapshots_of_other_processes(self):
+        requests = metrics.counter("test_requests_total", "Requests", ["endpoint"])
+        requests.inc(3, endpoint="home")
+        with tempfile.TemporaryDirectory() as directory:
+            with mock.patch.dict(os.environ, {"METRICS_DIR": directory}):
+                with open(os.path.join(directory, "1.json"), "w") as f:
+                    f.write('{"test_requests_total": {"[\\"home\\"]": 2}}')
+                metrics.save_snapshot(force=True)
+                self.assertIn(
+                    'test_requests_total{endpoint="home"} 5\n', metrics.render()
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+from dataclasses import dataclass
+import os
+import re
+from typing import List
+
+import psycopg2.extensions
+
+MIGRATIONS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "db", "migrations"
+)
+
+MIGRATION_FILENAME = re.compile(r"^(\d{4})_(\w+)\.sql$")
+
+# Migrations starting with this line run outside a transaction, one statement at a time,
+# which CREATE INDEX CONCURRENTLY requires. Each of their statements must be idempotent.
+NO_TRANSACTION_MARKER = "-- migrate: no-transaction"
+
+CONCURRENT_INDEX = re.compile(
+    r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)",
+    re.IGNORECASE,
+)
+
+
+class MigrationError(Exception):
+    pass
+
+
+@dataclass
+class Migration:
+    version: str
+    name: str
+    sql: str
+
+    @property
+    def transactional(self) -> bool:
+        return not self.sql.lstrip().startswith(NO_TRANSACTION_MARKER)
+
+
+def load_migrations(directory: str = MIGRATIONS_DIR) -> List[Migration]:
+    """load_migrations returns every migration in directory, in the order they must be applied."""
+    migrations = []
+    for filename in sorted(os.listdir(directory)):
+        match = MIGRATION_FILENAME.match(filename)
+        if match is None:
+            continue
+        with open(os.path.join(directory, filename)) as f:
+            sql = f.read()
+        migrations.append(Migration(version=match[1], name=match[2], sql=sql))
+    versions = [migration.version for migration in migrations]
+    if len(versions) != len(set(versions)):
+        raise MigrationError(f"Duplicate migration versions in {directory}")
+    return migrations
+
+
+def split_statements(sql: str) -> List[str]:
+    """split_statements splits a migration into statements at semicolons ending a line.
+
+    It doesn't understand quoting, so is only used for no-transaction migrations.
+    """
+    statements = []
+    current = []
+    for line in sql.splitlines():
+        if line.strip().startswith("--"):
+            continue
+        current.append(line)
+        if line.rstrip().endswith(";"):
+            statement = "\n".join(current).strip()
+            if statement != ";":
+                statements.append(statement)
+            current = []
+    remainder = "\n".join(current).strip()
+    if remainder:
+        statements.append(remainder)
+    return statements
+
+
+def applied_versions(conn: psycopg2.extensions.connection) -> List[str]:
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version VARCHAR NOT NULL PRIMARY KEY,
+                    name VARCHAR NOT NULL,
+                    applied_at TIMESTAMP NOT NULL DEFAULT now()
+                )
+                """)
+            cur.execute("SELECT version FROM schema_migrations ORDER BY version")
+            return [row[0] for row in cur.fetchall()]
+
+
+def migrate(conn: psycopg2.extensions.connection, *, log=print) -> List[Migration]:
+    """migrate applies every migration which hasn't been applied yet, and returns them."""
+    already_applied = set(applied_versions(conn))
+    pending = [
+        migration
+        for migration in load_migrations()
+        if migration.version not in already_applied
+    ]
+    for migration in pending:
+        log(f"Applying migration {migration.version}_{migration.name}")
+        if migration.transactional:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(migration.sql)
+                    record_applied(cur, migration)
+        else:
+            apply_without_transaction(conn, migration)
+    return pending
+
+
+def apply_without_transaction(
+    conn: psycopg2.extensions.connection, migration: Migration
+):
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            for statement in split_statements(migration.sql):
+                index_match = CONCURRENT_INDEX.search(statement)
+                if index_match is not None:
+                    drop_if_invalid(cur, index_match[1])
+                cur.execute(statement)
+            record_applied(cur, migration)
+    finally:
+        conn.autocommit = False
+
+
+def drop_if_invalid(cur, index_name: str):
+    """drop_if_invalid drops an index left behind by a failed CREATE INDEX CONCURRENTLY.
+
+    Otherwise IF NOT EXISTS would skip rebuilding it, leaving an index the planner never uses.
+    """
+    cur.execute(
+        """
+        SELECT NOT pg_index.indisvalid
+        FROM pg_index INNER JOIN pg_class ON pg_class.oid = pg_index.indexrelid
+        WHERE pg_class.relname = %s
+        """,
+        (index_name,),
+    )
+    row = cur.fetchone()
+    if row is not None and row[0]:
+        cur.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{index_name}"')
+
+
+def record_applied(cur, migration: Migration):
+    cur.execute(
+        "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+        (migration.version, migration.name),
+    )
@@ -0,0 +1,34 @@
+import unittest
+
+from data.migrations import load_migrations, split_statements
+
+
+class TestMigrations(unittest.TestCase):
+    def test_migrations_are_ordered_and_numbered_contiguously(self):
+        versions = [migration.version for migration in load_migrations()]
+        self.assertEqual(versions, [f"{i:04d}" for i in range(1, len(versions) + 1)])
+
+    def test_concurrent_indexes_run_outside_transactions(self):
+        for migration in load_migrations():
+            if "CONCURRENTLY" in migration.sql:
+                self.assertFalse(migration.transactional, migration.name)
+
+    def test_split_statements(self):
+        sql = """-- migrate: no-transaction
+
+-- The first index.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS a_idx
+    ON a (x);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS b_idx ON b (y);
+"""
+        self.assertEqual(
+            split_statements(sql),
+            [
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS a_idx\n    ON a (x);",
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS b_idx ON b (y);",
+            ],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,310 @@
+"""Monthly partitions of the blooms and hashtags tables, and archiving old months to disk.
+
+Both tables are range-partitioned on send_timestamp, one partition per month, named like
+blooms_y2025m01. Rows in months without a partition land in a default partition, e.g.
+blooms_default, so writes never fail. create_partitions, run daily from cron by
+`admin.py create-partitions`, adds partitions for the months ahead, and moves any rows in
+the default partitions into partitions of their own.
+
+archive_month exports a month of blooms and hashtags to gzipped CSV files in
+BLOOM_ARCHIVE_DIR, then detaches and drops its partitions, so the indexes requests use
+only ever cover recent months. iter_archived_blooms reads archived months back on demand.
+"""
+
+import csv
+from dataclasses import dataclass
+import datetime
+import gzip
+import os
+import re
+from typing import Dict, Iterator, List, Optional
+
+from data.blooms import Bloom
+from data.connection import db_cursor
+from data.result_cache import ARCHIVE_TAG, cached
+
+PARTITIONED_TABLES = ("blooms", "hashtags")
+
+PARTITION_NAME = re.compile(r"^(blooms|hashtags)_(?:y(\d{4})m(\d{2})|default)$")
+
+# The columns archive files hold, in order; the rest can be recomputed when restoring.
+ARCHIVED_COLUMNS = {
+    "blooms": ["id", "sender_id", "content", "send_timestamp"],
+    "hashtags": ["id", "hashtag", "bloom_id", "send_timestamp"],
+}
+
+LAST_ARCHIVED_QUERY = "SELECT max(archived_at) FROM archived_months"
+
+
+def months_ahead() -> int:
+    return int(os.getenv("BLOOM_PARTITION_MONTHS_AHEAD", "3"))
+
+
+def archive_after_months() -> int:
+    return int(os.getenv("BLOOM_ARCHIVE_AFTER_MONTHS", "12"))
+
+
+def archive_dir() -> str:
+    return os.getenv(
+        "BLOOM_ARCHIVE_DIR",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "archive"),
+    )
+
+
+def this_month() -> datetime.date:
+    return month_start(datetime.datetime.now(tz=datetime.UTC))
+
+
+def month_start(day: datetime.date) -> datetime.date:
+    return datetime.date(day.year, day.month, 1)
+
+
+def add_months(month: datetime.date, count: int) -> datetime.date:
+    months = month.year * 12 + month.month - 1 + count
+    return datetime.date(months // 12, months % 12 + 1, 1)
+
+
+def partition_name(table: str, month: datetime.date) -> str:
+    return f"{table}_y{month:%Y}m{month:%m}"
+
+
+def parent_table(relation_name: str) -> Optional[str]:
+    """parent_table returns which partitioned table relation_name is a partition of, if any."""
+    match = PARTITION_NAME.match(relation_name)
+    return match[1] if match is not None else None
+
+
+def partition_months(cur, table: str) -> List[datetime.date]:
+    """partition_months returns the months table has a partition for, oldest first."""
+    cur.execute(
+        """
+        SELECT child.relname
+        FROM pg_inherits
+          INNER JOIN pg_class AS parent ON parent.oid = pg_inherits.inhparent
+          INNER JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = %s
+        """,
+        (table,),
+    )
+    months = []
+    for (name,) in cur.fetchall():
+        match = PARTITION_NAME.match(name)
+        if match is not None and match[2] is not None:
+            months.append(datetime.date(int(match[2]), int(match[3]), 1))
+    return sorted(months)
+
+
+@cached(lambda: [ARCHIVE_TAG])
+def last_archived_at() -> Optional[datetime.datetime]:
+    """last_archived_at returns when a month was last archived, if ever; lists of blooms only shrink then."""
+    with db_cursor(read_only=True) as cur:
+        cur.execute(LAST_ARCHIVED_QUERY)
+        return cur.fetchone()[0]
+
+
+def archived_months(cur) -> List[datetime.date]:
+    cur.execute("SELECT month FROM archived_months ORDER BY month")
+    return [row[0] for row in cur.fetchall()]
+
+
+def create_partition(cur, table: str, month: datetime.date):
+    """create_partition adds table's partition for month, moving in any of its rows from the default partition."""
+    # Postgres won't create a partition while the default partition holds rows belonging in it.
+    columns = ", ".join(ARCHIVED_COLUMNS[table])
+    bounds = dict(start=month, end=add_months(month, 1))
+    cur.execute(
+        f"CREATE TEMPORARY TABLE moving_rows AS SELECT {columns} FROM {table} LIMIT 0"
+    )
+    cur.execute(
+        f"""
+        WITH moved AS (
+          DELETE FROM {table}_default
+          WHERE send_timestamp >= %(start)s AND send_timestamp < %(end)s
+          RETURNING {columns}
+        )
+        INSERT INTO moving_rows SELECT * FROM moved
+        """,
+        bounds,
+    )
+    cur.execute(
+        f"CREATE TABLE {partition_name(table, month)} PARTITION OF {table} FOR VALUES FROM (%(start)s) TO (%(end)s)",
+        bounds,
+    )
+    cur.execute(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM moving_rows")
+    cur.execute("DROP TABLE moving_rows")
+
+
+def create_partitions(cur, *, today: Optional[datetime.date] = None) -> List[str]:
+    """create_partitions adds the partitions for this month and the next BLOOM_PARTITION_MONTHS_AHEAD.
+
+    Months with rows in the default partitions, e.g. from backdated bulk sends, get partitions
+    too, unless they were archived. It returns the names of the partitions it created.
+    """
+    current = month_start(today) if today is not None else this_month()
+    archived = set(archived_months(cur))
+    created = []
+    for table in PARTITIONED_TABLES:
+        cur.execute(
+            f"SELECT DISTINCT date_trunc('month', send_timestamp)::date FROM {table}_default"
+        )
+        wanted = {row[0] for row in cur.fetchall()} - archived
+        wanted.update(
+            add_months(current, offset) for offset in range(months_ahead() + 1)
+        )
+        for month in sorted(wanted - set(partition_months(cur, table))):
+            create_partition(cur, table, month)
+            created.append(partition_name(table, month))
+    return created
+
+
+def archivable_months(
+    cur, *, today: Optional[datetime.date] = None, after_months: Optional[int] = None
+) -> List[datetime.date]:
+    """archivable_months returns the months with partitions older than BLOOM_ARCHIVE_AFTER_MONTHS, oldest first."""
+    current = month_start(today) if today is not None else this_month()
+    cutoff = add_months(
+        current, -(after_months if after_months is not None else archive_after_months())
+    )
+    return [month for month in partition_months(cur, "blooms") if month < cutoff]
+
+
+@dataclass
+class ArchivedMonth:
+    month: datetime.date
+    bloom_count: int
+    hashtag_count: int
+
+
+def archive_month(
+    cur, month: datetime.date, *, directory: Optional[str] = None
+) -> ArchivedMonth:
+    """archive_month writes month's blooms and hashtags to gzipped CSV files, then detaches and drops their partitions.
+
+    The files are complete on disk before the partitions are dropped, and nothing is dropped
+    unless the cursor's transaction commits, so a failed archive can simply be run again.
+    Once it has, invalidate ARCHIVE_TAG, so cached lists stop showing the archived blooms.
+    """
+    directory = directory or archive_dir()
+    os.makedirs(directory, exist_ok=True)
+    counts: Dict[str, int] = {}
+    files: Dict[str, str] = {}
+    for table in PARTITIONED_TABLES:
+        name = partition_name(table, month)
+        cur.execute(f"SELECT count(*) FROM {name}")
+        counts[table] = cur.fetchone()[0]
+        files[table] = f"{name}.csv.gz"
+        path = os.path.join(directory, files[table])
+        partial_path = path + ".partial"
+        with open(partial_path, "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb") as compressed:
+                cur.copy_expert(
+                    f"COPY (SELECT {', '.join(ARCHIVED_COLUMNS[table])} FROM {name} ORDER BY send_timestamp, id) TO STDOUT WITH (FORMAT csv, HEADER)",
+                    compressed,
+                )
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(partial_path, path)
+
+    # Materialized timelines would otherwise point at blooms which are no longer there.
+    cur.execute(
+        "DELETE FROM home_timeline WHERE send_timestamp >= %s AND send_timestamp < %s",
+        (month, add_months(month, 1)),
+    )
+    for table in PARTITIONED_TABLES:
+        name = partition_name(table, month)
+        cur.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+        cur.execute(f"DROP TABLE {name}")
+    cur.execute(
+        """
+        INSERT INTO archived_months (month, bloom_count, hashtag_count, blooms_file, hashtags_file, archived_at)
+        VALUES (%s, %s, %s, %s, %s, now() AT TIME ZONE 'UTC')
+        """,
+        (
+            month,
+            counts["blooms"],
+            counts["hashtags"],
+            files["blooms"],
+            files["hashtags"],
+        ),
+    )
+    return ArchivedMonth(
+        month=month, bloom_count=counts["blooms"], hashtag_count=counts["hashtags"]
+    )
+
+
+def read_archive(path: str) -> Iterator[Dict[str, str]]:
+    with gzip.open(path, "rt", encoding="utf-8", newline="") as f:
+        yield from csv.DictReader(f)
+
+
+def iter_archived_blooms(
+    start: datetime.datetime,
+    end: datetime.datetime,
+    *,
+    sender: Optional[str] = None,
+    hashtag: Optional[str] = None,
+    directory: Optional[str] = None,
+) -> Iterator[Bloom]:
+    """iter_archived_blooms yields the archived blooms sent from start until before end, oldest first.
+
+    Pass sender or hashtag (without its leading #) to only yield the blooms sent by that user
+    or tagged with that hashtag. Only the archive files of the months in range are read.
+    """
+    directory = directory or archive_dir()
+    with db_cursor(read_only=True) as cur:
+        cur.execute(
+            "SELECT blooms_file, hashtags_file FROM archived_months WHERE month >= %s AND month < %s ORDER BY month",
+            (month_start(start), end),
+        )
+        months = cur.fetchall()
+        sender_id = None
+        if sender is not None:
+            cur.execute("SELECT id FROM users WHERE username = %s", (sender,))
+            row = cur.fetchone()
+            if row is None:
+                return
+            sender_id = row[0]
+
+    usernames: Dict[int, str] = {}
+    for blooms_file, hashtags_file in months:
+        tagged = None
+        if hashtag is not None:
+            tagged = {
+                int(row["bloom_id"])
+                for row in read_archive(os.path.join(directory, hashtags_file))
+                if row["hashtag"] == hashtag
+            }
+        batch = []
+        for row in read_archive(os.path.join(directory, blooms_file)):
+            sent_timestamp = datetime.datetime.fromisoformat(row["send_timestamp"])
+            if not start <= sent_timestamp < end:
+                continue
+            if sender_id is not None and int(row["sender_id"]) != sender_id:
+                continue
+            if tagged is not None and int(row["id"]) not in tagged:
+                continue
+            batch.append((row, sent_timestamp))
+            if len(batch) == 1000:
+                yield from blooms_from_rows(batch, usernames)
+                batch = []
+        yield from blooms_from_rows(batch, usernames)
+
+
+def blooms_from_rows(batch, usernames: Dict[int, str]) -> List[Bloom]:
+    """blooms_from_rows turns archived rows into Blooms, looking up any sender usernames not already in usernames."""
+    unknown = {int(row["sender_id"]) for row, _ in batch} - usernames.keys()
+    if unknown:
+        with db_cursor(read_only=True) as cur:
+            cur.execute(
+                "SELECT id, username FROM users WHERE id = ANY(%s)", (list(unknown),)
+            )
+            usernames.update(cur.fetchall())
+    return [
+        Bloom(
+            id=int(row["id"]),
+            sender=usernames.get(int(row["sender_id"])),
+            content=row["content"],
+            sent_timestamp=sent_timestamp,
+        )
+        for row, sent_timestamp in batch
+    ]
@@ -0,0 +1,113 @@
+from contextlib import contextmanager
+import datetime
+import gzip
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from data import partitions
+from data.fakes import RecordingCursor
+from data.partitions import add_months, parent_table, partition_name
+
+
+class TestPartitionNames(unittest.TestCase):
+    def test_add_months(self):
+        self.assertEqual(
+            add_months(datetime.date(2024, 11, 1), 3), datetime.date(2025, 2, 1)
+        )
+        self.assertEqual(
+            add_months(datetime.date(2024, 1, 1), -13), datetime.date(2022, 12, 1)
+        )
+
+    def test_names(self):
+        self.assertEqual(
+            partition_name("blooms", datetime.date(2025, 3, 1)), "blooms_y2025m03"
+        )
+        self.assertEqual(parent_table("hashtags_y2025m03"), "hashtags")
+        self.assertEqual(parent_table("blooms_default"), "blooms")
+        self.assertIsNone(parent_table("blooms"))
+        self.assertIsNone(parent_table("home_timeline"))
+
+
+class TestArchivedBlooms(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.write(
+            "blooms_y2024m01.csv.gz",
+            "id,sender_id,content,send_timestamp\n"
+            '1,7,"Hello, #purple",2024-01-02 03:04:05\n'
+            "2,8,Hi,2024-01-20 00:00:00.5\n"
+            "3,7,Bye #forest,2024-01-31 23:59:59\n",
+        )
+        self.write(
+            "hashtags_y2024m01.csv.gz",
+            "id,hashtag,bloom_id,send_timestamp\n"
+            "10,purple,1,2024-01-02 03:04:05\n"
+            "11,forest,3,2024-01-31 23:59:59\n",
+        )
+
+    def write(self, name, text):
+        with gzip.open(os.path.join(self.directory, name), "wt", newline="") as f:
+            f.write(text)
+
+    def archived(self, results, start, end, **kwargs):
+        cursor = RecordingCursor(results)
+
+        @contextmanager
+        def fake_db_cursor(*, read_only=False):
+            yield cursor
+
+        with mock.patch.object(partitions, "db_cursor", fake_db_cursor):
+            return list(
+                partitions.iter_archived_blooms(
+                    start, end, directory=self.directory, **kwargs
+                )
+            )
+
+    def test_reads_range(self):
+        blooms = self.archived(
+            [
+                [("blooms_y2024m01.csv.gz", "hashtags_y2024m01.csv.gz")],
+                [(7, "ada"), (8, "bo")],
+            ],
+            datetime.datetime(2024, 1, 2),
+            datetime.datetime(2024, 1, 31),
+        )
+        self.assertEqual([bloom.id for bloom in blooms], [1, 2])
+        self.assertEqual(blooms[0].sender, "ada")
+        self.assertEqual(blooms[0].content, "Hello, #purple")
+        self.assertEqual(
+            blooms[1].sent_timestamp, datetime.datetime(2024, 1, 20, 0, 0, 0, 500000)
+        )
+
+    def test_filters_by_sender(self):
+        blooms = self.archived(
+            [
+                [("blooms_y2024m01.csv.gz", "hashtags_y2024m01.csv.gz")],
+                [(7,)],
+                [(7, "ada")],
+            ],
+            datetime.datetime(2024, 1, 1),
+            datetime.datetime(2024, 2, 1),
+            sender="ada",
+        )
+        self.assertEqual([bloom.id for bloom in blooms], [1, 3])
+
+    def test_filters_by_hashtag(self):
+        blooms = self.archived(
+            [
+                [("blooms_y2024m01.csv.gz", "hashtags_y2024m01.csv.gz")],
+                [(7, "ada")],
+            ],
+            datetime.datetime(2024, 1, 1),
+            datetime.datetime(2024, 2, 1),
+            hashtag="forest",
+        )
+        self.assertEqual([bloom.id for bloom in blooms], [3])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,160 @@
+"""Hashes and checks passwords with scrypt, on a small thread pool of its own.
+
+scrypt is deliberately slow, so a burst of logins or sign-ups hashing in request threads
+would use every CPU and slow down all other requests. Instead each process hashes on at
+most PASSWORD_HASH_THREADS threads, with at most PASSWORD_HASH_QUEUE more hashes waiting;
+beyond that, PasswordHashingBusyError is raised straight away, and the request is told to
+retry later. hashlib.scrypt releases the GIL, so the pool's threads run in parallel.
+
+Each password hash is stored with the scrypt parameters it was made with, so stronger
+parameters can be rolled out by setting PASSWORD_SCRYPT_N (and _R, _P): each user's
+password is rehashed with them the next time they log in.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import hashlib
+import hmac
+import os
+import threading
+from typing import Callable, Optional, TypeVar
+
+from data import metrics
+from data.cache import cacheable
+
+T = TypeVar("T")
+
+rejected_hashes = metrics.counter(
+    "purpleforest_password_hashes_rejected_total",
+    "Password hashes refused because the hashing pool was full",
+)
+
+
+@cacheable
+@dataclass(frozen=True)
+class ScryptParams:
+    n: int
+    r: int
+    p: int
+
+    def max_memory(self) -> int:
+        # What OpenSSL needs for these parameters; its default limit is too low for strong ones.
+        return 128 * self.r * (self.n + 2) + 128 * self.r * self.p + 1024 * 1024
+
+
+# Every password hashed before parameters were stored used these.
+LEGACY_PARAMS = ScryptParams(n=8, r=8, p=1)
+
+
+def current_params() -> ScryptParams:
+    """current_params are the parameters new password hashes are made with."""
+    return ScryptParams(
+        n=int(os.getenv("PASSWORD_SCRYPT_N", str(LEGACY_PARAMS.n))),
+        r=int(os.getenv("PASSWORD_SCRYPT_R", str(LEGACY_PARAMS.r))),
+        p=int(os.getenv("PASSWORD_SCRYPT_P", str(LEGACY_PARAMS.p))),
+    )
+
+
+def scrypt(
+    password_plaintext: bytes, password_salt: bytes, params: ScryptParams
+) -> bytes:
+    """scrypt hashes in the calling thread; requests should use hash_password or verify_password instead."""
+    return hashlib.scrypt(
+        password_plaintext,
+        salt=password_salt,
+        n=params.n,
+        r=params.r,
+        p=params.p,
+        maxmem=params.max_memory(),
+    )
+
+
+class PasswordHashingBusyError(Exception):
+    """PasswordHashingBusyError is raised when too many passwords are already being hashed."""
+
+
+class HashingPool:
+    """HashingPool runs hashes on a fixed number of threads, refusing work once max_queued are waiting."""
+
+    def __init__(self, *, threads: int, max_queued: int):
+        if threads < 1 or max_queued < 0:
+            raise ValueError(
+                f"Invalid hashing pool size: threads={threads}, max_queued={max_queued}"
+            )
+        self._executor = ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix="password-hash"
+        )
+        # One slot for each hash running or waiting to run.
+        self._slots = threading.BoundedSemaphore(threads + max_queued)
+
+    def run(self, func: Callable[..., T], *args) -> T:
+        if not self._slots.acquire(blocking=False):
+            rejected_hashes.inc()
+            raise PasswordHashingBusyError("Too many passwords are being hashed")
+
+        def run_in_slot():
+            try:
+                return func(*args)
+            finally:
+                self._slots.release()
+
+        try:
+            future = self._executor.submit(run_in_slot)
+        except BaseException:
+            self._slots.release()
+            raise
+        return future.result()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def hash_threads() -> int:
+    return int(os.getenv("PASSWORD_HASH_THREADS", "1"))
+
+
+def max_queued_hashes() -> int:
+    # Each hash running or waiting holds a request thread, so always leave one free.
+    default = min(4, max(0, int(os.getenv("WEB_THREADS", "4")) - hash_threads() - 1))
+    return int(os.getenv("PASSWORD_HASH_QUEUE", str(default)))
+
+
+_pool: Optional[HashingPool] = None
+_pool_lock = threading.Lock()
+
+
+def hashing_pool() -> HashingPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = HashingPool(
+                    threads=hash_threads(), max_queued=max_queued_hashes()
+                )
+    return _pool
+
+
+def forget_hashing_pool():
+    """forget_hashing_pool drops the pool in a freshly forked process, whose copy has no threads."""
+    global _pool
+    with _pool_lock:
+        _pool = None
+
+
+def hash_password(
+    password_plaintext: str, password_salt: bytes, params: ScryptParams
+) -> bytes:
+    return hashing_pool().run(
+        scrypt, password_plaintext.encode("utf-8"), password_salt, params
+    )
+
+
+def verify_password(
+    password_plaintext: str,
+    password_salt: bytes,
+    password_scrypt: bytes,
+    params: ScryptParams,
+) -> bool:
+    candidate = hash_password(password_plaintext, password_salt, params)
+    # Comparing in constant time doesn't reveal how much of the hash matched.
+    return hmac.compare_digest(candidate, password_scrypt)
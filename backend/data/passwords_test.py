@@ -0,0 +1,134 @@
+import hashlib
+import threading
+import time
+import unittest
+from unittest import mock
+
+from data import passwords
+from data.passwords import (
+    LEGACY_PARAMS,
+    HashingPool,
+    PasswordHashingBusyError,
+    ScryptParams,
+)
+
+
+class TestHashingPool(unittest.TestCase):
+    def test_runs_work(self):
+        pool = HashingPool(threads=2, max_queued=0)
+        self.addCleanup(pool.shutdown)
+        self.assertEqual(pool.run(lambda a, b: a + b, 1, 2), 3)
+
+    def test_refuses_work_when_full(self):
+        pool = HashingPool(threads=1, max_queued=1)
+        self.addCleanup(pool.shutdown)
+        release = threading.Event()
+        started = threading.Semaphore(0)
+
+        def block():
+            started.release()
+            release.wait()
+
+        callers = [threading.Thread(target=pool.run, args=(block,)) for _ in range(2)]
+        for caller in callers:
+            caller.start()
+        # Once one is running and the other waiting, there's no room for a third.
+        started.acquire()
+        while pool._slots._value > 0:
+            time.sleep(0.001)
+        with self.assertRaises(PasswordHashingBusyError):
+            pool.run(lambda: None)
+
+        release.set()
+        for caller in callers:
+            caller.join()
+        self.assertIsNone(pool.run(lambda: None))
+
+    def test_frees_slot_when_work_fails(self):
+        pool = HashingPool(threads=1, max_queued=0)
+        self.addCleanup(pool.shutdown)
+
+        def fail():
+            raise ValueError("boom")
+
+        with self.assertRaises(ValueError):
+            pool.run(fail)
+        self.assertEqual(pool.run(lambda: 1), 1)
+
+    def test_default_size_leaves_request_threads_free(self):
+        for web_threads in ("1", "2", "4", "8", "32"):
+            with mock.patch.dict("os.environ", {"WEB_THREADS": web_threads}):
+                threads = passwords.hash_threads()
+                max_queued = passwords.max_queued_hashes()
+            self.assertGreaterEqual(max_queued, 0)
+            if int(web_threads) > threads:
+                self.assertLess(threads + max_queued, int(web_threads))
+
+    def test_saturated_pool_leaves_request_capacity(self):
+        web_threads = 4
+        with mock.patch.dict("os.environ", {"WEB_THREADS": str(web_threads)}):
+            pool = HashingPool(
+                threads=passwords.hash_threads(),
+                max_queued=passwords.max_queued_hashes(),
+            )
+        self.addCleanup(pool.shutdown)
+        release = threading.Event()
+        refused = threading.Semaphore(0)
+
+        def log_in():
+            try:
+                pool.run(release.wait)
+            except PasswordHashingBusyError:
+                refused.release()
+
+        # A burst of logins on every request thread: those the pool takes wait for it.
+        callers = [threading.Thread(target=log_in) for _ in range(web_threads)]
+        for caller in callers:
+            caller.start()
+        # At least one is refused straight away, so its thread is free for other requests.
+        self.assertTrue(refused.acquire(timeout=5))
+
+        release.set()
+        for caller in callers:
+            caller.join()
+
+
+class TestPasswords(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(
+            passwords, "_pool", HashingPool(threads=1, max_queued=0)
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_legacy_params_match_existing_hashes(self):
+        self.assertEqual(
+            passwords.hash_password("secret", b"salt", LEGACY_PARAMS),
+            hashlib.scrypt(b"secret", salt=b"salt", n=8, r=8, p=1),
+        )
+
+    def test_verify_password(self):
+        params = ScryptParams(n=16, r=8, p=1)
+        stored = passwords.hash_password("secret", b"salt", params)
+        self.assertTrue(passwords.verify_password("secret", b"salt", stored, params))
+        self.assertFalse(passwords.verify_password("wrong", b"salt", stored, params))
+        # The same password checked with other parameters doesn't match.
+        self.assertFalse(
+            passwords.verify_password("secret", b"salt", stored, LEGACY_PARAMS)
+        )
+
+    def test_strong_params_fit_in_memory_limit(self):
+        params = ScryptParams(n=2**15, r=8, p=1)
+        self.assertEqual(len(passwords.scrypt(b"secret", b"salt", params)), 64)
+
+    def test_current_params_default_to_legacy(self):
+        with mock.patch.dict("os.environ", {}, clear=True):
+            self.assertEqual(passwords.current_params(), LEGACY_PARAMS)
+        with mock.patch.dict("os.environ", {"PASSWORD_SCRYPT_N": "16384"}):
+            self.assertEqual(
+                passwords.current_params(), ScryptParams(n=16384, r=8, p=1)
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
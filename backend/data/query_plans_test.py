@@ -0,0 +1,244 @@
+from contextlib import contextmanager
+import os
+import unittest
+from unittest import mock
+
+import psycopg2
+
+from data import (
+    blooms,
+    follows,
+    migrations,
+    partitions,
+    search,
+    suggestions,
+    user_stats,
+    users,
+)
+
+# This check needs a throwaway database, which it migrates and seeds, e.g.
+#   QUERY_PLAN_CHECK_DSN="dbname=plans user=postgres password=... host=127.0.0.1" python3 -m pytest data/query_plans_test.py
+DSN = os.getenv("QUERY_PLAN_CHECK_DSN")
+
+# Tables which grow with usage, so must never be read in full by a request.
+HOT_TABLES = {
+    "blooms",
+    "follows",
+    "hashtags",
+    "home_timeline",
+    "suggested_follows",
+    "user_stats",
+    "users",
+}
+
+SEED_SQL = """
+INSERT INTO users (username, password_salt, password_scrypt)
+SELECT 'user' || i, '\\x00'::bytea, '\\x00'::bytea FROM generate_series(1, 20000) AS i;
+
+INSERT INTO follows (follower, followee)
+SELECT users.id, 1 + (users.id * 7919 + k * 104729) % 20000
+FROM users, generate_series(1, 25) AS k
+ON CONFLICT DO NOTHING;
+
+INSERT INTO blooms (id, sender_id, content, send_timestamp)
+SELECT i, 1 + i % 20000, 'Bloom number ' || i || ' #tag' || i % 500, now() - i * interval '1 minute'
+FROM generate_series(1, 400000) AS i;
+
+INSERT INTO hashtags (hashtag, bloom_id, send_timestamp)
+SELECT 'tag' || id % 500, id, send_timestamp FROM blooms;
+
+INSERT INTO home_timeline (user_id, bloom_id, send_timestamp)
+SELECT follows.follower, blooms.id, blooms.send_timestamp
+FROM follows INNER JOIN blooms ON blooms.sender_id = follows.followee
+WHERE follows.follower <= 100;
+"""
+
+
+class ExplainingCursor:
+    """ExplainingCursor records the plan of every SELECT before running it.
+
+    Server cursors' plans favour returning the first rows quickly, so those are explained as a DECLARE.
+    """
+
+    def __init__(self, cur, plans, *, server=False):
+        self._cur = cur
+        self._plans = plans
+        self._server = server
+
+    def execute(self, query, args=None):
+        if query.lstrip().upper().startswith(("SELECT", "WITH")):
+            declare = "DECLARE explained CURSOR FOR " if self._server else ""
+            self._cur.execute("EXPLAIN (FORMAT JSON) " + declare + query, args)
+            self._plans.append((query, self._cur.fetchone()[0][0]["Plan"]))
+        self._cur.execute(query, args)
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+    def __iter__(self):
+        return iter(self._cur)
+
+
+def sequential_scans(plan):
+    """sequential_scans yields the name of every relation plan reads in full."""
+    if plan["Node Type"] == "Seq Scan":
+        yield plan["Relation Name"]
+    for child in plan.get("Plans", []):
+        yield from sequential_scans(child)
+
+
+def is_hot(relation):
+    # Scanning any partition of a hot table counts, e.g. blooms_y2025m01.
+    return (partitions.parent_table(relation) or relation) in HOT_TABLES
+
+
+@unittest.skipUnless(DSN, "set QUERY_PLAN_CHECK_DSN to check query plans")
+class TestQueryPlans(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.conn = psycopg2.connect(DSN)
+        migrations.migrate(cls.conn, log=lambda message: None)
+        with cls.conn:
+            with cls.conn.cursor() as cur:
+                cur.execute("SELECT EXISTS (SELECT 1 FROM users)")
+                if not cur.fetchone()[0]:
+                    cur.execute(SEED_SQL)
+                    # Spread the seeded blooms from the default partitions into monthly ones.
+                    partitions.create_partitions(cur)
+                    user_stats.recount(cur)
+                    cur.execute("SELECT id FROM users WHERE id <= 100")
+                    for (user_id,) in cur.fetchall():
+                        suggestions.refresh_suggestions(cur, user_id)
+        cls.conn.autocommit = True
+        with cls.conn.cursor() as cur:
+            cur.execute("ANALYZE")
+        cls.conn.autocommit = False
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.close()
+
+    def setUp(self):
+        self.plans = []
+
+        # Every call must reach the database to have its plan checked.
+        environment = mock.patch.dict(os.environ, {"RESULT_CACHE": "false"})
+        environment.start()
+        self.addCleanup(environment.stop)
+
+        @contextmanager
+        def explaining_db_cursor(*, read_only=False, fetch_size=None):
+            with self.conn:
+                with self.conn.cursor() as cur:
+                    yield ExplainingCursor(cur, self.plans)
+
+        @contextmanager
+        def explaining_db_server_cursor(*, read_only=False, fetch_size=None):
+            with self.conn:
+                with self.conn.cursor() as cur:
+                    yield ExplainingCursor(cur, self.plans, server=True)
+
+        for module in [blooms, follows, search, suggestions, user_stats, users]:
+            patcher = mock.patch.object(module, "db_cursor", explaining_db_cursor)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(
+            blooms, "db_server_cursor", explaining_db_server_cursor
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        users.user_cache().clear()
+        self.user = users.get_user("user42")
+        self.other_user = users.get_user("user4242")
+
+    @contextmanager
+    def explained(self):
+        self.plans.clear()
+        yield
+        self.assertTrue(self.plans, "No queries were run")
+        for query, plan in self.plans:
+            scanned = [
+                relation
+                for relation in sequential_scans(plan)
+                if is_hot(relation) and self.pages(relation) > 0
+            ]
+            self.assertEqual(scanned, [], f"Sequential scan in:\n{query}")
+
+    def pages(self, relation):
+        # The planner always scans an empty table, such as next month's partition, in full.
+        with self.conn:
+            with self.conn.cursor() as cur:
+                cur.execute(
+                    "SELECT relpages FROM pg_class WHERE relname = %s", (relation,)
+                )
+                return cur.fetchone()[0]
+
+    def test_get_user(self):
+        with self.explained():
+            users.user_cache().clear()
+            users.get_user("user4242")
+
+    def test_get_blooms_for_user(self):
+        with self.explained():
+            page = blooms.get_blooms_for_user("user42", limit=50)
+            blooms.get_blooms_for_user(
+                "user42", before=blooms.Cursor.after(page[-1]), limit=50
+            )
+
+    def test_get_bloom(self):
+        with self.explained():
+            blooms.get_bloom(1234)
+
+    def test_get_blooms_with_hashtag(self):
+        with self.explained():
+            page = blooms.get_blooms_with_hashtag("tag7", limit=50)
+            blooms.get_blooms_with_hashtag(
+                "tag7", before=blooms.Cursor.after(page[-1]), limit=50
+            )
+            blooms.get_hashtag_version("tag7")
+
+    def test_exports(self):
+        with self.explained():
+            list(blooms.iter_blooms_for_user("user42"))
+            list(blooms.iter_blooms_with_hashtag("tag7"))
+
+    def test_search(self):
+        with self.explained():
+            page = search.search_blooms("bloom tag7", limit=50)
+            search.search_blooms(
+                "bloom tag7",
+                before=search.next_cursor(page[-1], search.RELEVANCE),
+                limit=50,
+            )
+            search.search_blooms("number 12", order=search.RECENT, limit=50)
+
+    def test_merged_home_timeline(self):
+        with self.explained():
+            page = blooms.get_merged_home_timeline(self.user, limit=50)
+            blooms.get_merged_home_timeline(
+                self.user, before=blooms.Cursor.after(page[-1]), limit=50
+            )
+
+    def test_materialized_home_timeline(self):
+        with self.explained():
+            blooms.get_materialized_home_timeline(self.user, limit=50)
+
+    def test_follow_lists(self):
+        with self.explained():
+            follows.get_followed_usernames(self.user, limit=50)
+            follows.get_inverse_followed_usernames(self.user, limit=50)
+            follows.is_following(self.user, self.other_user)
+
+    def test_profile_stats(self):
+        with self.explained():
+            user_stats.get_user_stats(self.user)
+
+    def test_suggested_follows(self):
+        with self.explained():
+            suggestions.get_suggested_follows(self.user, 3)
+            suggestions.get_suggested_follows(self.other_user, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import functools
+import os
+import unittest
+from unittest import mock
+
+from flask import Flask, g
+import psycopg2
+
+from data import connection
+
+# This check needs two throwaway databases, standing in for a primary and its replica, e.g.
+#   REPLICA_CHECK_PRIMARY_DSN="dbname=primary user=postgres password=... host=127.0.0.1 port=5432" \
+#   REPLICA_CHECK_REPLICA_DSN="dbname=replica user=postgres password=... host=127.0.0.1 port=5433" \
+#   python3 -m pytest data/replicas_test.py
+# They needn't actually replicate: each is labelled, so the tests can tell which one answered,
+# and the stand-in replica is taken to be caught up, as it isn't in recovery.
+PRIMARY_DSN = os.getenv("REPLICA_CHECK_PRIMARY_DSN")
+REPLICA_DSN = os.getenv("REPLICA_CHECK_REPLICA_DSN")
+UNREACHABLE_DSN = "host=127.0.0.1 port=1 connect_timeout=1"
+
+
+def label(dsn: str, name: str):
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("CREATE TABLE IF NOT EXISTS replica_check (name TEXT)")
+                cur.execute("DELETE FROM replica_check")
+                cur.execute("INSERT INTO replica_check (name) VALUES (%s)", (name,))
+    finally:
+        conn.close()
+
+
+@unittest.skipUnless(
+    PRIMARY_DSN and REPLICA_DSN,
+    "set REPLICA_CHECK_PRIMARY_DSN and REPLICA_CHECK_REPLICA_DSN to check replica routing",
+)
+class TestReplicaRouting(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        label(PRIMARY_DSN, "primary")
+        label(REPLICA_DSN, "replica")
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.configure(REPLICA_DSN)
+        patcher = mock.patch.object(
+            connection, "connect", functools.partial(psycopg2.connect, PRIMARY_DSN)
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(connection, "REPLICA_LAG_QUERY", "SELECT 0")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def configure(self, replica_dsns: str, **settings: str):
+        connection.close_pool()
+        self.addCleanup(connection.close_pool)
+        environment = {
+            "POSTGRES_REPLICA_DSNS": replica_dsns,
+            "POSTGRES_POOL_MIN_SIZE": "0",
+        }
+        environment.update(settings)
+        patcher = mock.patch.dict(os.environ, environment)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def answered_by(self, *, read_only: bool) -> str:
+        with connection.db_cursor(read_only=read_only) as cur:
+            cur.execute("SELECT name FROM replica_check")
+            return cur.fetchone()[0]
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self.answered_by(read_only=True), "replica")
+
+    def test_writes_go_to_primary(self):
+        self.assertEqual(self.answered_by(read_only=False), "primary")
+
+    def test_reads_after_write_go_to_primary(self):
+        with self.app.test_request_context("/"):
+            self.assertEqual(self.answered_by(read_only=True), "replica")
+            self.assertEqual(self.answered_by(read_only=False), "primary")
+            self.assertEqual(self.answered_by(read_only=True), "primary")
+            self.assertTrue(g._wrote)
+            connection.release_request_connection()
+
+    def test_falls_back_when_replica_unreachable(self):
+        self.configure(UNREACHABLE_DSN)
+        self.assertEqual(self.answered_by(read_only=True), "primary")
+
+    def test_falls_back_when_replica_lagging(self):
+        self.configure(REPLICA_DSN, POSTGRES_REPLICA_MAX_LAG="-1")
+        self.assertEqual(self.answered_by(read_only=True), "primary")
+
+    def test_skips_unreachable_replica_among_others(self):
+        self.configure(f"{REPLICA_DSN},{UNREACHABLE_DSN},{REPLICA_DSN}")
+        answers = {self.answered_by(read_only=True) for _ in range(6)}
+        self.assertEqual(answers, {"replica"})
+        self.assertEqual(len(connection.get_replicas()), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
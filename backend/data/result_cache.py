@@ -0,0 +1,208 @@
+"""A cache of read query results which writes invalidate precisely.
+
+Every cached result is filed under one or more tags, such as "user:<username>" or
+"hashtag:<tag>". Each tag has a version token stored in the cache, and the token is
+part of the key of every result filed under the tag. Invalidating a tag just
+replaces its token, so all of its results, whatever their arguments, become
+unreachable at once and age out of the cache. This works the same whether the
+cache lives in this process or is shared between processes.
+
+Reads may come from replicas which lag the primary, so a result computed shortly after
+one of its tags was invalidated may predate the write; such results are returned but
+not cached.
+
+Invalidation only reaches the cache it is made in, so with several worker processes the
+cache must be shared: it is on by default only when CACHE_REDIS_URL is set.
+"""
+
+import functools
+import hashlib
+import os
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterable, List
+
+from data.cache import MISSING, CacheStats, make_cache
+from data.connection import env_flag, get_replicas, replica_max_lag
+from data.users import User
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ResultCache:
+    def __init__(self, cache, *, settle_seconds: float = 0.0):
+        self._cache = cache
+        self.settle_seconds = settle_seconds
+        self._flights: Dict[str, _Flight] = {}
+        self._flights_lock = threading.Lock()
+        # Counted here rather than by the underlying cache, which also sees version lookups.
+        self._stats = CacheStats()
+
+    def get_or_compute(
+        self, *, key: str, tags: Iterable[str], compute: Callable[[], Any]
+    ) -> Any:
+        """get_or_compute returns the cached result for key, or computes and caches it.
+
+        Concurrent misses for the same key share a single computation (single-flight),
+        so a popular entry expiring doesn't send a stampede of identical queries to the database.
+        """
+        versions = [self._version(tag) for tag in tags]
+        versioned_key = key + "|" + "|".join(versions)
+        result = self._cache.get(versioned_key)
+        with self._flights_lock:
+            if result is not MISSING:
+                self._stats.hits += 1
+                return detached(result)
+            self._stats.misses += 1
+            flight = self._flights.get(versioned_key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[versioned_key] = flight
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return detached(flight.result)
+
+        try:
+            flight.result = compute()
+            if self._settled(versions):
+                self._cache.set(versioned_key, flight.result)
+            return detached(flight.result)
+        except BaseException as error:
+            flight.error = error
+            raise
+        finally:
+            with self._flights_lock:
+                del self._flights[versioned_key]
+            flight.done.set()
+
+    def invalidate(self, *tags: str):
+        """invalidate drops every result filed under any of tags. Call it after the write has committed."""
+        for tag in tags:
+            self._cache.set("version:" + tag, new_version())
+
+    def stats(self) -> CacheStats:
+        with self._flights_lock:
+            return CacheStats(
+                hits=self._stats.hits,
+                misses=self._stats.misses,
+                evictions=self._cache.stats().evictions,
+            )
+
+    def _version(self, tag: str) -> str:
+        version = self._cache.get("version:" + tag)
+        if version is MISSING:
+            # An evicted version invalidates its results, which is always safe.
+            version = new_version()
+            self._cache.set("version:" + tag, version)
+        return version
+
+    def _settled(self, versions: List[str]) -> bool:
+        """_settled is whether every replica must have seen the writes which last changed these versions."""
+        if self.settle_seconds <= 0:
+            return True
+        now = time.time()
+        return all(
+            now - float(version.partition(":")[2] or 0) >= self.settle_seconds
+            for version in versions
+        )
+
+
+def detached(result: Any) -> Any:
+    """detached copies list results, so callers changing their list don't change the cached one."""
+    return list(result) if isinstance(result, list) else result
+
+
+def new_version() -> str:
+    # Versions record when they were made, to tell when replicas have caught up with the invalidating write.
+    return f"{uuid.uuid4().hex}:{time.time():.3f}"
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def result_cache() -> ResultCache:
+    global _result_cache
+    if _result_cache is None:
+        with _result_cache_lock:
+            if _result_cache is None:
+                _result_cache = ResultCache(
+                    make_cache(
+                        "results",
+                        max_entries=int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "10000")),
+                        ttl=float(os.getenv("RESULT_CACHE_TTL", "300")),
+                    ),
+                    settle_seconds=replica_max_lag() if get_replicas() else 0.0,
+                )
+    return _result_cache
+
+
+def result_cache_stats() -> CacheStats:
+    return result_cache().stats()
+
+
+def result_cache_enabled() -> bool:
+    # An in-process cache would only be invalidated in the worker which made the write.
+    return env_flag("RESULT_CACHE", bool(os.getenv("CACHE_REDIS_URL")))
+
+
+def cached(tags: Callable[..., List[str]]):
+    """cached caches a read function's results, filed under the tags computed from its arguments."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not result_cache_enabled():
+                return func(*args, **kwargs)
+            return result_cache().get_or_compute(
+                key=cache_key(func, args, kwargs),
+                tags=tags(*args, **kwargs),
+                compute=lambda: func(*args, **kwargs),
+            )
+
+        return wrapper
+
+    return decorator
+
+
+def cache_key(func: Callable, args: tuple, kwargs: Dict[str, Any]) -> str:
+    """cache_key identifies a call to func, with users identified by their id alone."""
+    return hashlib.sha1(
+        repr(
+            (
+                func.__module__,
+                func.__qualname__,
+                [key_argument(arg) for arg in args],
+                sorted((name, key_argument(arg)) for name, arg in kwargs.items()),
+            )
+        ).encode("utf-8")
+    ).hexdigest()
+
+
+def key_argument(arg: Any) -> Any:
+    # A user's repr includes their password hash, which mustn't be written into keys in a shared cache.
+    if isinstance(arg, User):
+        return ("user", arg.id)
+    return arg
+
+
+# Results which archiving a month of blooms may change, whoever sent them.
+ARCHIVE_TAG = "archive"
+
+
+def user_tag(username: str) -> str:
+    return f"user:{username}"
+
+
+def hashtag_tag(hashtag: str) -> str:
+    return f"hashtag:{hashtag}"
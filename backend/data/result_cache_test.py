@@ -0,0 +1,166 @@
+import os
+import threading
+import unittest
+from unittest import mock
+
+from data.cache import LocalCache
+from data.result_cache import ResultCache, cache_key, result_cache_enabled
+from data.users import User
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = ResultCache(LocalCache(max_entries=100, ttl=60))
+        self.computations = 0
+
+    def compute(self, value):
+        def compute():
+            self.computations += 1
+            return value
+
+        return compute
+
+    def test_caches_results(self):
+        for _ in range(3):
+            result = self.cache.get_or_compute(
+                key="a", tags=["user:a"], compute=self.compute([1, 2])
+            )
+            self.assertEqual(result, [1, 2])
+        self.assertEqual(self.computations, 1)
+        stats = self.cache.stats()
+        self.assertEqual((stats.hits, stats.misses), (2, 1))
+
+    def test_callers_get_their_own_lists(self):
+        first = self.cache.get_or_compute(key="a", tags=[], compute=self.compute([1]))
+        first.append(2)
+        second = self.cache.get_or_compute(key="a", tags=[], compute=self.compute([3]))
+        self.assertEqual(second, [1])
+        second.append(4)
+        self.assertEqual(
+            self.cache.get_or_compute(key="a", tags=[], compute=self.compute([5])), [1]
+        )
+
+    def test_invalidation_is_per_tag(self):
+        self.cache.get_or_compute(key="a", tags=["user:a"], compute=self.compute(1))
+        self.cache.get_or_compute(key="b", tags=["user:b"], compute=self.compute(2))
+        self.cache.invalidate("user:a")
+        self.assertEqual(
+            self.cache.get_or_compute(
+                key="a", tags=["user:a"], compute=self.compute(3)
+            ),
+            3,
+        )
+        self.assertEqual(
+            self.cache.get_or_compute(
+                key="b", tags=["user:b"], compute=self.compute(4)
+            ),
+            2,
+        )
+
+    def test_any_tag_invalidates(self):
+        tags = ["user:a", "user:b"]
+        self.cache.get_or_compute(key="a-b", tags=tags, compute=self.compute(1))
+        self.cache.invalidate("user:b")
+        self.assertEqual(
+            self.cache.get_or_compute(key="a-b", tags=tags, compute=self.compute(2)), 2
+        )
+
+    def test_concurrent_misses_compute_once(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_compute():
+            self.computations += 1
+            started.set()
+            release.wait()
+            return "value"
+
+        results = []
+
+        def fetch():
+            results.append(
+                self.cache.get_or_compute(key="a", tags=[], compute=slow_compute)
+            )
+
+        leader = threading.Thread(target=fetch)
+        leader.start()
+        started.wait()
+        followers = [threading.Thread(target=fetch) for _ in range(5)]
+        for follower in followers:
+            follower.start()
+        release.set()
+        for thread in [leader] + followers:
+            thread.join()
+        self.assertEqual(results, ["value"] * 6)
+        self.assertEqual(self.computations, 1)
+
+    def test_errors_are_not_cached(self):
+        def fail():
+            raise RuntimeError("database down")
+
+        with self.assertRaises(RuntimeError):
+            self.cache.get_or_compute(key="a", tags=[], compute=fail)
+        self.assertEqual(
+            self.cache.get_or_compute(key="a", tags=[], compute=self.compute(1)), 1
+        )
+
+    def test_results_not_cached_until_replicas_settle(self):
+        cache = ResultCache(LocalCache(max_entries=100, ttl=60), settle_seconds=60)
+        cache.invalidate("user:a")
+        for value in (1, 2):
+            self.assertEqual(
+                cache.get_or_compute(
+                    key="a", tags=["user:a"], compute=self.compute(value)
+                ),
+                value,
+            )
+        self.assertEqual(self.computations, 2)
+
+
+class TestResultCacheEnabled(unittest.TestCase):
+    def test_on_by_default_only_when_shared(self):
+        with mock.patch.dict(os.environ, {}, clear=True):
+            self.assertFalse(result_cache_enabled())
+        with mock.patch.dict(
+            os.environ, {"CACHE_REDIS_URL": "redis://127.0.0.1:6379/0"}, clear=True
+        ):
+            self.assertTrue(result_cache_enabled())
+
+    def test_flag_overrides_default(self):
+        with mock.patch.dict(os.environ, {"RESULT_CACHE": "true"}, clear=True):
+            self.assertTrue(result_cache_enabled())
+        with mock.patch.dict(
+            os.environ,
+            {"RESULT_CACHE": "false", "CACHE_REDIS_URL": "redis://127.0.0.1:6379/0"},
+            clear=True,
+        ):
+            self.assertFalse(result_cache_enabled())
+
+
+class TestCacheKey(unittest.TestCase):
+    def user(self, user_id, password_scrypt):
+        return User(
+            id=user_id,
+            username=f"user{user_id}",
+            password_salt=b"salt",
+            password_scrypt=password_scrypt,
+        )
+
+    def test_users_keyed_by_id_alone(self):
+        def read(user, *, other):
+            pass
+
+        key = cache_key(read, (self.user(1, b"a"),), {"other": self.user(2, b"a")})
+        self.assertEqual(
+            key, cache_key(read, (self.user(1, b"b"),), {"other": self.user(2, b"b")})
+        )
+        self.assertNotEqual(
+            key, cache_key(read, (self.user(3, b"a"),), {"other": self.user(2, b"a")})
+        )
+        self.assertNotEqual(
+            key, cache_key(read, (self.user(1, b"a"),), {"other": self.user(3, b"a")})
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,251 @@
+"""Full-text search over bloom content.
+
+Blooms are matched by a GIN index over their search_vector column (see
+db/migrations/0007_bloom_search.sql). A bloom matches if it contains every word of the
+query, with the last word also matching as a prefix, so results can follow typing.
+InvertedIndex answers the same queries in memory, with the same semantics, for tests.
+"""
+
+import base64
+import binascii
+import bisect
+import datetime
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Union
+
+from data.blooms import Bloom, Cursor, InvalidCursorError, make_before_clause
+from data.connection import db_cursor
+
+MAXIMUM_QUERY_WORDS = 10
+
+RELEVANCE = "relevance"
+RECENT = "recent"
+ORDERS = (RELEVANCE, RECENT)
+
+# Letters and digits, roughly as Postgres' text search parser splits words.
+WORD = re.compile(r"[^\W_]+")
+
+
+class InvalidQueryError(ValueError):
+    pass
+
+
+@dataclass
+class SearchResult:
+    bloom: Bloom
+    rank: float
+
+
+@dataclass(frozen=True)
+class RankCursor:
+    """RankCursor marks a position in a list of search results, best match first."""
+
+    rank: float
+    send_timestamp: datetime.datetime
+    bloom_id: int
+
+    @staticmethod
+    def after(result: SearchResult) -> "RankCursor":
+        return RankCursor(
+            rank=result.rank,
+            send_timestamp=result.bloom.sent_timestamp,
+            bloom_id=result.bloom.id,
+        )
+
+    def encode(self) -> str:
+        raw = f"{self.rank!r}|{self.send_timestamp.isoformat()}|{self.bloom_id}"
+        return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+    @staticmethod
+    def decode(encoded: str) -> "RankCursor":
+        try:
+            padded = encoded + "=" * (-len(encoded) % 4)
+            raw = base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8")
+            rank_str, timestamp_str, bloom_id_str = raw.split("|")
+            return RankCursor(
+                rank=float(rank_str),
+                send_timestamp=datetime.datetime.fromisoformat(timestamp_str),
+                bloom_id=int(bloom_id_str),
+            )
+        except (binascii.Error, UnicodeError, ValueError):
+            raise InvalidCursorError(f"Invalid cursor: {encoded}")
+
+
+SearchCursor = Union[RankCursor, Cursor]
+
+
+def query_words(query: str) -> List[str]:
+    """query_words returns the words to search for, lower-cased, raising InvalidQueryError if there are none."""
+    words = WORD.findall(query.lower())[:MAXIMUM_QUERY_WORDS]
+    if not words:
+        raise InvalidQueryError("Search query must contain a letter or digit")
+    return words
+
+
+def to_tsquery_text(words: List[str]) -> str:
+    # The words only contain letters and digits, so can't contain tsquery operators.
+    return " & ".join(words[:-1] + [words[-1] + ":*"])
+
+
+def search_blooms(
+    query: str,
+    *,
+    order: str = RELEVANCE,
+    before: Optional[SearchCursor] = None,
+    limit: int,
+) -> List[SearchResult]:
+    """search_blooms returns a page of blooms matching query, best match or newest first."""
+    kwargs = {
+        "query": to_tsquery_text(query_words(query)),
+        "limit": limit,
+    }
+    if order == RELEVANCE:
+        before_clause = ""
+        if before is not None:
+            before_clause = "WHERE (rank, send_timestamp, matches.id) < (%(before_rank)s::real, %(before_timestamp)s, %(before_id)s)"
+            kwargs["before_rank"] = before.rank
+            kwargs["before_timestamp"] = before.send_timestamp
+            kwargs["before_id"] = before.bloom_id
+        statement = f"""
+            WITH matches AS (
+              SELECT blooms.id, sender_id, content, send_timestamp, ts_rank_cd(search_vector, query) AS rank
+              FROM blooms, to_tsquery('simple', %(query)s) AS query
+              WHERE search_vector @@ query
+            )
+            SELECT page.id, users.username, content, send_timestamp, rank
+            FROM
+              (
+                SELECT * FROM matches
+                {before_clause}
+                ORDER BY rank DESC, send_timestamp DESC, matches.id DESC
+                LIMIT %(limit)s
+              ) AS page
+              INNER JOIN users ON users.id = page.sender_id
+            ORDER BY rank DESC, send_timestamp DESC, page.id DESC
+            """
+    else:
+        before_clause = make_before_clause(before, kwargs)
+        statement = f"""
+            SELECT page.id, users.username, content, send_timestamp, 0
+            FROM
+              (
+                SELECT id, sender_id, content, send_timestamp FROM blooms
+                WHERE
+                  search_vector @@ to_tsquery('simple', %(query)s)
+                  {before_clause}
+                ORDER BY send_timestamp DESC, blooms.id DESC
+                LIMIT %(limit)s
+              ) AS page
+              INNER JOIN users ON users.id = page.sender_id
+            ORDER BY send_timestamp DESC, page.id DESC
+            """
+    with db_cursor(read_only=True) as cur:
+        cur.execute(statement, kwargs)
+        rows = cur.fetchall()
+    return [
+        SearchResult(
+            bloom=Bloom(
+                id=bloom_id,
+                sender=sender_username,
+                content=content,
+                sent_timestamp=timestamp,
+            ),
+            rank=rank,
+        )
+        for bloom_id, sender_username, content, timestamp, rank in rows
+    ]
+
+
+def next_cursor(result: SearchResult, order: str) -> SearchCursor:
+    if order == RELEVANCE:
+        return RankCursor.after(result)
+    return Cursor.after(result.bloom)
+
+
+def decode_cursor(encoded: str, order: str) -> SearchCursor:
+    if order == RELEVANCE:
+        return RankCursor.decode(encoded)
+    return Cursor.decode(encoded)
+
+
+class InvertedIndex:
+    """InvertedIndex searches blooms held in memory, matching and ordering like search_blooms.
+
+    Its ranks count how often the query's words occur, so only their order is comparable with Postgres'.
+    """
+
+    def __init__(self):
+        # Each word maps to the ids of the blooms containing it, and how often it occurs in each.
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._words: List[str] = []
+        self._blooms: Dict[int, Bloom] = {}
+
+    def add(self, bloom: Bloom):
+        self._blooms[bloom.id] = bloom
+        for word in WORD.findall(bloom.content.lower()):
+            postings = self._postings.get(word)
+            if postings is None:
+                postings = {}
+                self._postings[word] = postings
+                bisect.insort(self._words, word)
+            postings[bloom.id] = postings.get(bloom.id, 0) + 1
+
+    def search(
+        self,
+        query: str,
+        *,
+        order: str = RELEVANCE,
+        before: Optional[SearchCursor] = None,
+        limit: int,
+    ) -> List[SearchResult]:
+        words = query_words(query)
+        ranks: Optional[Dict[int, float]] = None
+        for index, word in enumerate(words):
+            prefix = index == len(words) - 1
+            matches = self._matches(word, prefix=prefix)
+            if ranks is None:
+                ranks = {bloom_id: float(count) for bloom_id, count in matches.items()}
+            else:
+                ranks = {
+                    bloom_id: rank + matches[bloom_id]
+                    for bloom_id, rank in ranks.items()
+                    if bloom_id in matches
+                }
+
+        results = [
+            SearchResult(
+                bloom=self._blooms[bloom_id], rank=rank if order == RELEVANCE else 0
+            )
+            for bloom_id, rank in ranks.items()
+        ]
+        if before is not None:
+            results = [
+                result
+                for result in results
+                if position_of(result, order) < cursor_position(before, order)
+            ]
+        results.sort(key=lambda result: position_of(result, order), reverse=True)
+        return results[:limit]
+
+    def _matches(self, word: str, *, prefix: bool) -> Dict[int, int]:
+        if not prefix:
+            return self._postings.get(word, {})
+        matches: Dict[int, int] = {}
+        start = bisect.bisect_left(self._words, word)
+        for candidate in self._words[start:]:
+            if not candidate.startswith(word):
+                break
+            for bloom_id, count in self._postings[candidate].items():
+                matches[bloom_id] = matches.get(bloom_id, 0) + count
+        return matches
+
+
+def position_of(result: SearchResult, order: str) -> tuple:
+    return cursor_position(next_cursor(result, order), order)
+
+
+def cursor_position(cursor: SearchCursor, order: str) -> tuple:
+    if order == RELEVANCE:
+        return (cursor.rank, cursor.send_timestamp, cursor.bloom_id)
+    return (cursor.send_timestamp, cursor.bloom_id)
@@ -0,0 +1,88 @@
+import datetime
+import unittest
+
+from data.blooms import Bloom
+from data.search import (
+    RECENT,
+    InvalidQueryError,
+    InvertedIndex,
+    RankCursor,
+    next_cursor,
+    query_words,
+    to_tsquery_text,
+)
+
+
+def make_bloom(bloom_id: int, content: str) -> Bloom:
+    return Bloom(
+        id=bloom_id,
+        sender="someone",
+        content=content,
+        sent_timestamp=datetime.datetime(2025, 1, 1)
+        + datetime.timedelta(minutes=bloom_id),
+    )
+
+
+class TestQueryParsing(unittest.TestCase):
+    def test_words(self):
+        self.assertEqual(
+            query_words("Purple  FOREST! #tree"), ["purple", "forest", "tree"]
+        )
+        self.assertEqual(to_tsquery_text(["purple", "for"]), "purple & for:*")
+
+    def test_operators_are_ignored(self):
+        self.assertEqual(to_tsquery_text(query_words("a & !b | c:*")), "a & b & c:*")
+
+    def test_rejects_empty_query(self):
+        with self.assertRaises(InvalidQueryError):
+            query_words(" !?_ ")
+
+
+class TestInvertedIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = InvertedIndex()
+        for bloom_id, content in enumerate(
+            [
+                "walking in the purple forest",
+                "forest forest forest",
+                "the sea is purple today",
+                "formal purple forests #nature",
+                "nothing to see here",
+            ]
+        ):
+            self.index.add(make_bloom(bloom_id, content))
+
+    def ids(self, results):
+        return [result.bloom.id for result in results]
+
+    def test_matches_every_word_with_prefix_on_the_last(self):
+        self.assertEqual(self.ids(self.index.search("purple for", limit=10)), [3, 0])
+        self.assertEqual(self.ids(self.index.search("forest purple", limit=10)), [0])
+
+    def test_ranks_by_occurrences(self):
+        self.assertEqual(self.ids(self.index.search("forest", limit=10)), [1, 3, 0])
+
+    def test_recent_order(self):
+        self.assertEqual(
+            self.ids(self.index.search("forest", order=RECENT, limit=10)), [3, 1, 0]
+        )
+
+    def test_pagination(self):
+        first = self.index.search("purple", limit=2)
+        rest = self.index.search(
+            "purple", before=next_cursor(first[-1], "relevance"), limit=2
+        )
+        self.assertEqual(
+            self.ids(first + rest), self.ids(self.index.search("purple", limit=10))
+        )
+        self.assertEqual(len(rest), 1)
+
+    def test_rank_cursor_round_trip(self):
+        cursor = RankCursor(
+            rank=0.1, send_timestamp=datetime.datetime(2025, 1, 1), bloom_id=42
+        )
+        self.assertEqual(RankCursor.decode(cursor.encode()), cursor)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+import os
+from typing import List
+
+from data.connection import db_cursor
+from data.users import User
+
+
+def suggestions_per_user() -> int:
+    return int(os.getenv("SUGGESTIONS_PER_USER", "20"))
+
+
+def get_suggested_follows(following_user: User, limit: int) -> List[str]:
+    """get_suggested_follows returns up to limit usernames the user may want to follow, best first.
+
+    Precomputed friends-of-friends suggestions come first, topped up with the most followed accounts.
+    """
+    with db_cursor(read_only=True) as cur:
+        cur.execute(
+            """
+            SELECT users.username
+            FROM suggested_follows INNER JOIN users ON users.id = suggested_follows.suggested_user_id
+            WHERE suggested_follows.user_id = %(user_id)s
+            ORDER BY score DESC, suggested_user_id
+            LIMIT %(limit)s
+            """,
+            dict(user_id=following_user.id, limit=limit),
+        )
+        usernames = [row[0] for row in cur.fetchall()]
+        if len(usernames) >= limit:
+            return usernames
+
+        # Accounts without a user_stats row yet, e.g. new ones, have no followers, so come last.
+        cur.execute(
+            """
+            (
+              SELECT users.username, 0 AS tier, user_stats.follower_count, users.id
+              FROM user_stats INNER JOIN users ON users.id = user_stats.user_id
+              WHERE
+                user_stats.user_id <> %(user_id)s
+                AND user_stats.user_id NOT IN (
+                  SELECT followee FROM follows WHERE follower = %(user_id)s
+                )
+                AND users.username <> ALL(%(already_suggested)s)
+              ORDER BY user_stats.follower_count DESC, user_stats.user_id
+              LIMIT %(limit)s
+            )
+            UNION ALL
+            (
+              SELECT users.username, 1, 0, users.id
+              FROM users LEFT JOIN user_stats ON user_stats.user_id = users.id
+              WHERE
+                user_stats.user_id IS NULL
+                AND users.id <> %(user_id)s
+                AND users.id NOT IN (
+                  SELECT followee FROM follows WHERE follower = %(user_id)s
+                )
+                AND users.username <> ALL(%(already_suggested)s)
+              ORDER BY users.id
+              LIMIT %(limit)s
+            )
+            ORDER BY tier, follower_count DESC, id
+            LIMIT %(limit)s
+            """,
+            dict(
+                user_id=following_user.id,
+                already_suggested=usernames,
+                limit=limit - len(usernames),
+            ),
+        )
+        return usernames + [row[0] for row in cur.fetchall()]
+
+
+def refresh_suggestions(cur, user_id: int):
+    """refresh_suggestions recomputes a user's suggestions, ranking accounts followed by the accounts they follow.
+
+    Each candidate scores one point per followed account which also follows it.
+    """
+    cur.execute("DELETE FROM suggested_follows WHERE user_id = %s", (user_id,))
+    cur.execute(
+        """
+        INSERT INTO suggested_follows (user_id, suggested_user_id, score)
+        SELECT %(user_id)s, second_hop.followee, count(*)
+        FROM follows AS first_hop INNER JOIN follows AS second_hop ON second_hop.follower = first_hop.followee
+        WHERE
+          first_hop.follower = %(user_id)s
+          AND second_hop.followee <> %(user_id)s
+          AND second_hop.followee NOT IN (
+            SELECT followee FROM follows WHERE follower = %(user_id)s
+          )
+        GROUP BY second_hop.followee
+        ORDER BY count(*) DESC, second_hop.followee
+        LIMIT %(limit)s
+        """,
+        dict(user_id=user_id, limit=suggestions_per_user()),
+    )
+
+
+def record_follow(cur, *, follower_id: int, followee_id: int):
+    """record_follow incrementally updates the follower's suggestions after they follow followee.
+
+    The followee stops being suggested, and everyone the followee follows gains a point.
+    """
+    cur.execute(
+        "DELETE FROM suggested_follows WHERE user_id = %s AND suggested_user_id = %s",
+        (follower_id, followee_id),
+    )
+    cur.execute(
+        """
+        INSERT INTO suggested_follows (user_id, suggested_user_id, score)
+        SELECT %(follower_id)s, followee, 1 FROM follows
+        WHERE
+          follower = %(followee_id)s
+          AND followee <> %(follower_id)s
+          AND followee NOT IN (
+            SELECT followee FROM follows WHERE follower = %(follower_id)s
+          )
+        ON CONFLICT (user_id, suggested_user_id) DO UPDATE SET
+          score = suggested_follows.score + 1
+        """,
+        dict(follower_id=follower_id, followee_id=followee_id),
+    )
+    cur.execute(
+        """
+        DELETE FROM suggested_follows
+        WHERE user_id = %(user_id)s AND suggested_user_id NOT IN (
+          SELECT suggested_user_id FROM suggested_follows
+          WHERE user_id = %(user_id)s
+          ORDER BY score DESC, suggested_user_id
+          LIMIT %(limit)s
+        )
+        """,
+        dict(user_id=follower_id, limit=suggestions_per_user()),
+    )
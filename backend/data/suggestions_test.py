@@ -0,0 +1,67 @@
+from contextlib import contextmanager
+import unittest
+from unittest import mock
+
+from data import suggestions
+from data.fakes import RecordingCursor
+from data.users import User
+
+USER = User(id=1, username="ada", password_salt=b"", password_scrypt=b"")
+
+
+class TestGetSuggestedFollows(unittest.TestCase):
+    def suggested(self, results, limit):
+        cursor = RecordingCursor(results)
+
+        @contextmanager
+        def fake_db_cursor(*, read_only=False):
+            yield cursor
+
+        with mock.patch.object(suggestions, "db_cursor", fake_db_cursor):
+            return suggestions.get_suggested_follows(USER, limit), cursor.queries
+
+    def test_precomputed_suggestions_first(self):
+        usernames, queries = self.suggested([[("bo",), ("cy",)]], 2)
+        self.assertEqual(usernames, ["bo", "cy"])
+        self.assertEqual(len(queries), 1)
+
+    def test_tops_up_with_popular_and_new_accounts(self):
+        usernames, queries = self.suggested([[("bo",)], [("cy",), ("dana",)]], 3)
+        self.assertEqual(usernames, ["bo", "cy", "dana"])
+
+        top_up, args = queries[1]
+        self.assertEqual(args, dict(user_id=1, already_suggested=["bo"], limit=2))
+        # Accounts nobody has followed yet have no user_stats row, and are still suggested.
+        self.assertIn("FROM users LEFT JOIN user_stats", top_up)
+        self.assertIn("user_stats.user_id IS NULL", top_up)
+
+
+class TestRefreshSuggestions(unittest.TestCase):
+    def test_replaces_suggestions(self):
+        cur = RecordingCursor()
+        with mock.patch.dict("os.environ", {"SUGGESTIONS_PER_USER": "5"}):
+            suggestions.refresh_suggestions(cur, 1)
+
+        (delete, delete_args), (insert, insert_args) = cur.queries
+        self.assertTrue(delete.startswith("DELETE FROM suggested_follows"))
+        self.assertEqual(delete_args, (1,))
+        self.assertTrue(insert.startswith("INSERT INTO suggested_follows"))
+        self.assertEqual(insert_args, dict(user_id=1, limit=5))
+
+
+class TestRecordFollow(unittest.TestCase):
+    def test_updates_suggestions_incrementally(self):
+        cur = RecordingCursor()
+        with mock.patch.dict("os.environ", {"SUGGESTIONS_PER_USER": "5"}):
+            suggestions.record_follow(cur, follower_id=1, followee_id=2)
+
+        (unsuggest, unsuggest_args), (score, score_args), (cap, cap_args) = cur.queries
+        self.assertEqual(unsuggest_args, (1, 2))
+        self.assertIn("score = suggested_follows.score + 1", score)
+        self.assertEqual(score_args, dict(follower_id=1, followee_id=2))
+        self.assertTrue(cap.startswith("DELETE FROM suggested_follows"))
+        self.assertEqual(cap_args, dict(user_id=1, limit=5))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,195 @@
+"""Materialized home timelines, filled in when blooms are written (fan-out-on-write).
+
+When enabled, each new bloom's id is pushed into the home_timeline rows of its sender
+and all of their followers, so reading /home is a single indexed range read. Senders
+with more than HOME_TIMELINE_FANOUT_MAX_FOLLOWERS followers are not fanned out; their
+blooms are merged in when the timeline is read instead. A sender who goes over the limit
+needs nothing moved, as reads merge their blooms in from then on; one who drops back to it
+has their recent blooms copied into every follower's timeline, since reads stop merging.
+"""
+
+import datetime
+import os
+from typing import List
+
+from data.connection import env_flag
+
+
+def fanout_enabled() -> bool:
+    return env_flag("HOME_TIMELINE_FANOUT", False)
+
+
+def timeline_length() -> int:
+    return int(os.getenv("HOME_TIMELINE_LENGTH", "800"))
+
+
+def fanout_max_followers() -> int:
+    return int(os.getenv("HOME_TIMELINE_FANOUT_MAX_FOLLOWERS", "10000"))
+
+
+def fan_out_bloom(
+    cur, *, bloom_id: int, sender_id: int, send_timestamp: datetime.datetime
+):
+    """fan_out_bloom pushes a new bloom into the timelines of its sender and their followers."""
+    cur.execute(
+        """
+        INSERT INTO home_timeline (user_id, bloom_id, send_timestamp)
+        SELECT %(sender_id)s, %(bloom_id)s, %(send_timestamp)s
+        UNION
+        SELECT follower, %(bloom_id)s, %(send_timestamp)s FROM follows
+        WHERE followee = %(sender_id)s AND NOT %(fanout_skipped)s
+        ON CONFLICT DO NOTHING
+        RETURNING user_id
+        """,
+        dict(
+            bloom_id=bloom_id,
+            sender_id=sender_id,
+            send_timestamp=send_timestamp,
+            fanout_skipped=is_fanout_skipped(cur, sender_id),
+        ),
+    )
+    trim(cur, [row[0] for row in cur.fetchall()])
+
+
+def fan_out_blooms(cur, bloom_ids: List[int]):
+    """fan_out_blooms pushes many new blooms into the timelines of their senders and their followers."""
+    cur.execute(
+        """
+        INSERT INTO home_timeline (user_id, bloom_id, send_timestamp)
+        SELECT sender_id, id, send_timestamp FROM blooms WHERE id = ANY(%(bloom_ids)s)
+        UNION
+        SELECT follows.follower, blooms.id, blooms.send_timestamp
+        FROM blooms INNER JOIN follows ON follows.followee = blooms.sender_id
+        WHERE
+          blooms.id = ANY(%(bloom_ids)s)
+          AND blooms.sender_id NOT IN (
+            SELECT user_id FROM user_stats WHERE follower_count > %(max_followers)s
+          )
+        ON CONFLICT DO NOTHING
+        RETURNING user_id
+        """,
+        dict(bloom_ids=bloom_ids, max_followers=fanout_max_followers()),
+    )
+    trim(cur, list({row[0] for row in cur.fetchall()}))
+
+
+def backfill(cur, *, follower_id: int, followee_id: int):
+    """backfill copies the recent blooms of a newly followed user into the follower's timeline."""
+    if is_fanout_skipped(cur, followee_id):
+        return
+    cur.execute(
+        """
+        INSERT INTO home_timeline (user_id, bloom_id, send_timestamp)
+        SELECT %(follower_id)s, id, send_timestamp FROM blooms
+        WHERE sender_id = %(followee_id)s
+        ORDER BY send_timestamp DESC, id DESC
+        LIMIT %(length)s
+        ON CONFLICT DO NOTHING
+        """,
+        dict(
+            follower_id=follower_id,
+            followee_id=followee_id,
+            length=timeline_length(),
+        ),
+    )
+    trim(cur, [follower_id])
+
+
+def remove_followee(cur, *, follower_id: int, followee_id: int):
+    """remove_followee drops the blooms of a user the follower stopped following from their timeline."""
+    cur.execute(
+        """
+        DELETE FROM home_timeline USING blooms
+        WHERE
+          home_timeline.user_id = %(follower_id)s
+          AND home_timeline.bloom_id = blooms.id
+          AND blooms.sender_id = %(followee_id)s
+        """,
+        dict(follower_id=follower_id, followee_id=followee_id),
+    )
+
+
+def record_unfollow(cur, *, follower_id: int, followee_id: int, follower_count: int):
+    """record_unfollow updates timelines after an unfollow left followee with follower_count followers."""
+    remove_followee(cur, follower_id=follower_id, followee_id=followee_id)
+    if follower_count == fanout_max_followers():
+        # Reads merged this user's blooms in until now; from here on they're fanned out.
+        backfill_followers(cur, followee_id)
+
+
+def backfill_followers(cur, sender_id: int):
+    """backfill_followers copies the recent blooms of sender_id into all of their followers' timelines."""
+    cur.execute(
+        """
+        INSERT INTO home_timeline (user_id, bloom_id, send_timestamp)
+        SELECT follows.follower, recent.id, recent.send_timestamp
+        FROM follows CROSS JOIN (
+          SELECT id, send_timestamp FROM blooms
+          WHERE sender_id = %(sender_id)s
+          ORDER BY send_timestamp DESC, id DESC
+          LIMIT %(length)s
+        ) AS recent
+        WHERE follows.followee = %(sender_id)s
+        ON CONFLICT DO NOTHING
+        RETURNING user_id
+        """,
+        dict(sender_id=sender_id, length=timeline_length()),
+    )
+    trim(cur, list({row[0] for row in cur.fetchall()}))
+
+
+def is_fanout_skipped(cur, sender_id: int) -> bool:
+    """is_fanout_skipped returns whether sender_id has too many followers to fan out to."""
+    cur.execute(
+        "SELECT follower_count > %(max_followers)s FROM user_stats WHERE user_id = %(sender_id)s",
+        dict(sender_id=sender_id, max_followers=fanout_max_followers()),
+    )
+    row = cur.fetchone()
+    return row is not None and row[0]
+
+
+def trim(cur, user_ids: List[int]):
+    """trim drops everything but the newest HOME_TIMELINE_LENGTH entries from each user's timeline.
+
+    Each user's cutoff is found by skipping HOME_TIMELINE_LENGTH - 1 entries down the primary
+    key, so only the entries being kept and dropped are read, not a ranking of every row.
+    """
+    if not user_ids:
+        return
+    cur.execute(
+        """
+        DELETE FROM home_timeline
+        USING (
+          SELECT timeline_users.user_id, oldest_kept.send_timestamp, oldest_kept.bloom_id
+          FROM unnest(%(user_ids)s::int[]) AS timeline_users (user_id)
+          CROSS JOIN LATERAL (
+            SELECT send_timestamp, bloom_id FROM home_timeline
+            WHERE home_timeline.user_id = timeline_users.user_id
+            ORDER BY send_timestamp DESC, bloom_id DESC
+            OFFSET %(length)s - 1 LIMIT 1
+          ) AS oldest_kept
+        ) AS cutoffs
+        WHERE
+          home_timeline.user_id = cutoffs.user_id
+          AND (home_timeline.send_timestamp, home_timeline.bloom_id)
+            < (cutoffs.send_timestamp, cutoffs.bloom_id)
+        """,
+        dict(user_ids=user_ids, length=timeline_length()),
+    )
+
+
+def rebuild(cur, user_id: int):
+    """rebuild refills a user's timeline from scratch, e.g. after fan-out has been switched on."""
+    cur.execute("DELETE FROM home_timeline WHERE user_id = %s", (user_id,))
+    cur.execute(
+        """
+        INSERT INTO home_timeline (user_id, bloom_id, send_timestamp)
+        SELECT %(user_id)s, id, send_timestamp FROM blooms
+        WHERE
+          sender_id = %(user_id)s
+          OR sender_id IN (SELECT followee FROM follows WHERE follower = %(user_id)s)
+        ORDER BY send_timestamp DESC, id DESC
+        LIMIT %(length)s
+        """,
+        dict(user_id=user_id, length=timeline_length()),
+    )
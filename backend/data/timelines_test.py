@@ -0,0 +1,143 @@
+import datetime
+import unittest
+from unittest import mock
+
+from data import timelines
+from data.blooms import Cursor, materialized_home_timeline_query
+from data.fakes import RecordingCursor
+from data.users import User
+
+SENT = datetime.datetime(2025, 5, 1, 12, 0, 0)
+
+
+class TestFanOut(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.dict(
+            "os.environ",
+            {"HOME_TIMELINE_LENGTH": "3", "HOME_TIMELINE_FANOUT_MAX_FOLLOWERS": "2"},
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_fans_out_and_trims_the_timelines_written(self):
+        cur = RecordingCursor([[(False,)], [(7,), (8,), (9,)]])
+        timelines.fan_out_bloom(cur, bloom_id=42, sender_id=7, send_timestamp=SENT)
+
+        (_, skipped_args), (insert, insert_args), (trim, trim_args) = cur.queries
+        self.assertEqual(skipped_args, dict(sender_id=7, max_followers=2))
+        self.assertTrue(insert.startswith("INSERT INTO home_timeline"))
+        self.assertEqual(
+            insert_args,
+            dict(bloom_id=42, sender_id=7, send_timestamp=SENT, fanout_skipped=False),
+        )
+        self.assertTrue(trim.startswith("DELETE FROM home_timeline"))
+        self.assertEqual(trim_args, dict(user_ids=[7, 8, 9], length=3))
+
+    def test_skipped_sender_only_writes_their_own_timeline(self):
+        cur = RecordingCursor([[(True,)], [(7,)]])
+        timelines.fan_out_bloom(cur, bloom_id=42, sender_id=7, send_timestamp=SENT)
+
+        _, (_, insert_args), (_, trim_args) = cur.queries
+        self.assertTrue(insert_args["fanout_skipped"])
+        self.assertEqual(trim_args["user_ids"], [7])
+
+    def test_unknown_sender_is_not_skipped(self):
+        cur = RecordingCursor([[]])
+        self.assertFalse(timelines.is_fanout_skipped(cur, 7))
+
+    def test_bulk_fan_out_trims_each_timeline_once(self):
+        cur = RecordingCursor([[(7,), (8,), (7,)]])
+        timelines.fan_out_blooms(cur, [1, 2])
+
+        (_, insert_args), (_, trim_args) = cur.queries
+        self.assertEqual(insert_args, dict(bloom_ids=[1, 2], max_followers=2))
+        self.assertEqual(sorted(trim_args["user_ids"]), [7, 8])
+
+
+class TestBackfill(unittest.TestCase):
+    def test_backfills_and_trims(self):
+        cur = RecordingCursor([[(False,)]])
+        with mock.patch.dict("os.environ", {"HOME_TIMELINE_LENGTH": "3"}):
+            timelines.backfill(cur, follower_id=1, followee_id=7)
+
+        _, (insert, insert_args), (_, trim_args) = cur.queries
+        self.assertIn("LIMIT %(length)s", insert)
+        self.assertEqual(insert_args, dict(follower_id=1, followee_id=7, length=3))
+        self.assertEqual(trim_args, dict(user_ids=[1], length=3))
+
+    def test_skipped_followee_is_not_backfilled(self):
+        cur = RecordingCursor([[(True,)]])
+        timelines.backfill(cur, follower_id=1, followee_id=7)
+        self.assertEqual(len(cur.queries), 1)
+
+
+class TestRecordUnfollow(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.dict(
+            "os.environ",
+            {"HOME_TIMELINE_LENGTH": "3", "HOME_TIMELINE_FANOUT_MAX_FOLLOWERS": "2"},
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_only_removes_the_followee(self):
+        for follower_count in (0, 1, 3):
+            cur = RecordingCursor()
+            timelines.record_unfollow(
+                cur, follower_id=1, followee_id=7, follower_count=follower_count
+            )
+            [(remove, remove_args)] = cur.queries
+            self.assertTrue(remove.startswith("DELETE FROM home_timeline"))
+            self.assertEqual(remove_args, dict(follower_id=1, followee_id=7))
+
+    def test_backfills_followers_when_fanout_resumes(self):
+        cur = RecordingCursor([[], [(8,), (9,), (8,)]])
+        timelines.record_unfollow(cur, follower_id=1, followee_id=7, follower_count=2)
+
+        _, (backfill, backfill_args), (_, trim_args) = cur.queries
+        self.assertTrue(backfill.startswith("INSERT INTO home_timeline"))
+        self.assertIn("WHERE follows.followee = %(sender_id)s", backfill)
+        self.assertEqual(backfill_args, dict(sender_id=7, length=3))
+        self.assertEqual(sorted(trim_args["user_ids"]), [8, 9])
+
+
+class TestTrim(unittest.TestCase):
+    def test_nothing_to_trim(self):
+        cur = RecordingCursor()
+        timelines.trim(cur, [])
+        self.assertEqual(cur.queries, [])
+
+    def test_keeps_the_newest_entries_per_user(self):
+        cur = RecordingCursor()
+        with mock.patch.dict("os.environ", {"HOME_TIMELINE_LENGTH": "800"}):
+            timelines.trim(cur, [1, 2])
+
+        [(query, args)] = cur.queries
+        self.assertEqual(args, dict(user_ids=[1, 2], length=800))
+        # The cutoff is found with an index walk per user, rather than ranking every row.
+        self.assertIn("OFFSET %(length)s - 1 LIMIT 1", query)
+        self.assertNotIn("row_number", query)
+
+
+class TestMaterializedHomeTimeline(unittest.TestCase):
+    def test_merges_in_skipped_senders(self):
+        before = Cursor(send_timestamp=SENT, bloom_id=42)
+        with mock.patch.dict("os.environ", {"HOME_TIMELINE_FANOUT_MAX_FOLLOWERS": "2"}):
+            statement, kwargs = materialized_home_timeline_query(
+                User(id=1, username="ada", password_salt=b"", password_scrypt=b""),
+                before=before,
+                limit=10,
+            )
+
+        statement = " ".join(statement.split())
+        self.assertEqual(kwargs["user_id"], 1)
+        self.assertEqual(kwargs["max_followers"], 2)
+        self.assertIn("FROM home_timeline", statement)
+        self.assertIn("UNION", statement)
+        self.assertIn("follower_count > %(max_followers)s", statement)
+        # Both halves of the page start after the cursor.
+        self.assertEqual(statement.count("%(before_timestamp)s"), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
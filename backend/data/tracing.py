@@ -0,0 +1,174 @@
+"""Records what each request costs: how many queries it ran, for how long, and how many rows they returned.
+
+Every cursor from db_cursor is a TracingCursor, which times its statements into the
+current request's RequestTrace and the process-wide metrics. When the request finishes
+the trace is summarized into histograms, and, if DEBUG_QUERY_HEADERS is set, into
+response headers, so an N+1 query pattern shows up as a large X-Query-Count.
+"""
+
+from dataclasses import dataclass
+import logging
+import os
+import time
+from typing import Optional
+
+from data import connection, metrics
+
+from flask import Flask, Response, g, has_request_context, request
+import psycopg2.extensions
+
+logger = logging.getLogger(__name__)
+
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+ROW_BUCKETS = (0, 1, 10, 50, 100, 500, 1000, 10000, 100000)
+
+request_duration = metrics.histogram(
+    "purpleforest_http_request_duration_seconds",
+    "Time taken to handle requests",
+    ["endpoint", "method", "status"],
+)
+queries_per_request = metrics.histogram(
+    "purpleforest_db_queries_per_request",
+    "Number of SQL statements run by each request",
+    ["endpoint"],
+    COUNT_BUCKETS,
+)
+query_duration = metrics.histogram(
+    "purpleforest_db_query_duration_seconds",
+    "Time taken by each SQL statement",
+    ["endpoint"],
+)
+query_rows = metrics.histogram(
+    "purpleforest_db_query_rows",
+    "Rows returned or affected by each SQL statement",
+    ["endpoint"],
+    ROW_BUCKETS,
+)
+slow_queries = metrics.counter(
+    "purpleforest_db_slow_queries_total",
+    "SQL statements slower than SLOW_QUERY_THRESHOLD_MS",
+    ["endpoint"],
+)
+connection_acquire_duration = metrics.histogram(
+    "purpleforest_db_connection_acquire_seconds",
+    "Time spent waiting for a connection from the pool",
+)
+serialization_duration = metrics.histogram(
+    "purpleforest_json_serialization_seconds",
+    "Time taken to serialize JSON response bodies",
+)
+
+
+@dataclass
+class RequestTrace:
+    started: float
+    queries: int = 0
+    query_seconds: float = 0.0
+    rows: int = 0
+    acquire_seconds: float = 0.0
+    serialization_seconds: float = 0.0
+
+
+def current_trace() -> Optional[RequestTrace]:
+    if not has_request_context():
+        return None
+    return g.get("_trace")
+
+
+def current_endpoint() -> str:
+    if not has_request_context():
+        return "none"
+    return request.endpoint or "unmatched"
+
+
+def slow_query_threshold() -> float:
+    return float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "200")) / 1000
+
+
+class TracingCursor(psycopg2.extensions.cursor):
+    """TracingCursor is a cursor which records the time taken and rows returned by each statement."""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            self._record(query, time.perf_counter() - started)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            self._record(query, time.perf_counter() - started)
+
+    def _record(self, query, seconds: float):
+        rows = max(self.rowcount, 0)
+        endpoint = current_endpoint()
+        query_duration.observe(seconds, endpoint=endpoint)
+        query_rows.observe(rows, endpoint=endpoint)
+        trace = current_trace()
+        if trace is not None:
+            trace.queries += 1
+            trace.query_seconds += seconds
+            trace.rows += rows
+        if seconds >= slow_query_threshold():
+            slow_queries.inc(endpoint=endpoint)
+            statement = (
+                query.decode("utf-8", "replace") if isinstance(query, bytes) else query
+            )
+            logger.warning(
+                "Slow query (%.1fms, %d rows) in %s: %s",
+                seconds * 1000,
+                rows,
+                endpoint,
+                " ".join(statement.split())[:500],
+            )
+
+
+def record_connection_acquire(seconds: float):
+    connection_acquire_duration.observe(seconds)
+    trace = current_trace()
+    if trace is not None:
+        trace.acquire_seconds += seconds
+
+
+def record_serialization(seconds: float):
+    serialization_duration.observe(seconds)
+    trace = current_trace()
+    if trace is not None:
+        trace.serialization_seconds += seconds
+
+
+def start_request():
+    g._trace = RequestTrace(started=time.perf_counter())
+
+
+def finish_request(response: Response) -> Response:
+    trace = current_trace()
+    if trace is None:
+        return response
+    endpoint = current_endpoint()
+    request_duration.observe(
+        time.perf_counter() - trace.started,
+        endpoint=endpoint,
+        method=request.method,
+        status=str(response.status_code),
+    )
+    queries_per_request.observe(trace.queries, endpoint=endpoint)
+    if connection.env_flag("DEBUG_QUERY_HEADERS", False):
+        response.headers["X-Query-Count"] = str(trace.queries)
+        response.headers["Server-Timing"] = ", ".join(
+            [
+                f'db;desc="{trace.queries} queries, {trace.rows} rows";dur={trace.query_seconds * 1000:.2f}',
+                f"db-acquire;dur={trace.acquire_seconds * 1000:.2f}",
+                f"json;dur={trace.serialization_seconds * 1000:.2f}",
+            ]
+        )
+    metrics.save_snapshot()
+    return response
+
+
+def init_app(app: Flask):
+    app.before_request(start_request)
+    app.after_request(finish_request)
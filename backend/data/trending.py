@@ -0,0 +1,325 @@
+"""Finds the hashtags used most in the last hour, day or week, without scanning the hashtags table.
+
+Sending a bloom adds to per-minute, per-hour and per-day counts for each of its hashtags.
+Each process adds up its counts in memory, and a background thread adds them to the
+hashtag_counts table every TRENDING_FLUSH_SECONDS, in a short transaction of its own, so
+sending never waits on a popular hashtag's row lock. A window is then the sum of a bounded
+number of buckets: the last 60 minutes, 24 hours or 7 days. Old buckets are pruned.
+
+Each process keeps the current top hashtags for every window in memory, recomputed by a
+background thread every TRENDING_REFRESH_SECONDS, so /trending never waits on the database
+once warmed up.
+"""
+
+from collections import Counter
+from dataclasses import dataclass
+import datetime
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from data.connection import db_cursor
+
+from psycopg2.extras import execute_values
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Granularity:
+    name: str
+    # Buckets older than this are deleted.
+    retention: datetime.timedelta
+
+    def bucket_start(self, timestamp: datetime.datetime) -> datetime.datetime:
+        if self.name == "minute":
+            return timestamp.replace(second=0, microsecond=0)
+        if self.name == "hour":
+            return timestamp.replace(minute=0, second=0, microsecond=0)
+        return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+MINUTE = Granularity("minute", retention=datetime.timedelta(hours=2))
+HOUR = Granularity("hour", retention=datetime.timedelta(days=2))
+DAY = Granularity("day", retention=datetime.timedelta(days=14))
+GRANULARITIES = (MINUTE, HOUR, DAY)
+
+# Each window is summed from the buckets of one granularity.
+WINDOWS: Dict[str, Tuple[Granularity, datetime.timedelta]] = {
+    "hour": (MINUTE, datetime.timedelta(hours=1)),
+    "day": (HOUR, datetime.timedelta(days=1)),
+    "week": (DAY, datetime.timedelta(days=7)),
+}
+DEFAULT_WINDOW = "day"
+
+
+@dataclass(frozen=True)
+class TrendingHashtag:
+    hashtag: str
+    count: int
+
+
+def max_trending() -> int:
+    return int(os.getenv("TRENDING_MAX_HASHTAGS", "100"))
+
+
+def refresh_interval() -> float:
+    return float(os.getenv("TRENDING_REFRESH_SECONDS", "30"))
+
+
+def now() -> datetime.datetime:
+    return datetime.datetime.now(tz=datetime.UTC)
+
+
+def flush_interval() -> float:
+    return float(os.getenv("TRENDING_FLUSH_SECONDS", "5"))
+
+
+def bucket_counts(used: Iterable[Tuple[str, datetime.datetime]]) -> Counter:
+    """bucket_counts counts hashtag uses, given as (hashtag, send_timestamp) pairs, in each bucket they fall in."""
+    oldest = now()
+    counts = Counter()
+    for hashtag, send_timestamp in used:
+        # Buckets start on UTC minutes, hours and days.
+        send_timestamp = send_timestamp.astimezone(datetime.UTC)
+        for granularity in GRANULARITIES:
+            # Backdated blooms, e.g. from bulk imports, are too old to trend.
+            if send_timestamp < oldest - granularity.retention:
+                continue
+            counts[
+                (granularity.name, granularity.bucket_start(send_timestamp), hashtag)
+            ] += 1
+    return counts
+
+
+def write_counts(cur, counts: Counter):
+    """write_counts adds counts, keyed by (granularity, bucket_start, hashtag), to hashtag_counts."""
+    if not counts:
+        return
+    # Sorted, so concurrent transactions lock shared buckets in the same order and can't deadlock.
+    execute_values(
+        cur,
+        """INSERT INTO hashtag_counts (granularity, bucket_start, hashtag, count) VALUES %s
+        ON CONFLICT (granularity, bucket_start, hashtag)
+        DO UPDATE SET count = hashtag_counts.count + EXCLUDED.count""",
+        [(*key, count) for key, count in sorted(counts.items())],
+    )
+
+
+class PendingCounts:
+    """PendingCounts holds the hashtag counts not yet written, which a background thread writes periodically."""
+
+    def __init__(self, *, interval: float):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._counts = Counter()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, counts: Counter):
+        if not counts:
+            return
+        with self._lock:
+            self._counts.update(counts)
+        self._ensure_flushing()
+
+    def flush(self):
+        """flush writes every pending count in one transaction; if that fails, they're kept for the next try."""
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+        try:
+            with db_cursor() as cur:
+                write_counts(cur, counts)
+        except BaseException:
+            with self._lock:
+                self._counts.update(counts)
+            raise
+
+    def _ensure_flushing(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._flush_forever, name="trending-flush", daemon=True
+            )
+            self._thread.start()
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Couldn't write hashtag counts")
+
+
+_pending_counts: Optional[PendingCounts] = None
+_pending_counts_lock = threading.Lock()
+
+
+def pending_counts() -> PendingCounts:
+    global _pending_counts
+    if _pending_counts is None:
+        with _pending_counts_lock:
+            if _pending_counts is None:
+                _pending_counts = PendingCounts(interval=flush_interval())
+    return _pending_counts
+
+
+def record_hashtags(used: Iterable[Tuple[str, datetime.datetime]]):
+    """record_hashtags counts hashtag uses, given as (hashtag, send_timestamp) pairs, once their blooms are committed."""
+    pending_counts().add(bucket_counts(used))
+
+
+def flush_hashtag_counts():
+    """flush_hashtag_counts writes this process's pending counts now, e.g. before it exits."""
+    if _pending_counts is not None:
+        _pending_counts.flush()
+
+
+def query_trending(window: str, limit: int) -> List[TrendingHashtag]:
+    """query_trending sums the window's buckets in the database; most callers want get_trending instead."""
+    granularity, length = WINDOWS[window]
+    with db_cursor(read_only=True) as cur:
+        cur.execute(
+            """SELECT hashtag, SUM(count) AS uses
+            FROM hashtag_counts
+            WHERE granularity = %(granularity)s AND bucket_start > %(since)s
+            GROUP BY hashtag
+            ORDER BY uses DESC, hashtag
+            LIMIT %(limit)s""",
+            dict(
+                granularity=granularity.name,
+                since=granularity.bucket_start(now() - length),
+                limit=limit,
+            ),
+        )
+        return [
+            TrendingHashtag(hashtag=hashtag, count=int(uses))
+            for hashtag, uses in cur.fetchall()
+        ]
+
+
+def prune(cur):
+    """prune deletes buckets too old to be part of any window."""
+    for granularity in GRANULARITIES:
+        cur.execute(
+            "DELETE FROM hashtag_counts WHERE granularity = %s AND bucket_start < %s",
+            (granularity.name, now() - granularity.retention),
+        )
+
+
+def rebuild(cur):
+    """rebuild recounts every bucket from the hashtags table, e.g. after turning this on or importing data.
+
+    Worker processes may still hold counts of the last few TRENDING_FLUSH_SECONDS' blooms,
+    which the hashtags table already has, so blooms sent since then are left counted as they
+    are: those minute buckets are kept, and added into the hour and day buckets recounted.
+    """
+    settled = MINUTE.bucket_start(
+        now() - 3 * datetime.timedelta(seconds=flush_interval())
+    )
+    # Flushes wait until the recount commits, then add to the recounted buckets.
+    cur.execute("LOCK TABLE hashtag_counts IN EXCLUSIVE MODE")
+    for granularity in GRANULARITIES:
+        args = dict(
+            granularity=granularity.name,
+            since=now() - granularity.retention,
+            settled=settled,
+        )
+        if granularity is MINUTE:
+            cur.execute(
+                "DELETE FROM hashtag_counts WHERE granularity = 'minute' AND bucket_start < %(settled)s",
+                args,
+            )
+            recent = ""
+        else:
+            cur.execute(
+                "DELETE FROM hashtag_counts WHERE granularity = %(granularity)s", args
+            )
+            recent = """UNION ALL
+              SELECT date_trunc(%(granularity)s, bucket_start), hashtag, count
+              FROM hashtag_counts
+              WHERE granularity = 'minute' AND bucket_start >= %(settled)s"""
+        cur.execute(
+            f"""INSERT INTO hashtag_counts (granularity, bucket_start, hashtag, count)
+            SELECT %(granularity)s, bucket_start, hashtag, SUM(count)
+            FROM (
+              SELECT date_trunc(%(granularity)s, send_timestamp) AS bucket_start, hashtag, COUNT(*) AS count
+              FROM hashtags
+              WHERE send_timestamp >= %(since)s AND send_timestamp < %(settled)s
+              GROUP BY 1, 2
+              {recent}
+            ) AS counts
+            GROUP BY 2, 3""",
+            args,
+        )
+
+
+class TrendingCache:
+    """TrendingCache holds each window's top hashtags, which a background thread keeps up to date."""
+
+    def __init__(self, *, size: int, interval: float):
+        self.size = size
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._trending: Dict[str, List[TrendingHashtag]] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    def get(self, window: str, limit: int) -> List[TrendingHashtag]:
+        self._ensure_refreshing()
+        with self._lock:
+            trending = self._trending.get(window)
+        if trending is None:
+            # Not loaded yet in this process, so load it now rather than answer with nothing.
+            trending = query_trending(window, self.size)
+            with self._lock:
+                self._trending.setdefault(window, trending)
+        return trending[:limit]
+
+    def refresh(self):
+        for window in WINDOWS:
+            trending = query_trending(window, self.size)
+            with self._lock:
+                self._trending[window] = trending
+        with db_cursor() as cur:
+            prune(cur)
+
+    def _ensure_refreshing(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._refresh_forever, name="trending-refresh", daemon=True
+            )
+            self._thread.start()
+
+    def _refresh_forever(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.refresh()
+            except Exception:
+                # Keep serving the last results; the next refresh may well succeed.
+                logger.exception("Couldn't refresh trending hashtags")
+
+
+_trending_cache: Optional[TrendingCache] = None
+_trending_cache_lock = threading.Lock()
+
+
+def trending_cache() -> TrendingCache:
+    global _trending_cache
+    if _trending_cache is None:
+        with _trending_cache_lock:
+            if _trending_cache is None:
+                _trending_cache = TrendingCache(
+                    size=max_trending(), interval=refresh_interval()
+                )
+    return _trending_cache
+
+
+def get_trending(window: str, limit: int) -> List[TrendingHashtag]:
+    """get_trending returns up to limit of the hashtags used most in the window, most used first."""
+    return trending_cache().get(window, limit)
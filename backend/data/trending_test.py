@@ -0,0 +1,153 @@
+from collections import Counter
+import datetime
+import unittest
+from unittest import mock
+
+from data import trending
+from data.fakes import RecordingCursor
+from data.trending import (
+    DAY,
+    HOUR,
+    MINUTE,
+    PendingCounts,
+    TrendingCache,
+    TrendingHashtag,
+)
+
+NOW = datetime.datetime(2024, 5, 6, 7, 8, 9, 10, tzinfo=datetime.UTC)
+
+
+class TestRecordHashtags(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(trending, "now", return_value=NOW)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def recorded(self, used):
+        with mock.patch.object(trending, "execute_values") as execute_values:
+            trending.write_counts(mock.sentinel.cur, trending.bucket_counts(used))
+        if not execute_values.called:
+            return None
+        return execute_values.call_args.args[2]
+
+    def test_bucket_start(self):
+        self.assertEqual(MINUTE.bucket_start(NOW), NOW.replace(second=0, microsecond=0))
+        self.assertEqual(
+            HOUR.bucket_start(NOW), NOW.replace(minute=0, second=0, microsecond=0)
+        )
+        self.assertEqual(
+            DAY.bucket_start(NOW), datetime.datetime(2024, 5, 6, tzinfo=datetime.UTC)
+        )
+
+    def test_counts_each_granularity(self):
+        rows = self.recorded([("#purple", NOW), ("#purple", NOW), ("#forest", NOW)])
+        self.assertEqual(
+            rows,
+            [
+                ("day", DAY.bucket_start(NOW), "#forest", 1),
+                ("day", DAY.bucket_start(NOW), "#purple", 2),
+                ("hour", HOUR.bucket_start(NOW), "#forest", 1),
+                ("hour", HOUR.bucket_start(NOW), "#purple", 2),
+                ("minute", MINUTE.bucket_start(NOW), "#forest", 1),
+                ("minute", MINUTE.bucket_start(NOW), "#purple", 2),
+            ],
+        )
+
+    def test_buckets_in_utc(self):
+        plus_two = datetime.timezone(datetime.timedelta(hours=2))
+        rows = self.recorded([("#purple", NOW.astimezone(plus_two))])
+        self.assertIn(("day", DAY.bucket_start(NOW), "#purple", 1), rows)
+
+    def test_skips_buckets_past_retention(self):
+        three_days_ago = NOW - datetime.timedelta(days=3)
+        rows = self.recorded([("#purple", three_days_ago)])
+        self.assertEqual(
+            rows, [("day", DAY.bucket_start(three_days_ago), "#purple", 1)]
+        )
+        self.assertIsNone(
+            self.recorded([("#purple", NOW - datetime.timedelta(days=30))])
+        )
+
+    def test_nothing_to_record(self):
+        self.assertIsNone(self.recorded([]))
+
+
+class TestPendingCounts(unittest.TestCase):
+    def setUp(self):
+        self.db_cursor = mock.MagicMock()
+        patcher = mock.patch.object(trending, "db_cursor", self.db_cursor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pending = PendingCounts(interval=3600)
+
+    def written(self):
+        with mock.patch.object(trending, "write_counts") as write_counts:
+            self.pending.flush()
+        return write_counts.call_args.args[1]
+
+    def test_adds_up_counts_until_flushed(self):
+        self.pending.add(Counter({("minute", NOW, "#purple"): 1}))
+        self.pending.add(Counter({("minute", NOW, "#purple"): 2}))
+        self.db_cursor.assert_not_called()
+
+        self.assertEqual(self.written(), Counter({("minute", NOW, "#purple"): 3}))
+        self.assertEqual(self.written(), Counter())
+
+    def test_keeps_counts_when_write_fails(self):
+        self.pending.add(Counter({("minute", NOW, "#purple"): 1}))
+        with mock.patch.object(trending, "write_counts", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.pending.flush()
+        self.pending.add(Counter({("minute", NOW, "#purple"): 1}))
+
+        self.assertEqual(self.written(), Counter({("minute", NOW, "#purple"): 2}))
+
+
+class TestRebuild(unittest.TestCase):
+    def test_keeps_counts_workers_may_still_hold(self):
+        cur = RecordingCursor()
+        with (
+            mock.patch.object(trending, "now", return_value=NOW),
+            mock.patch.dict("os.environ", {"TRENDING_FLUSH_SECONDS": "20"}),
+        ):
+            trending.rebuild(cur)
+
+        lock, *statements = cur.queries
+        self.assertEqual(lock[0], "LOCK TABLE hashtag_counts IN EXCLUSIVE MODE")
+        settled = datetime.datetime(2024, 5, 6, 7, 7, tzinfo=datetime.UTC)
+        (minute_delete, minute_args), (minute_insert, _) = statements[:2]
+        # Only minutes before the last three flush intervals are recounted...
+        self.assertIn("bucket_start < %(settled)s", minute_delete)
+        self.assertEqual(minute_args["settled"], settled)
+        self.assertNotIn("UNION ALL", minute_insert)
+        # ...and the minutes since are added into the recounted hours and days.
+        for delete, insert in [statements[2:4], statements[4:6]]:
+            self.assertNotIn("settled", delete[0])
+            self.assertIn("UNION ALL", insert[0])
+            self.assertIn("send_timestamp < %(settled)s", insert[0])
+
+
+class TestTrendingCache(unittest.TestCase):
+    def test_loads_once_then_serves_from_memory(self):
+        top = [TrendingHashtag("#purple", 3), TrendingHashtag("#forest", 1)]
+        cache = TrendingCache(size=10, interval=3600)
+        with mock.patch.object(trending, "query_trending", return_value=top) as query:
+            self.assertEqual(cache.get("day", 1), top[:1])
+            self.assertEqual(cache.get("day", 5), top)
+        query.assert_called_once_with("day", 10)
+
+    def test_refresh_replaces_every_window(self):
+        cache = TrendingCache(size=10, interval=3600)
+        fresh = [TrendingHashtag("#new", 1)]
+        with (
+            mock.patch.object(trending, "query_trending", return_value=fresh),
+            mock.patch.object(trending, "db_cursor"),
+        ):
+            cache.refresh()
+        self.assertEqual(
+            cache._trending, {window: fresh for window in trending.WINDOWS}
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
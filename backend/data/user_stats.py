@@ -0,0 +1,122 @@
+import datetime
+
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from psycopg2.extras import execute_values
+
+from data.cache import cacheable
+from data.connection import db_cursor
+from data.result_cache import cached, user_tag
+from data.users import User
+
+USER_STATS_QUERY = "SELECT bloom_count, follower_count, following_count, last_bloom_timestamp FROM user_stats WHERE user_id = %s"
+
+
+@cacheable
+@dataclass
+class UserStats:
+    bloom_count: int
+    follower_count: int
+    following_count: int
+    last_bloom_timestamp: Optional[datetime.datetime]
+
+
+@cached(lambda user: [user_tag(user.username)])
+def get_user_stats(user: User) -> UserStats:
+    with db_cursor(read_only=True) as cur:
+        cur.execute(USER_STATS_QUERY, (user.id,))
+        return row_to_user_stats(cur.fetchone())
+
+
+def row_to_user_stats(row) -> UserStats:
+    if row is None:
+        return UserStats(
+            bloom_count=0,
+            follower_count=0,
+            following_count=0,
+            last_bloom_timestamp=None,
+        )
+    bloom_count, follower_count, following_count, last_bloom_timestamp = row
+    return UserStats(
+        bloom_count=bloom_count,
+        follower_count=follower_count,
+        following_count=following_count,
+        last_bloom_timestamp=last_bloom_timestamp,
+    )
+
+
+def record_bloom(cur, *, sender_id: int, send_timestamp: datetime.datetime):
+    """record_bloom counts a new bloom, in the same transaction as the cursor which inserted it."""
+    cur.execute(
+        """
+        INSERT INTO user_stats (user_id, bloom_count, last_bloom_timestamp)
+        VALUES (%(sender_id)s, 1, %(send_timestamp)s)
+        ON CONFLICT (user_id) DO UPDATE SET
+          bloom_count = user_stats.bloom_count + 1,
+          last_bloom_timestamp = GREATEST(user_stats.last_bloom_timestamp, EXCLUDED.last_bloom_timestamp)
+        """,
+        dict(sender_id=sender_id, send_timestamp=send_timestamp),
+    )
+
+
+def record_blooms(cur, blooms: List[Tuple[int, datetime.datetime]]):
+    """record_blooms counts many new blooms, given as (sender_id, send_timestamp) pairs."""
+    per_sender = {}
+    for sender_id, send_timestamp in blooms:
+        count, last = per_sender.get(sender_id, (0, send_timestamp))
+        per_sender[sender_id] = (count + 1, max(last, send_timestamp))
+    if not per_sender:
+        return
+    execute_values(
+        cur,
+        """
+        INSERT INTO user_stats (user_id, bloom_count, last_bloom_timestamp) VALUES %s
+        ON CONFLICT (user_id) DO UPDATE SET
+          bloom_count = user_stats.bloom_count + EXCLUDED.bloom_count,
+          last_bloom_timestamp = GREATEST(user_stats.last_bloom_timestamp, EXCLUDED.last_bloom_timestamp)
+        """,
+        [(sender_id, count, last) for sender_id, (count, last) in per_sender.items()],
+    )
+
+
+def record_follow(cur, *, follower_id: int, followee_id: int, delta: int = 1) -> int:
+    """record_follow adjusts follow counts, in the same transaction as the cursor which changed follows.
+
+    It returns the followee's new follower count.
+    """
+    cur.execute(
+        """
+        INSERT INTO user_stats (user_id, following_count) VALUES (%(user_id)s, %(delta)s)
+        ON CONFLICT (user_id) DO UPDATE SET following_count = user_stats.following_count + EXCLUDED.following_count
+        """,
+        dict(user_id=follower_id, delta=delta),
+    )
+    cur.execute(
+        """
+        INSERT INTO user_stats (user_id, follower_count) VALUES (%(user_id)s, %(delta)s)
+        ON CONFLICT (user_id) DO UPDATE SET follower_count = user_stats.follower_count + EXCLUDED.follower_count
+        RETURNING follower_count
+        """,
+        dict(user_id=followee_id, delta=delta),
+    )
+    return cur.fetchone()[0]
+
+
+def recount(cur):
+    """recount recomputes every user's stats from the blooms and follows tables, repairing any drift."""
+    cur.execute("""
+        INSERT INTO user_stats (user_id, bloom_count, follower_count, following_count, last_bloom_timestamp)
+        SELECT
+          users.id,
+          (SELECT count(*) FROM blooms WHERE sender_id = users.id),
+          (SELECT count(*) FROM follows WHERE followee = users.id),
+          (SELECT count(*) FROM follows WHERE follower = users.id),
+          (SELECT max(send_timestamp) FROM blooms WHERE sender_id = users.id)
+        FROM users
+        ON CONFLICT (user_id) DO UPDATE SET
+          bloom_count = EXCLUDED.bloom_count,
+          follower_count = EXCLUDED.follower_count,
+          following_count = EXCLUDED.following_count,
+          last_bloom_timestamp = EXCLUDED.last_bloom_timestamp
+        """)
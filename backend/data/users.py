@@ -1,24 +1,40 @@
 from dataclasses import dataclass
-from hashlib import scrypt
-import hashlib
+import os
 import random
 import string
-from typing import List, Optional
+import threading
+from typing import Dict, Iterable, Optional
 
+from data.cache import MISSING, CacheStats, cacheable, make_cache
 from data.connection import db_cursor
+from data.passwords import (
+    LEGACY_PARAMS,
+    PasswordHashingBusyError,
+    ScryptParams,
+    current_params,
+    hash_password,
+    verify_password,
+)
 from psycopg2.errors import UniqueViolation
 
 
-@dataclass
+@cacheable
+@dataclass(slots=True)
 class User:
     id: int
     username: str
     password_salt: bytes
     password_scrypt: bytes
 
+    password_params: ScryptParams = LEGACY_PARAMS
+
     def check_password(self, password_plaintext: str) -> bool:
-        return self.password_scrypt == scrypt(
-            password_plaintext.encode("utf-8"), self.password_salt
+        """check_password hashes on the shared pool, so may raise PasswordHashingBusyError."""
+        return verify_password(
+            password_plaintext,
+            self.password_salt,
+            self.password_scrypt,
+            self.password_params,
         )
 
 
@@ -29,69 +45,181 @@ class UserRegistrationError(Exception):
         self.reason = reason
 
 
+_user_cache = None
+_user_cache_lock = threading.Lock()
+
+
+def user_cache():
+    """user_cache returns the cache of User records, keyed by "username:<name>" and "id:<id>"."""
+    global _user_cache
+    if _user_cache is None:
+        with _user_cache_lock:
+            if _user_cache is None:
+                _user_cache = make_cache(
+                    "users",
+                    max_entries=int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000")),
+                    ttl=float(os.getenv("USER_CACHE_TTL", "60")),
+                )
+    return _user_cache
+
+
+def user_cache_stats() -> CacheStats:
+    return user_cache().stats()
+
+
+def cache_user(user: User):
+    cache = user_cache()
+    cache.set(f"username:{user.username}", user)
+    cache.set(f"id:{user.id}", user)
+
+
+def invalidate_cached_user(*, username: str, user_id: int):
+    """invalidate_cached_user must be called whenever a user's row is inserted or changed."""
+    cache = user_cache()
+    cache.delete(f"username:{username}")
+    cache.delete(f"id:{user_id}")
+
+
 def get_user(username: str) -> Optional[User]:
-    with db_cursor() as cur:
+    cached = user_cache().get(f"username:{username}")
+    if cached is not MISSING:
+        return cached
+    with db_cursor(read_only=True) as cur:
         cur.execute(
-            "SELECT id, password_salt, password_scrypt FROM users WHERE username = %s",
-            (username,),
+            f"SELECT {USER_COLUMNS} FROM users WHERE username = %s", (username,)
         )
         row = cur.fetchone()
         if row is None:
             return None
-        user_id, password_salt, password_scrypt = row
-        return User(
-            id=user_id,
-            username=username,
-            password_salt=bytes(password_salt),
-            password_scrypt=bytes(password_scrypt),
-        )
+        user = row_to_user(row)
+    cache_user(user)
+    return user
 
 
-def get_suggested_follows(following_user: User, limit: int) -> List[str]:
-    with db_cursor() as cur:
+def get_user_by_id(user_id: int) -> Optional[User]:
+    cached = user_cache().get(f"id:{user_id}")
+    if cached is not MISSING:
+        return cached
+    with db_cursor(read_only=True) as cur:
+        cur.execute(f"SELECT {USER_COLUMNS} FROM users WHERE id = %s", (user_id,))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        user = row_to_user(row)
+    cache_user(user)
+    return user
+
+
+def get_users(usernames: Iterable[str]) -> Dict[str, User]:
+    """get_users looks up many users at once, returning those which exist keyed by username."""
+    found = {}
+    missing = []
+    for username in set(usernames):
+        cached = user_cache().get(f"username:{username}")
+        if cached is MISSING:
+            missing.append(username)
+        else:
+            found[username] = cached
+    if not missing:
+        return found
+    with db_cursor(read_only=True) as cur:
         cur.execute(
-            """
-            SELECT
-              users.username
-            FROM
-              users
-            WHERE
-              users.id <> %(following_user_id)s AND
-              users.id NOT IN (
-                SELECT followee FROM follows WHERE follower = %(following_user_id)s
-              )
-            ORDER BY RANDOM()
-            LIMIT %(limit)s
-            """,
-            dict(
-                following_user_id=following_user.id,
-                limit=limit,
-            ),
+            f"SELECT {USER_COLUMNS} FROM users WHERE username = ANY(%s)", (missing,)
         )
         rows = cur.fetchall()
-        return [row[0] for row in rows]
+    for row in rows:
+        user = row_to_user(row)
+        cache_user(user)
+        found[user.username] = user
+    return found
 
 
 def register_user(username: str, password_plaintext: str) -> User:
     salt = generate_salt()
-    password_scrypt = scrypt(password_plaintext.encode("utf-8"), salt)
+    params = current_params()
+    password_scrypt = hash_password(password_plaintext, salt, params)
 
     with db_cursor() as cur:
         try:
             cur.execute(
-                "INSERT INTO users (username, password_salt, password_scrypt) VALUES (%(username)s, %(password_salt)s, %(password_scrypt)s)",
+                """INSERT INTO users (username, password_salt, password_scrypt, password_scrypt_n, password_scrypt_r, password_scrypt_p)
+                VALUES (%(username)s, %(password_salt)s, %(password_scrypt)s, %(n)s, %(r)s, %(p)s)
+                RETURNING id""",
                 dict(
                     username=username,
                     password_salt=salt,
                     password_scrypt=password_scrypt,
+                    n=params.n,
+                    r=params.r,
+                    p=params.p,
                 ),
             )
         except UniqueViolation as err:
             raise UserRegistrationError("user already exists")
-
-
-def scrypt(password_plaintext: bytes, password_salt: bytes) -> bytes:
-    return hashlib.scrypt(password_plaintext, salt=password_salt, n=8, r=8, p=1)
+        user_id = cur.fetchone()[0]
+    invalidate_cached_user(username=username, user_id=user_id)
+    return User(
+        id=user_id,
+        username=username,
+        password_salt=salt,
+        password_scrypt=password_scrypt,
+        password_params=params,
+    )
+
+
+def rehash_password_if_outdated(user: User, password_plaintext: str) -> User:
+    """rehash_password_if_outdated rehashes a just-checked password whose hash used old parameters.
+
+    It's best effort: if the hashing pool is busy, the old hash is kept until the next login.
+    """
+    params = current_params()
+    if user.password_params == params:
+        return user
+    salt = generate_salt()
+    try:
+        password_scrypt = hash_password(password_plaintext, salt, params)
+    except PasswordHashingBusyError:
+        return user
+    with db_cursor() as cur:
+        cur.execute(
+            """UPDATE users SET
+              password_salt = %(password_salt)s,
+              password_scrypt = %(password_scrypt)s,
+              password_scrypt_n = %(n)s,
+              password_scrypt_r = %(r)s,
+              password_scrypt_p = %(p)s
+            WHERE id = %(user_id)s""",
+            dict(
+                password_salt=salt,
+                password_scrypt=password_scrypt,
+                n=params.n,
+                r=params.r,
+                p=params.p,
+                user_id=user.id,
+            ),
+        )
+    invalidate_cached_user(username=user.username, user_id=user.id)
+    return User(
+        id=user.id,
+        username=user.username,
+        password_salt=salt,
+        password_scrypt=password_scrypt,
+        password_params=params,
+    )
+
+
+USER_COLUMNS = "id, username, password_salt, password_scrypt, password_scrypt_n, password_scrypt_r, password_scrypt_p"
+
+
+def row_to_user(row) -> User:
+    user_id, username, password_salt, password_scrypt, n, r, p = row
+    return User(
+        id=user_id,
+        username=username,
+        password_salt=bytes(password_salt),
+        password_scrypt=bytes(password_scrypt),
+        password_params=ScryptParams(n=n, r=r, p=p),
+    )
 
 
 SALT_CHARACTERS = string.ascii_uppercase + string.ascii_lowercase + string.digits
@@ -1,14 +1,37 @@
-from typing import Dict, Union
-from data import blooms
-from data.follows import follow, get_followed_usernames, get_inverse_followed_usernames
+import datetime
+import hashlib
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from data import (
+    blooms,
+    connection,
+    export,
+    live,
+    metrics,
+    partitions,
+    search,
+    trending,
+)
+from data.follows import (
+    follow,
+    get_followed_usernames,
+    get_inverse_followed_usernames,
+    get_mutual_follows,
+    is_following,
+    unfollow,
+)
+from data.suggestions import get_suggested_follows
+from data.user_stats import get_user_stats
 from data.users import (
     UserRegistrationError,
-    get_suggested_follows,
     get_user,
+    get_users,
     register_user,
+    rehash_password_if_outdated,
 )
 
-from flask import Response, jsonify, make_response, request
+from flask import Response, current_app, jsonify, make_response, request
+from werkzeug.http import http_date, parse_date, parse_etags, quote_etag
 from flask_jwt_extended import (
     create_access_token,
     get_current_user,
@@ -19,6 +42,26 @@ from datetime import timedelta
 
 MINIMUM_PASSWORD_LENGTH = 5
 
+DEFAULT_PAGE_SIZE = 50
+PROFILE_RECENT_BLOOMS = 10
+MAXIMUM_PAGE_SIZE = 200
+
+MAXIMUM_BULK_BLOOMS = 10000
+# How far ahead of this server's clock an imported bloom's sent_timestamp may be.
+MAXIMUM_CLOCK_SKEW = timedelta(minutes=1)
+
+DEFAULT_TRENDING = 10
+
+# A client which missed more blooms than this while disconnected reloads its timeline instead.
+MAXIMUM_STREAM_REPLAY = 200
+
+# Blooms never change once sent, so a client may keep one forever.
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Lists gain blooms, so clients must revalidate (cheaply, with the ETag) before reuse.
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+# Profiles depend on who is looking at them.
+PRIVATE_REVALIDATE_CACHE_CONTROL = "private, no-cache"
+
 
 def login():
     type_check_error = verify_request_fields({"username": str, "password": str})
@@ -29,6 +72,7 @@ def login():
         return make_response(({"success": False, "message": "Unknown user"}, 403))
     if not user.check_password(request.json["password"]):
         return make_response(({"success": False, "message": "Incorrect password"}, 403))
+    rehash_password_if_outdated(user, request.json["password"])
     access_token = create_access_token(
         identity=request.json["username"], expires_delta=timedelta(days=1)
     )
@@ -77,18 +121,12 @@ def register():
 
 @jwt_required()
 def self_profile():
-    username = get_current_user().username
-
-    # Check if the user exists
-    user = get_user(username)
-    if user is None:
-        return make_response(
-            jsonify({"success": False, "message": "User not found"}), 404
-        )
+    # The JWT middleware has already looked up (and cached) the current user.
+    user = get_current_user()
 
     return jsonify(
         {
-            "username": username,
+            "username": user.username,
             "follows": get_followed_usernames(user),
             "followers": get_inverse_followed_usernames(user),
         }
@@ -109,24 +147,98 @@ def other_profile(profile_username):
 
     current_user = get_current_user()
 
-    followers = get_inverse_followed_usernames(profile_user)
-    all_blooms = blooms.get_blooms_for_user(profile_username)
-    all_blooms.reverse()
-    return jsonify(
-        {
+    stats = get_user_stats(profile_user)
+    viewer_is_following = current_user is not None and is_following(
+        current_user, profile_user
+    )
+    include = request.args.get("include", "").split(",")
+
+    def build_profile() -> Response:
+        recent_blooms = blooms.get_blooms_for_user(
+            profile_username, limit=PROFILE_RECENT_BLOOMS
+        )
+        profile = {
             "username": profile_username,
-            "recent_blooms": all_blooms[:10],
-            "follows": get_followed_usernames(profile_user),
-            "followers": list(followers),
-            "is_following": current_user is not None
-            and current_user.username in followers,
+            "recent_blooms": recent_blooms,
+            "is_following": viewer_is_following,
             "is_self": current_user is not None
             and current_user.username == profile_username,
-            "total_blooms": len(all_blooms),
+            "total_blooms": stats.bloom_count,
+            "follower_count": stats.follower_count,
+            "following_count": stats.following_count,
+            "last_bloom_timestamp": stats.last_bloom_timestamp,
         }
+
+        # Follow lists can be long, so only include their first pages when asked.
+        # Later pages come from /profile/<profile_username>/followers and /follows.
+        if "followers" in include:
+            profile["followers"] = get_inverse_followed_usernames(
+                profile_user, limit=DEFAULT_PAGE_SIZE
+            )
+        if "follows" in include:
+            profile["follows"] = get_followed_usernames(
+                profile_user, limit=DEFAULT_PAGE_SIZE
+            )
+
+        response = jsonify(profile)
+        # Older blooms can be fetched from /blooms/<profile_username> with this cursor.
+        cursor = next_cursor(recent_blooms, PROFILE_RECENT_BLOOMS)
+        if cursor is not None:
+            response.headers["Next-Cursor"] = cursor
+        return response
+
+    # The counts change whenever anything shown on the profile does.
+    return conditional_response(
+        build_profile,
+        etag=make_etag(
+            "profile",
+            profile_username,
+            stats,
+            current_user.username if current_user is not None else None,
+            viewer_is_following,
+            sorted(include),
+        ),
+        last_modified=None,
+        cache_control=PRIVATE_REVALIDATE_CACHE_CONTROL,
+        vary="Authorization",
     )
 
 
+def profile_followers(profile_username):
+    return username_page(profile_username, get_inverse_followed_usernames)
+
+
+def profile_follows(profile_username):
+    return username_page(profile_username, get_followed_usernames)
+
+
+def profile_mutuals(profile_username):
+    return username_page(profile_username, get_mutual_follows)
+
+
+def username_page(profile_username, get_usernames):
+    limit = get_limit_arg()
+    if isinstance(limit, Response):
+        return limit
+
+    profile_user = get_user(profile_username)
+    if profile_user is None:
+        return make_response(
+            jsonify(
+                {"success": False, "message": f"User {profile_username} not found"}
+            ),
+            404,
+        )
+
+    usernames = get_usernames(
+        profile_user, after=request.args.get("after"), limit=limit
+    )
+    response = jsonify(usernames)
+    if len(usernames) == limit:
+        response.headers["Next-Cursor"] = usernames[-1]
+    return response
+
+
 @jwt_required()
 def do_follow():
     type_check_error = verify_request_fields({"follow_username": str})
@@ -150,6 +262,24 @@ def do_follow():
     )
 
 
+@jwt_required()
+def do_unfollow(unfollow_username):
+    current_user = get_current_user()
+
+    unfollow_user = get_user(unfollow_username)
+    if unfollow_user is None:
+        return make_response(
+            (f"Cannot unfollow {unfollow_username} - user does not exist", 404)
+        )
+
+    unfollow(current_user, unfollow_user)
+    return jsonify(
+        {
+            "success": True,
+        }
+    )
+
+
 @jwt_required()
 def send_bloom():
     type_check_error = verify_request_fields({"content": str})
@@ -167,49 +297,287 @@ def send_bloom():
     )
 
 
+@jwt_required()
+def send_blooms_bulk():
+    """send_blooms_bulk ingests many blooms in one transaction, e.g. when importing an archive.
+
+    Anyone may bulk-send their own blooms; sending as other users, or with a sent_timestamp,
+    needs an admin (see ADMIN_USERNAMES).
+    Each item's outcome is reported in order, and invalid items don't stop the rest being inserted.
+    """
+    type_check_error = verify_request_fields({"blooms": list})
+    if type_check_error is not None:
+        return type_check_error
+    items = request.json["blooms"]
+    if len(items) > MAXIMUM_BULK_BLOOMS:
+        return make_response(
+            (f"At most {MAXIMUM_BULK_BLOOMS} blooms can be sent at once", 400)
+        )
+
+    current_user = get_current_user()
+    is_admin = current_user.username in admin_usernames()
+    senders = get_users(
+        item["sender"]
+        for item in items
+        if isinstance(item, dict)
+        and isinstance(item.get("sender"), str)
+        and is_storable_text(item["sender"])
+    )
+
+    results: List[Optional[Dict[str, Any]]] = []
+    new_blooms = []
+    for item in items:
+        new_bloom = parse_bulk_bloom(item, current_user, is_admin, senders)
+        if isinstance(new_bloom, str):
+            results.append({"success": False, "message": new_bloom})
+        else:
+            results.append(None)
+            new_blooms.append(new_bloom)
+
+    outcomes = iter(blooms.add_blooms_bulk(new_blooms) if new_blooms else [])
+    for index, result in enumerate(results):
+        if result is None:
+            outcome = next(outcomes)
+            results[index] = (
+                {"success": True, "id": outcome.bloom_id}
+                if outcome.error is None
+                else {"success": False, "message": outcome.error}
+            )
+
+    inserted = sum(1 for result in results if result["success"])
+    return jsonify(
+        {
+            "success": True,
+            "inserted": inserted,
+            "failed": len(results) - inserted,
+            "results": results,
+        }
+    )
+
+
+def parse_bulk_bloom(
+    item, current_user, is_admin, senders
+) -> Union[str, blooms.NewBloom]:
+    """parse_bulk_bloom validates one item of a bulk send, returning why it's invalid or the bloom to insert."""
+    if not isinstance(item, dict):
+        return "Bloom must be an object"
+    content = item.get("content")
+    if not isinstance(content, str):
+        return "Bloom missing field: content"
+    if not is_storable_text(content):
+        return "Bloom field content must be valid text without NUL characters"
+
+    sender_name = item.get("sender", current_user.username)
+    if not isinstance(sender_name, str):
+        return "Bloom field sender must be a str"
+    if not is_storable_text(sender_name):
+        return "Bloom field sender must be valid text without NUL characters"
+    if sender_name != current_user.username and not is_admin:
+        return f"Cannot send blooms as {sender_name}"
+    sender = (
+        current_user
+        if sender_name == current_user.username
+        else senders.get(sender_name)
+    )
+    if sender is None:
+        return f"Unknown user {sender_name}"
+
+    sent_timestamp = None
+    if item.get("sent_timestamp") is not None:
+        # Timelines show blooms in send order, so only imports may choose their send times.
+        if not is_admin:
+            return "Only admins may set sent_timestamp"
+        try:
+            sent_timestamp = datetime.datetime.fromisoformat(item["sent_timestamp"])
+        except (TypeError, ValueError):
+            return "Bloom field sent_timestamp must be an ISO 8601 timestamp"
+        if sent_timestamp.tzinfo is None:
+            return "Bloom field sent_timestamp must include a timezone"
+        if sent_timestamp > datetime.datetime.now(tz=datetime.UTC) + MAXIMUM_CLOCK_SKEW:
+            return "Bloom field sent_timestamp must not be in the future"
+
+    return blooms.NewBloom(
+        sender=sender, content=content, sent_timestamp=sent_timestamp
+    )
+
+
+def is_storable_text(text: str) -> bool:
+    """is_storable_text is whether Postgres can store text, which must be valid UTF-8 without NUL characters.
+
+    JSON can carry both NULs and unpaired surrogates, and either would fail a whole bulk insert.
+    """
+    if "\x00" in text:
+        return False
+    try:
+        text.encode("utf-8")
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def admin_usernames() -> List[str]:
+    return [
+        name.strip()
+        for name in os.getenv("ADMIN_USERNAMES", "").split(",")
+        if name.strip()
+    ]
+
+
 def get_bloom(id_str):
     try:
         id_int = int(id_str)
     except ValueError:
         return make_response((f"Invalid bloom id", 400))
+
+    # Blooms never change, but may be archived, so a cached copy is only valid while the bloom exists.
     bloom = blooms.get_bloom(id_int)
     if bloom is None:
-        return make_response((f"Bloom not found", 404))
-    return jsonify(bloom)
+        return make_response(("Bloom not found", 404))
+    return conditional_response(
+        lambda: jsonify(bloom),
+        etag=f"bloom-{id_int}",
+        last_modified=bloom.sent_timestamp,
+        cache_control=IMMUTABLE_CACHE_CONTROL,
+    )
 
 
 @jwt_required()
 def home_timeline():
+    page_args = get_page_args()
+    if isinstance(page_args, Response):
+        return page_args
+    before, limit = page_args
+
     current_user = get_current_user()
 
-    # Get blooms from followed users
-    followed_users = get_followed_usernames(current_user)
-    nested_user_blooms = [
-        blooms.get_blooms_for_user(followed_user, limit=50)
-        for followed_user in followed_users
-    ]
+    # Own blooms and blooms from followed users, merged and paginated by the database.
+    timeline = blooms.get_home_timeline(current_user, before=before, limit=limit)
 
-    # Flatten list of blooms from followed users
-    followed_blooms = [bloom for blooms in nested_user_blooms for bloom in blooms]
+    return paginated_response(timeline, limit)
 
-    # Get the current user's own blooms
-    own_blooms = blooms.get_blooms_for_user(current_user.username, limit=50)
 
-    # Combine own blooms with followed blooms
-    all_blooms = followed_blooms + own_blooms
+# EventSource can't send headers, so browsers pass their token as ?jwt= instead.
+@jwt_required(locations=["headers", "query_string"])
+def stream_home():
+    """stream_home pushes new blooms for the user's home timeline as Server-Sent Events.
 
-    # Sort by timestamp (newest first)
-    sorted_blooms = list(
-        sorted(all_blooms, key=lambda bloom: bloom.sent_timestamp, reverse=True)
+    Reconnecting clients send the id of the last bloom they saw as Last-Event-ID (or ?last_event_id=),
+    and are first sent everything they missed.
+    """
+    last_event_id = request.headers.get(
+        "Last-Event-ID", request.args.get("last_event_id")
     )
+    try:
+        after_id = int(last_event_id) if last_event_id is not None else None
+    except ValueError:
+        return make_response(("Invalid last event id", 400))
 
-    return jsonify(sorted_blooms)
+    user = get_current_user()
+    try:
+        subscription = live.broker().subscribe(
+            lambda: set(get_followed_usernames(user)) | {user.username}
+        )
+    except live.TooManySubscribersError:
+        return make_response(
+            (
+                {"success": False, "message": "Too many live streams, try again later"},
+                503,
+            )
+        )
+
+    # Subscribed before reading what was missed, so nothing falls in between.
+    replay = []
+    if after_id is not None:
+        try:
+            replay = blooms.get_home_blooms_after(
+                user, after_id, limit=MAXIMUM_STREAM_REPLAY + 1
+            )
+        except BaseException:
+            live.broker().unsubscribe(subscription)
+            raise
+    # The stream may stay open for hours, so mustn't hold on to this request's database connection.
+    connection.release_request_connection()
+
+    replay_complete = len(replay) <= MAXIMUM_STREAM_REPLAY
+    return Response(
+        live.event_stream(
+            subscription,
+            replay if replay_complete else [],
+            replay_complete=replay_complete,
+            dumps=current_app.json.dumps,
+        ),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"},
+    )
 
 
 def user_blooms(profile_username):
-    user_blooms = blooms.get_blooms_for_user(profile_username)
-    user_blooms.reverse()
-    return jsonify(user_blooms)
+    page_args = get_page_args()
+    if isinstance(page_args, Response):
+        return page_args
+    before, limit = page_args
+
+    def build_page() -> Response:
+        user_blooms = blooms.get_blooms_for_user(
+            profile_username, before=before, limit=limit
+        )
+        return paginated_response(user_blooms, limit)
+
+    profile_user = get_user(profile_username)
+    if profile_user is None:
+        return build_page()
+
+    # Blooms are only removed by archiving whole months, so the count, newest time and
+    # last archive identify the list.
+    stats = get_user_stats(profile_user)
+    archived_at = partitions.last_archived_at()
+    return conditional_response(
+        build_page,
+        etag=make_etag(
+            "blooms",
+            profile_username,
+            stats.bloom_count,
+            stats.last_bloom_timestamp,
+            archived_at,
+            before,
+            limit,
+        ),
+        last_modified=latest(stats.last_bloom_timestamp, archived_at),
+        cache_control=REVALIDATE_CACHE_CONTROL,
+    )
+
+
+def export_user_blooms(profile_username):
+    """export_user_blooms streams every bloom sent by the user as NDJSON, newest first, in constant memory."""
+    if get_user(profile_username) is None:
+        return make_response(
+            jsonify(
+                {"success": False, "message": f"User {profile_username} not found"}
+            ),
+            404,
+        )
+    slots = export.export_slots()
+    if not slots.acquire(blocking=False):
+        return make_response(
+            jsonify({"success": False, "message": "Too many exports, try again later"}),
+            503,
+            {"Retry-After": "10"},
+        )
+    # The export reads a page at a time as it streams, so this request's connection can go back now.
+    connection.release_request_connection()
+
+    response = Response(
+        export.ndjson_chunks(blooms.iter_blooms_for_user(profile_username)),
+        mimetype=export.MIMETYPE,
+        headers={
+            "Cache-Control": "no-store",
+            "Content-Disposition": f'attachment; filename="{profile_username}-blooms.ndjson"',
+            "X-Accel-Buffering": "no",
+        },
+    )
+    # Called once the response is finished with, even if the client went away part way.
+    response.call_on_close(slots.release)
+    return response
 
 
 @jwt_required()
@@ -229,19 +597,262 @@ def suggested_follows(limit_str):
 
 
 def hashtag(hashtag):
-    return jsonify(blooms.get_blooms_with_hashtag(hashtag))
+    page_args = get_page_args()
+    if isinstance(page_args, Response):
+        return page_args
+    before, limit = page_args
+
+    def build_page() -> Response:
+        hashtag_blooms = blooms.get_blooms_with_hashtag(
+            hashtag, before=before, limit=limit
+        )
+        return paginated_response(hashtag_blooms, limit)
+
+    version = blooms.get_hashtag_version(hashtag)
+    archived_at = partitions.last_archived_at()
+    return conditional_response(
+        build_page,
+        etag=make_etag("hashtag", hashtag, version, archived_at, before, limit),
+        last_modified=latest(version.last_modified(), archived_at),
+        cache_control=REVALIDATE_CACHE_CONTROL,
+    )
+
+
+def trending_hashtags():
+    """trending_hashtags lists the hashtags used most in the last hour, day or week, most used first."""
+    window = request.args.get("window", trending.DEFAULT_WINDOW)
+    if window not in trending.WINDOWS:
+        return make_response(
+            (f"Window must be one of: {', '.join(trending.WINDOWS)}", 400)
+        )
+    limit_str = request.args.get("limit")
+    try:
+        limit = int(limit_str) if limit_str is not None else DEFAULT_TRENDING
+    except ValueError:
+        return make_response(("Invalid limit", 400))
+    if limit < 1 or limit > trending.max_trending():
+        return make_response(
+            (f"Limit must be between 1 and {trending.max_trending()}", 400)
+        )
+
+    response = jsonify(
+        [
+            {"hashtag": hashtag.hashtag, "count": hashtag.count}
+            for hashtag in trending.get_trending(window, limit)
+        ]
+    )
+    # Every worker recomputes its list this often anyway.
+    response.headers["Cache-Control"] = (
+        f"public, max-age={int(trending.refresh_interval())}"
+    )
+    return response
+
+
+def search_blooms():
+    query = request.args.get("q", "")
+    order = request.args.get("order", search.RELEVANCE)
+    if order not in search.ORDERS:
+        return make_response((f"Order must be one of: {', '.join(search.ORDERS)}", 400))
+    limit = get_limit_arg()
+    if isinstance(limit, Response):
+        return limit
+    before = None
+    before_str = request.args.get("before")
+    if before_str is not None:
+        try:
+            before = search.decode_cursor(before_str, order)
+        except blooms.InvalidCursorError:
+            return make_response(("Invalid cursor", 400))
+
+    try:
+        results = search.search_blooms(query, order=order, before=before, limit=limit)
+    except search.InvalidQueryError as error:
+        return make_response((str(error), 400))
+
+    response = jsonify([result.bloom for result in results])
+    if len(results) == limit:
+        response.headers["Next-Cursor"] = search.next_cursor(
+            results[-1], order
+        ).encode()
+    return response
+
+
+def serve_metrics():
+    """serve_metrics serves request and database metrics in the Prometheus text format."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
 
 def verify_request_fields(names_to_types: Dict[str, type]) -> Union[Response, None]:
+    error = check_request_fields(request.json, names_to_types)
+    if error is not None:
+        return make_response((error, 400))
+    return None
+
+
+def get_page_args() -> Union[Response, Tuple[Optional[blooms.Cursor], int]]:
+    """get_page_args reads the before cursor and limit query parameters of a paginated endpoint."""
+    page_args = parse_page_args(request.args.get("before"), request.args.get("limit"))
+    if isinstance(page_args, str):
+        return make_response((page_args, 400))
+    return page_args
+
+
+def get_limit_arg() -> Union[Response, int]:
+    limit = parse_limit(request.args.get("limit"))
+    if isinstance(limit, str):
+        return make_response((limit, 400))
+    return limit
+
+
+def paginated_response(page: List[blooms.Bloom], limit: int) -> Response:
+    """paginated_response returns a page of blooms, with a Next-Cursor header if there may be more."""
+    response = jsonify(page)
+    cursor = next_cursor(page, limit)
+    if cursor is not None:
+        response.headers["Next-Cursor"] = cursor
+    return response
+
+
+# The functions below check requests and build responses without Flask, so the async
+# endpoints share them, and both apps answer alike. Those returning Union[str, ...] return
+# why the request is invalid as a str.
+
+
+def check_request_fields(body: Any, names_to_types: Dict[str, type]) -> Optional[str]:
+    """check_request_fields returns why a JSON request body lacks any of the fields, with the expected types."""
+    if not isinstance(body, dict):
+        body = {}
     for name, expected_type in names_to_types.items():
-        if name not in request.json:
-            return make_response((f"Request missing field: {name}", 400))
-        actual_type = type(request.json[name])
+        if name not in body:
+            return f"Request missing field: {name}"
+        actual_type = type(body[name])
         if actual_type != expected_type:
-            return make_response(
-                (
-                    f"Request field {name} had wrong type - expected {expected_type.__name__} but got {actual_type.__name__}",
-                    400,
-                )
-            )
+            return f"Request field {name} had wrong type - expected {expected_type.__name__} but got {actual_type.__name__}"
     return None
+
+
+def parse_page_args(
+    before_str: Optional[str], limit_str: Optional[str]
+) -> Union[str, Tuple[Optional[blooms.Cursor], int]]:
+    """parse_page_args parses the before cursor and limit query parameters of a paginated endpoint."""
+    limit = parse_limit(limit_str)
+    if isinstance(limit, str):
+        return limit
+    if before_str is None:
+        return None, limit
+    try:
+        return blooms.Cursor.decode(before_str), limit
+    except blooms.InvalidCursorError:
+        return "Invalid cursor"
+
+
+def parse_limit(limit_str: Optional[str]) -> Union[str, int]:
+    if limit_str is None:
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(limit_str)
+    except ValueError:
+        return "Invalid limit"
+    if limit < 1 or limit > MAXIMUM_PAGE_SIZE:
+        return f"Limit must be between 1 and {MAXIMUM_PAGE_SIZE}"
+    return limit
+
+
+def next_cursor(page: List[blooms.Bloom], limit: int) -> Optional[str]:
+    """next_cursor returns the Next-Cursor header of a full page of blooms, which may be followed by more."""
+    if len(page) == limit:
+        return blooms.Cursor.after(page[-1]).encode()
+    return None
+
+
+def make_etag(*parts: Any) -> str:
+    """make_etag derives an opaque entity tag from everything a response depends on."""
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()[:32]
+
+
+def as_utc(timestamp: Optional[datetime.datetime]) -> Optional[datetime.datetime]:
+    # Timestamps are stored without a time zone, in UTC.
+    if timestamp is None or timestamp.tzinfo is not None:
+        return timestamp
+    return timestamp.replace(tzinfo=datetime.UTC)
+
+
+def latest(*timestamps: Optional[datetime.datetime]) -> Optional[datetime.datetime]:
+    """latest returns the latest of the timestamps which aren't None, if any."""
+    known = [as_utc(timestamp) for timestamp in timestamps if timestamp is not None]
+    return max(known) if known else None
+
+
+def is_not_modified(
+    etag: str,
+    last_modified: Optional[datetime.datetime],
+    *,
+    if_none_match: Optional[str],
+    if_modified_since: Optional[str],
+) -> bool:
+    """is_not_modified is whether a client's conditional request headers show its copy is still current."""
+    if if_none_match:
+        return parse_etags(if_none_match).contains(etag)
+    if last_modified is not None and if_modified_since:
+        since = parse_date(if_modified_since)
+        return (
+            since is not None and as_utc(last_modified).replace(microsecond=0) <= since
+        )
+    return False
+
+
+def validator_headers(
+    *, etag: str, last_modified: Optional[datetime.datetime], cache_control: str
+) -> Dict[str, str]:
+    """validator_headers returns the headers a client needs to cache a response and revalidate it later."""
+    headers = {"ETag": quote_etag(etag), "Cache-Control": cache_control}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(as_utc(last_modified))
+    return headers
+
+
+def request_is_not_modified(
+    etag: str, last_modified: Optional[datetime.datetime]
+) -> bool:
+    return is_not_modified(
+        etag,
+        last_modified,
+        if_none_match=request.headers.get("If-None-Match"),
+        if_modified_since=request.headers.get("If-Modified-Since"),
+    )
+
+
+def not_modified_response(
+    *, etag: str, last_modified: Optional[datetime.datetime], cache_control: str
+) -> Response:
+    return Response(
+        status=304,
+        headers=validator_headers(
+            etag=etag, last_modified=last_modified, cache_control=cache_control
+        ),
+    )
+
+
+def conditional_response(
+    build: Callable[[], Response],
+    *,
+    etag: str,
+    last_modified: Optional[datetime.datetime],
+    cache_control: str,
+    vary: Optional[str] = None,
+) -> Response:
+    """conditional_response answers 304 if the client's copy is current, only building the body otherwise."""
+    if request_is_not_modified(etag, last_modified):
+        response = not_modified_response(
+            etag=etag, last_modified=last_modified, cache_control=cache_control
+        )
+    else:
+        response = build()
+        response.headers.update(
+            validator_headers(
+                etag=etag, last_modified=last_modified, cache_control=cache_control
+            )
+        )
+    if vary is not None:
+        response.vary.add(vary)
+    return response
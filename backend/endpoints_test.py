@@ -0,0 +1,174 @@
+import datetime
+import os
+import unittest
+from unittest import mock
+
+from data import export, ids
+from data.blooms import Bloom, HashtagVersion, NewBloom
+from data.user_stats import UserStats
+from data.users import User
+from endpoints import parse_bulk_bloom
+from main import create_app
+
+ADA = User(id=1, username="ada", password_salt=b"", password_scrypt=b"")
+
+
+class TestParseBulkBloom(unittest.TestCase):
+    def test_valid_bloom(self):
+        self.assertEqual(
+            parse_bulk_bloom({"content": "Hello \U0001f338"}, ADA, False, {}),
+            NewBloom(sender=ADA, content="Hello \U0001f338"),
+        )
+
+    def test_rejects_text_postgres_cannot_store(self):
+        for item in [
+            {"content": "nul\x00byte"},
+            {"content": "lone \ud800 surrogate"},
+            {"content": "Hello", "sender": "ad\x00a"},
+        ]:
+            self.assertIsInstance(parse_bulk_bloom(item, ADA, True, {}), str)
+
+    def test_only_admins_set_sent_timestamp(self):
+        item = {"content": "Hello", "sent_timestamp": "2024-01-02T03:04:05+00:00"}
+        self.assertEqual(
+            parse_bulk_bloom(item, ADA, False, {}), "Only admins may set sent_timestamp"
+        )
+        self.assertEqual(
+            parse_bulk_bloom(item, ADA, True, {}).sent_timestamp,
+            datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=datetime.UTC),
+        )
+
+    def test_rejects_future_sent_timestamp(self):
+        future = datetime.datetime.now(tz=datetime.UTC) + datetime.timedelta(days=1)
+        self.assertIsInstance(
+            parse_bulk_bloom(
+                {"content": "Hello", "sent_timestamp": future.isoformat()},
+                ADA,
+                True,
+                {},
+            ),
+            str,
+        )
+
+
+class TestExportUserBlooms(unittest.TestCase):
+    def setUp(self):
+        with mock.patch.dict(os.environ, {"JWT_SECRET_KEY": "test-secret"}):
+            self.client = create_app().test_client()
+        for patcher in [
+            mock.patch.dict(os.environ, {"EXPORT_MAX_CONCURRENT": "1"}),
+            mock.patch.object(export, "_export_slots", None),
+            mock.patch("endpoints.get_user", return_value=ADA),
+            mock.patch(
+                "endpoints.blooms.iter_blooms_for_user",
+                side_effect=lambda username: iter(
+                    [
+                        Bloom(
+                            id=1,
+                            sender=username,
+                            content="Hello",
+                            sent_timestamp=datetime.datetime(2025, 5, 1),
+                        )
+                    ]
+                ),
+            ),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_limits_concurrent_exports(self):
+        first = self.client.get("/blooms/ada/export", buffered=False)
+        self.assertEqual(first.status_code, 200)
+        busy = self.client.get("/blooms/ada/export")
+        self.assertEqual(busy.status_code, 503)
+        self.assertIn("Retry-After", busy.headers)
+
+        # Finishing with a response, read or not, frees its slot.
+        first.close()
+        again = self.client.get("/blooms/ada/export")
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(again.get_data(as_text=True).count("\n"), 1)
+
+
+class TestArchivedListValidators(unittest.TestCase):
+    SENT = datetime.datetime(2025, 5, 1)
+
+    def setUp(self):
+        with mock.patch.dict(os.environ, {"JWT_SECRET_KEY": "test-secret"}):
+            self.client = create_app().test_client()
+        self.archived_at = None
+        self.hashtag_version = HashtagVersion(
+            bloom_count=1, newest_timestamp=self.SENT, last_bloom_id=ids_at(self.SENT)
+        )
+        for patcher in [
+            mock.patch("endpoints.get_user", return_value=ADA),
+            mock.patch(
+                "endpoints.get_user_stats",
+                return_value=UserStats(
+                    bloom_count=1,
+                    follower_count=0,
+                    following_count=0,
+                    last_bloom_timestamp=self.SENT,
+                ),
+            ),
+            mock.patch(
+                "endpoints.blooms.get_hashtag_version",
+                side_effect=lambda hashtag: self.hashtag_version,
+            ),
+            mock.patch("endpoints.blooms.get_blooms_for_user", return_value=[]),
+            mock.patch("endpoints.blooms.get_blooms_with_hashtag", return_value=[]),
+            mock.patch(
+                "endpoints.partitions.last_archived_at",
+                side_effect=lambda: self.archived_at,
+            ),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_archiving_changes_validators(self):
+        for path in ["/blooms/ada", "/hashtag/purple"]:
+            self.archived_at = None
+            before = self.client.get(path)
+            self.assertEqual(
+                self.client.get(
+                    path, headers={"If-None-Match": before.headers["ETag"]}
+                ).status_code,
+                304,
+            )
+
+            self.archived_at = datetime.datetime(2025, 6, 1)
+            for headers in [
+                {"If-None-Match": before.headers["ETag"]},
+                {"If-Modified-Since": before.headers["Last-Modified"]},
+            ]:
+                self.assertEqual(
+                    self.client.get(path, headers=headers).status_code, 200
+                )
+
+    def test_backdated_bloom_changes_hashtag_validators(self):
+        before = self.client.get("/hashtag/purple")
+
+        # A backdated bloom, added a month later, doesn't change the newest send time.
+        self.hashtag_version = HashtagVersion(
+            bloom_count=2,
+            newest_timestamp=self.SENT,
+            last_bloom_id=ids_at(datetime.datetime(2025, 6, 1)),
+        )
+        for headers in [
+            {"If-None-Match": before.headers["ETag"]},
+            {"If-Modified-Since": before.headers["Last-Modified"]},
+        ]:
+            self.assertEqual(
+                self.client.get("/hashtag/purple", headers=headers).status_code, 200
+            )
+
+
+def ids_at(timestamp: datetime.datetime) -> int:
+    """ids_at returns the first id generated at timestamp, a UTC time without a time zone."""
+    return ids.IdGenerator(
+        0, clock=lambda: int(timestamp.replace(tzinfo=datetime.UTC).timestamp() * 1e9)
+    ).next_id()
+
+
+if __name__ == "__main__":
+    unittest.main()
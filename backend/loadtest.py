@@ -0,0 +1,215 @@
+"""Replays a mixed workload against a running server, and reports throughput and latency per endpoint.
+
+It logs in as users created by seed.py, so seed the database first. Run from the backend directory, e.g.:
+  python3 loadtest.py --url http://127.0.0.1:3000 --concurrency 32 --duration 60
+"""
+
+import argparse
+import collections
+import math
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import requests
+
+DEFAULT_MIX = "home=40,profile=20,hashtag=15,blooms=10,post=10,login=5"
+
+
+class Recorder:
+    """Recorder collects the latency and outcome of every request, by endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = collections.defaultdict(list)
+        self.errors: Dict[str, int] = collections.defaultdict(int)
+
+    def record(self, endpoint: str, seconds: float, ok: bool):
+        with self._lock:
+            self.latencies[endpoint].append(seconds)
+            if not ok:
+                self.errors[endpoint] += 1
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """percentile returns the nearest-rank percentile of already sorted values."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def parse_mix(mix: str) -> List[Tuple[str, float]]:
+    weights = []
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(
+                f"Unknown operation {name}; choose from {', '.join(OPERATIONS)}"
+            )
+        weights.append((name, float(weight or 1)))
+    return weights
+
+
+class Client:
+    """Client is one simulated user, making requests over its own keep-alive session."""
+
+    def __init__(
+        self, options: argparse.Namespace, recorder: Recorder, rng: random.Random
+    ):
+        self.options = options
+        self.recorder = recorder
+        self.rng = rng
+        self.session = requests.Session()
+        self.username = self.random_username()
+        self.token: Optional[str] = None
+
+    def random_username(self) -> str:
+        return f"{self.options.prefix}{self.rng.randrange(self.options.users)}"
+
+    def request(
+        self, endpoint: str, method: str, path: str, **kwargs
+    ) -> Optional[requests.Response]:
+        if self.token is not None:
+            kwargs.setdefault("headers", {})["Authorization"] = f"Bearer {self.token}"
+        started = time.perf_counter()
+        try:
+            response = self.session.request(
+                method, self.options.url + path, timeout=self.options.timeout, **kwargs
+            )
+        except requests.RequestException:
+            self.recorder.record(endpoint, time.perf_counter() - started, False)
+            return None
+        # 304s are successes: the client's cached copy is still valid.
+        ok = response.status_code in (200, 304)
+        self.recorder.record(endpoint, time.perf_counter() - started, ok)
+        return response if ok else None
+
+    def login(self):
+        self.username = self.random_username()
+        self.token = None
+        response = self.request(
+            "login",
+            "POST",
+            "/login",
+            json={"username": self.username, "password": self.options.password},
+        )
+        if response is not None:
+            self.token = response.json().get("token")
+
+    def home(self):
+        self.ensure_logged_in()
+        self.request("home", "GET", "/home")
+
+    def profile(self):
+        self.request("profile", "GET", f"/profile/{self.random_username()}")
+
+    def blooms(self):
+        self.request("blooms", "GET", f"/blooms/{self.random_username()}")
+
+    def hashtag(self):
+        rank = min(self.options.hashtags, int(self.rng.paretovariate(1.2)))
+        self.request("hashtag", "GET", f"/hashtag/topic{rank}")
+
+    def post(self):
+        self.ensure_logged_in()
+        words = " ".join(
+            self.rng.choice(["load", "test", "bloom", "hello"]) for _ in range(8)
+        )
+        self.request(
+            "post",
+            "POST",
+            "/bloom",
+            json={"content": f"{words} #topic{self.rng.randint(1, 20)}"},
+        )
+
+    def ensure_logged_in(self):
+        if self.token is None:
+            self.login()
+
+
+OPERATIONS: Dict[str, Callable[[Client], None]] = {
+    "login": Client.login,
+    "home": Client.home,
+    "profile": Client.profile,
+    "blooms": Client.blooms,
+    "hashtag": Client.hashtag,
+    "post": Client.post,
+}
+
+
+def run_client(options, recorder: Recorder, mix, seed: int, deadline: float):
+    rng = random.Random(seed)
+    client = Client(options, recorder, rng)
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    while time.monotonic() < deadline:
+        OPERATIONS[rng.choices(names, weights)[0]](client)
+
+
+def report(recorder: Recorder, elapsed: float):
+    print(
+        f"{'endpoint':<10} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    )
+    total = 0
+    for endpoint in sorted(recorder.latencies):
+        latencies = sorted(recorder.latencies[endpoint])
+        total += len(latencies)
+        print(
+            f"{endpoint:<10} {len(latencies):>9} {recorder.errors[endpoint]:>7} {len(latencies) / elapsed:>9.1f} "
+            + " ".join(
+                f"{percentile(latencies, fraction) * 1000:>8.1f}"
+                for fraction in (0.5, 0.95, 0.99)
+            )
+        )
+    print(
+        f"{'total':<10} {total:>9} {sum(recorder.errors.values()):>7} {total / elapsed:>9.1f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--url", default="http://127.0.0.1:3000")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to run for")
+    parser.add_argument(
+        "--mix",
+        default=DEFAULT_MIX,
+        help=f"Relative weights of each operation (default {DEFAULT_MIX})",
+    )
+    parser.add_argument(
+        "--users", type=int, default=1000, help="How many users seed.py created"
+    )
+    parser.add_argument("--hashtags", type=int, default=5000)
+    parser.add_argument("--prefix", default="seed")
+    parser.add_argument("--password", default="password")
+    parser.add_argument("--timeout", type=float, default=10)
+    parser.add_argument("--random-seed", type=int, default=0)
+    options = parser.parse_args()
+    try:
+        mix = parse_mix(options.mix)
+    except argparse.ArgumentTypeError as error:
+        parser.error(str(error))
+
+    recorder = Recorder()
+    started = time.monotonic()
+    deadline = started + options.duration
+    threads = [
+        threading.Thread(
+            target=run_client,
+            args=(options, recorder, mix, options.random_seed + i, deadline),
+        )
+        for i in range(options.concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    report(recorder, time.monotonic() - started)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,66 @@
+import argparse
 import os
 
 from custom_json_provider import CustomJsonProvider
+from data import connection, tracing
+from data.connection import PoolTimeoutError
+from data.passwords import PasswordHashingBusyError
 from data.users import lookup_user
 from endpoints import (
     do_follow,
+    do_unfollow,
+    export_user_blooms,
     get_bloom,
     hashtag,
     home_timeline,
     login,
     other_profile,
+    profile_followers,
+    profile_follows,
+    profile_mutuals,
     register,
+    search_blooms,
     self_profile,
     send_bloom,
+    send_blooms_bulk,
+    serve_metrics,
+    stream_home,
     suggested_follows,
+    trending_hashtags,
     user_blooms,
 )
 
 from dotenv import load_dotenv
-from flask import Flask
+from flask import Flask, jsonify, make_response
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 
+# Seconds a client refused because too many passwords are being hashed should wait.
+HASHING_BUSY_RETRY_AFTER = "1"
 
-def main():
-    load_dotenv()
 
+def create_app() -> Flask:
     app = Flask("PurpleForest")
 
     app.json = CustomJsonProvider(app)
 
+    connection.init_app(app)
+    tracing.init_app(app)
+
+    @app.errorhandler(PoolTimeoutError)
+    def database_busy(error):
+        return make_response(
+            jsonify({"success": False, "message": "Server busy, try again"}), 503
+        )
+
+    @app.errorhandler(PasswordHashingBusyError)
+    def hashing_busy(error):
+        return make_response(
+            jsonify({"success": False, "message": "Server busy, try again"}),
+            503,
+            {"Retry-After": HASHING_BUSY_RETRY_AFTER},
+        )
+
     # Configure CORS to handle preflight requests
     CORS(
         app,
@@ -36,8 +68,9 @@ def main():
         resources={
             r"/*": {
                 "origins": "*",
-                "allow_headers": ["Content-Type", "Authorization"],
+                "allow_headers": ["Content-Type", "Authorization", "Last-Event-ID"],
                 "methods": ["GET", "POST", "OPTIONS"],
+                "expose_headers": ["Next-Cursor", "X-Query-Count", "Server-Timing"],
             }
         },
     )
@@ -50,18 +83,63 @@ def main():
     app.add_url_rule("/login", methods=["POST"], view_func=login)
 
     app.add_url_rule("/home", view_func=home_timeline)
+    app.add_url_rule("/stream/home", view_func=stream_home)
 
     app.add_url_rule("/profile", view_func=self_profile)
     app.add_url_rule("/profile/<profile_username>", view_func=other_profile)
+    app.add_url_rule(
+        "/profile/<profile_username>/followers", view_func=profile_followers
+    )
+    app.add_url_rule("/profile/<profile_username>/follows", view_func=profile_follows)
+    app.add_url_rule("/profile/<profile_username>/mutuals", view_func=profile_mutuals)
     app.add_url_rule("/follow", methods=["POST"], view_func=do_follow)
+    app.add_url_rule(
+        "/unfollow/<unfollow_username>", methods=["POST"], view_func=do_unfollow
+    )
     app.add_url_rule("/suggested-follows/<limit_str>", view_func=suggested_follows)
 
     app.add_url_rule("/bloom", methods=["POST"], view_func=send_bloom)
     app.add_url_rule("/bloom/<id_str>", methods=["GET"], view_func=get_bloom)
+    app.add_url_rule("/blooms/bulk", methods=["POST"], view_func=send_blooms_bulk)
     app.add_url_rule("/blooms/<profile_username>", view_func=user_blooms)
+    app.add_url_rule("/blooms/<profile_username>/export", view_func=export_user_blooms)
     app.add_url_rule("/hashtag/<hashtag>", view_func=hashtag)
+    app.add_url_rule("/search", view_func=search_blooms)
+    app.add_url_rule("/trending", view_func=trending_hashtags)
+
+    app.add_url_rule("/metrics", view_func=serve_metrics)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the PurpleForest backend")
+    parser.add_argument(
+        "--dev",
+        action="store_true",
+        help="Run Flask's single-process development server, with the debugger and auto-reloader",
+    )
+    parser.add_argument(
+        "--asgi",
+        action="store_true",
+        help="Serve the busiest endpoints with async handlers and an async database driver (needs requirements-async.txt)",
+    )
+    args = parser.parse_args()
+
+    load_dotenv()
+
+    app = create_app()
+
+    if args.dev:
+        app.run(host="0.0.0.0", port="3000", debug=True)
+    else:
+        # Imported here so that gunicorn isn't needed just to use the dev server.
+        import server
 
-    app.run(host="0.0.0.0", port="3000", debug=True)
+        if args.asgi:
+            server.run_asgi(app)
+        else:
+            server.run(app)
 
 
 if __name__ == "__main__":
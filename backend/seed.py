@@ -0,0 +1,301 @@
+"""Fills the database with a synthetic, production-shaped dataset, writing directly to Postgres.
+
+Follower counts, bloom counts and hashtag use all follow power laws: a few users are
+followed by most people and a few hashtags are on most blooms, like real networks.
+Work is split into chunks of users, loaded with COPY by parallel worker processes.
+
+Run from the backend directory, against a migrated database, e.g.:
+  python3 seed.py --users 100000
+Every seeded user's password is --password, so loadtest.py can log in as them.
+"""
+
+import argparse
+import datetime
+import io
+import math
+import multiprocessing
+import os
+import random
+import time
+from typing import Iterable, List, Sequence
+
+from data import ids, user_stats
+from data.connection import connect
+from data.passwords import current_params, scrypt
+from data.users import generate_salt
+
+from dotenv import load_dotenv
+
+WORDS = (
+    "the a purple forest bloom today just about really new love think why how "
+    "never always coffee music code tech life work weekend morning night tree "
+    "flower rain sun friends little big great terrible honestly maybe"
+).split()
+
+# Module globals set in each worker process by init_worker.
+_options = None
+_generator = None
+
+
+def zipf_rank(rng: random.Random, n: int, exponent: float) -> int:
+    """zipf_rank picks a rank from 1 to n, where rank r is picked with probability proportional to r ** -exponent.
+
+    It inverts the continuous distribution's CDF, so needs no per-rank tables even for millions of ranks.
+    """
+    u = rng.random()
+    if exponent == 1.0:
+        rank = n**u
+    else:
+        one_minus = 1.0 - exponent
+        rank = ((n**one_minus - 1.0) * u + 1.0) ** (1.0 / one_minus)
+    return min(n, max(1, math.floor(rank)))
+
+
+def heavy_tailed_count(rng: random.Random, mean: float, maximum: int) -> int:
+    """heavy_tailed_count picks a count averaging about mean, but with a long tail of much larger ones."""
+    # A Pareto variate with shape 2, minus 1, has a mean of 1.
+    return min(maximum, int(mean * (rng.paretovariate(2.0) - 1.0)))
+
+
+def copy_rows(cur, table: str, columns: Sequence[str], rows: Iterable[Sequence]):
+    """copy_rows loads rows into table with COPY, which is far faster than INSERTs."""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(copy_value(value) for value in row))
+        buffer.write("\n")
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+
+def copy_value(value) -> str:
+    if value is None:
+        return "\\N"
+    if isinstance(value, bytes):
+        return "\\\\x" + value.hex()
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def init_worker(options: argparse.Namespace, next_slot):
+    global _options, _generator
+    _options = options
+    with next_slot.get_lock():
+        slot = next_slot.value
+        next_slot.value += 1
+    _generator = ids.IdGenerator(options.id_worker_id + slot)
+
+
+def user_ids_in(chunk: int) -> range:
+    first = _options.first_user_id + chunk * _options.chunk_size
+    last = min(first + _options.chunk_size, _options.first_user_id + _options.users)
+    return range(first, last)
+
+
+def seed_users(chunk: int) -> int:
+    user_ids = user_ids_in(chunk)
+    offset = _options.first_user_id
+    conn = connect()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                copy_rows(
+                    cur,
+                    "users",
+                    [
+                        "id",
+                        "username",
+                        "password_salt",
+                        "password_scrypt",
+                        "password_scrypt_n",
+                        "password_scrypt_r",
+                        "password_scrypt_p",
+                    ],
+                    (
+                        (
+                            user_id,
+                            f"{_options.prefix}{user_id - offset}",
+                            _options.password_salt,
+                            _options.password_scrypt,
+                            _options.password_params.n,
+                            _options.password_params.r,
+                            _options.password_params.p,
+                        )
+                        for user_id in user_ids
+                    ),
+                )
+    finally:
+        conn.close()
+    return len(user_ids)
+
+
+def seed_activity(chunk: int) -> int:
+    """seed_activity writes the follows, blooms and hashtags of one chunk of users, and returns how many blooms it wrote."""
+    options = _options
+    rng = random.Random(f"{options.random_seed}:{chunk}")
+    now = datetime.datetime.now(tz=datetime.UTC).replace(tzinfo=None)
+    window_ms = options.days * 24 * 60 * 60 * 1000
+
+    follow_rows = []
+    bloom_rows = []
+    hashtag_rows = []
+    for user_id in user_ids_in(chunk):
+        followees = set()
+        for _ in range(
+            heavy_tailed_count(rng, options.follows_per_user, options.users - 1)
+        ):
+            rank = zipf_rank(rng, options.users, options.follow_exponent)
+            followee = options.first_user_id + rank - 1
+            if followee != user_id:
+                followees.add(followee)
+        follow_rows.extend((user_id, followee) for followee in followees)
+
+        for _ in range(
+            heavy_tailed_count(
+                rng, options.blooms_per_user, options.max_blooms_per_user
+            )
+        ):
+            bloom_id = _generator.next_id()
+            sent = now - datetime.timedelta(milliseconds=rng.randrange(window_ms))
+            hashtags = {
+                f"topic{zipf_rank(rng, options.hashtags, options.hashtag_exponent)}"
+                for _ in range(min(3, int(rng.expovariate(1.5))))
+            }
+            words = rng.choices(WORDS, k=rng.randint(3, 25))
+            content = " ".join(words + [f"#{hashtag}" for hashtag in sorted(hashtags)])
+            bloom_rows.append((bloom_id, user_id, content, sent.isoformat()))
+            hashtag_rows.extend(
+                (hashtag, bloom_id, sent.isoformat()) for hashtag in hashtags
+            )
+
+    conn = connect()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                copy_rows(cur, "follows", ["follower", "followee"], follow_rows)
+                copy_rows(
+                    cur,
+                    "blooms",
+                    ["id", "sender_id", "content", "send_timestamp"],
+                    bloom_rows,
+                )
+                copy_rows(
+                    cur,
+                    "hashtags",
+                    ["hashtag", "bloom_id", "send_timestamp"],
+                    hashtag_rows,
+                )
+    finally:
+        conn.close()
+    return len(bloom_rows)
+
+
+def run_chunks(pool, func, chunks: List[int], label: str):
+    started = time.monotonic()
+    total = 0
+    for done, count in enumerate(pool.imap_unordered(func, chunks), start=1):
+        total += count
+        if done % 10 == 0 or done == len(chunks):
+            print(
+                f"  {label}: {done}/{len(chunks)} chunks, {total} rows, {time.monotonic() - started:.1f}s"
+            )
+    return total
+
+
+def main():
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--follows-per-user", type=float, default=50)
+    parser.add_argument("--blooms-per-user", type=float, default=20)
+    parser.add_argument("--max-blooms-per-user", type=int, default=5000)
+    parser.add_argument("--hashtags", type=int, default=5000)
+    parser.add_argument(
+        "--follow-exponent",
+        type=float,
+        default=1.1,
+        help="Power law exponent of how many followers each user gets; higher means more skewed",
+    )
+    parser.add_argument("--hashtag-exponent", type=float, default=1.2)
+    parser.add_argument(
+        "--days", type=int, default=365, help="Spread blooms over this many past days"
+    )
+    parser.add_argument("--prefix", default="seed", help="Prefix of every username")
+    parser.add_argument("--password", default="password")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--random-seed", default="purpleforest")
+    parser.add_argument(
+        "--id-worker-id",
+        type=int,
+        default=1000,
+        help="Bloom id worker ids to use, counting up; keep clear of the web server's ID_WORKER_ID range",
+    )
+    options = parser.parse_args()
+    if options.users < 2:
+        parser.error("--users must be at least 2")
+    if options.id_worker_id + options.workers > ids.MAX_WORKER_ID + 1:
+        parser.error(
+            f"--id-worker-id plus --workers must be at most {ids.MAX_WORKER_ID + 1}"
+        )
+
+    options.password_salt = generate_salt()
+    # Every seeded user shares one password, so it only needs hashing once.
+    options.password_params = current_params()
+    options.password_scrypt = scrypt(
+        options.password.encode("utf-8"),
+        options.password_salt,
+        options.password_params,
+    )
+
+    conn = connect()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                # Reserve a block of user ids, so ids can be assigned without the database.
+                cur.execute(
+                    "SELECT setval('users_id_seq', GREATEST((SELECT max(id) FROM users), nextval('users_id_seq')) + %s)",
+                    (options.users,),
+                )
+                options.first_user_id = cur.fetchone()[0] - options.users + 1
+    finally:
+        conn.close()
+
+    chunks = list(range(math.ceil(options.users / options.chunk_size)))
+    print(
+        f"Seeding {options.users} users with {options.workers} workers, in {len(chunks)} chunks"
+    )
+    next_slot = multiprocessing.Value("i", 0)
+    with multiprocessing.Pool(
+        options.workers, initializer=init_worker, initargs=(options, next_slot)
+    ) as pool:
+        run_chunks(pool, seed_users, chunks, "users")
+        # Follows and blooms refer to users in every chunk, so all users must exist first.
+        run_chunks(pool, seed_activity, chunks, "blooms")
+
+    print("Recounting user stats and analyzing tables")
+    conn = connect()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                user_stats.recount(cur)
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("ANALYZE")
+    finally:
+        conn.close()
+    print(
+        "Done. If you use HOME_TIMELINE_FANOUT, run `python3 admin.py rebuild-timelines`, "
+        "and run `python3 admin.py refresh-suggestions` for friends-of-friends suggestions."
+    )
+
+
+if __name__ == "__main__":
+    main()
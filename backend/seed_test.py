@@ -0,0 +1,27 @@
+import random
+import unittest
+
+from seed import copy_value, heavy_tailed_count, zipf_rank
+
+
+class TestSeed(unittest.TestCase):
+    def test_zipf_rank_is_in_range_and_skewed(self):
+        rng = random.Random(1)
+        ranks = [zipf_rank(rng, 1000, 1.1) for _ in range(10000)]
+        self.assertTrue(all(1 <= rank <= 1000 for rank in ranks))
+        self.assertGreater(ranks.count(1), ranks.count(500) * 20)
+
+    def test_heavy_tailed_count_averages_about_mean(self):
+        rng = random.Random(1)
+        counts = [heavy_tailed_count(rng, 20, 100000) for _ in range(20000)]
+        self.assertAlmostEqual(sum(counts) / len(counts), 20, delta=5)
+        self.assertGreater(max(counts), 200)
+
+    def test_copy_value_escapes(self):
+        self.assertEqual(copy_value("a\tb\nc\\d"), "a\\tb\\nc\\\\d")
+        self.assertEqual(copy_value(None), "\\N")
+        self.assertEqual(copy_value(b"\x01\xff"), "\\\\x01ff")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+import logging
+import multiprocessing
+import os
+import re
+import sys
+import tempfile
+from typing import Any, Dict
+
+from data import connection, ids, metrics, passwords, trending
+
+from flask import Flask
+from gunicorn.app.base import BaseApplication
+from gunicorn.glogging import Logger
+import psycopg2
+
+# Streams are authenticated with ?jwt=<token>, which must never reach the access log.
+TOKEN_PARAM = re.compile(r"(^|[?&])jwt=[^&\s]*")
+
+
+class ProductionServer(BaseApplication):
+    """ProductionServer runs an already-built app under gunicorn's pre-forking multi-worker server.
+
+    The app is built once in the master process before workers are forked (preloading).
+    Send the master SIGHUP to gracefully replace all workers, e.g. after a deploy.
+    """
+
+    def __init__(self, app: Any, options: Dict[str, Any]):
+        self.application = app
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self) -> Any:
+        return self.application
+
+
+def scrub_tokens(text: str) -> str:
+    return TOKEN_PARAM.sub(r"\1jwt=[redacted]", text)
+
+
+class AccessLogger(Logger):
+    """AccessLogger is gunicorn's logger, with tokens passed in query strings redacted."""
+
+    def atoms(self, resp, req, environ, request_time):
+        atoms = super().atoms(resp, req, environ, request_time)
+        for key in ("r", "q"):
+            if atoms[key]:
+                atoms[key] = scrub_tokens(atoms[key])
+        return atoms
+
+
+class ScrubTokensFilter(logging.Filter):
+    """ScrubTokensFilter redacts tokens from the request paths uvicorn logs requests with."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if isinstance(record.args, tuple) and len(record.args) == 5:
+            client_addr, method, full_path, http_version, status_code = record.args
+            record.args = (
+                client_addr,
+                method,
+                scrub_tokens(full_path),
+                http_version,
+                status_code,
+            )
+        return True
+
+
+def pre_fork(server, worker):
+    # Runs in the master, so the slot is picked knowing every live worker's, and is inherited by the fork.
+    used_slots = {other.id_slot for other in server.WORKERS.values()}
+    worker.id_slot = min(
+        slot for slot in range(len(used_slots) + 1) if slot not in used_slots
+    )
+
+
+def max_id_slots(server) -> int:
+    return 2 * server.num_workers
+
+
+def post_fork(server, worker):
+    # Each worker needs its own connections; sockets must not be shared across processes.
+    connection.forget_pool()
+    passwords.forget_hashing_pool()
+
+    # Bloom ids embed the worker id, so no two live workers may share one. During a
+    # reload old and new workers run together, so a host uses up to twice WEB_WORKERS
+    # slots; give each host its own ID_WORKER_ID base, spaced at least that far apart.
+    if worker.id_slot >= max_id_slots(server):
+        # Only while old workers are slow to exit; the master forks again once they have.
+        server.log.error(
+            f"All {max_id_slots(server)} bloom id slots are in use, so this worker can't start"
+        )
+        sys.exit(1)
+    ids.configure(int(os.getenv("ID_WORKER_ID", "0")) + worker.id_slot)
+
+    try:
+        connection.get_pool()
+    except psycopg2.Error as error:
+        # The pool will be created on the first request instead.
+        server.log.warning(f"Could not open database connections: {error}")
+
+
+def worker_exit(server, worker):
+    try:
+        trending.flush_hashtag_counts()
+    except psycopg2.Error as error:
+        server.log.warning(f"Could not write hashtag counts: {error}")
+    connection.close_pool()
+    # Keep this worker's final counts, so /metrics totals don't drop when it's replaced.
+    metrics.save_snapshot(force=True)
+
+
+def server_options(*, worker_class: str = "gthread") -> Dict[str, Any]:
+    return {
+        "bind": os.getenv("WEB_BIND", "0.0.0.0:3000"),
+        "workers": int(
+            os.getenv("WEB_WORKERS", str(multiprocessing.cpu_count() * 2 + 1))
+        ),
+        "threads": int(os.getenv("WEB_THREADS", "4")),
+        "worker_class": worker_class,
+        "preload_app": True,
+        "keepalive": int(os.getenv("WEB_KEEPALIVE", "5")),
+        "timeout": int(os.getenv("WEB_TIMEOUT", "30")),
+        "graceful_timeout": int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30")),
+        # Recycling workers now and then bounds the damage of any slow leak.
+        "max_requests": int(os.getenv("WEB_MAX_REQUESTS", "10000")),
+        "max_requests_jitter": int(os.getenv("WEB_MAX_REQUESTS_JITTER", "1000")),
+        "accesslog": os.getenv("WEB_ACCESS_LOG", "-"),
+        "logger_class": AccessLogger,
+        "pre_fork": pre_fork,
+        "post_fork": post_fork,
+        "worker_exit": worker_exit,
+    }
+
+
+def run(app: Flask):
+    # Workers share their metrics through files, so any worker can report on all of them.
+    os.environ.setdefault(
+        "METRICS_DIR", tempfile.mkdtemp(prefix="purpleforest-metrics-")
+    )
+    ProductionServer(app, server_options()).run()
+
+
+def run_asgi(app: Flask):
+    """run_asgi serves the app's ASGI version, with one event loop per worker process instead of threads."""
+    # Imported here so that the async dependencies are only needed to serve with them.
+    import asgi
+
+    os.environ.setdefault(
+        "METRICS_DIR", tempfile.mkdtemp(prefix="purpleforest-metrics-")
+    )
+    # Uvicorn workers write their own access log lines, so scrub those as they're logged.
+    logging.getLogger("uvicorn.access").addFilter(ScrubTokensFilter())
+    # Only the Flask fallback uses threads, for the less common endpoints.
+    wsgi_threads = int(os.getenv("WEB_THREADS", "4"))
+    ProductionServer(
+        asgi.create_asgi_app(app, wsgi_threads=wsgi_threads),
+        server_options(worker_class="uvicorn_worker.UvicornWorker"),
+    ).run()
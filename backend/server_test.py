@@ -0,0 +1,85 @@
+import datetime
+import logging
+import unittest
+from unittest import mock
+
+from gunicorn.config import Config
+
+from server import AccessLogger, ScrubTokensFilter, post_fork, pre_fork, scrub_tokens
+
+
+class FakeResponse:
+    status = "200 OK"
+    sent = 10
+    headers = []
+
+
+class TestScrubTokens(unittest.TestCase):
+    def test_redacts_only_the_token(self):
+        self.assertEqual(
+            scrub_tokens("GET /stream/home?jwt=abc.def.ghi&x=1 HTTP/1.1"),
+            "GET /stream/home?jwt=[redacted]&x=1 HTTP/1.1",
+        )
+        self.assertEqual(scrub_tokens("x=1&jwt=abc"), "x=1&jwt=[redacted]")
+        self.assertEqual(scrub_tokens("notjwt=abc"), "notjwt=abc")
+
+    def test_gunicorn_access_log(self):
+        environ = {
+            "REQUEST_METHOD": "GET",
+            "RAW_URI": "/stream/home?jwt=secret",
+            "SERVER_PROTOCOL": "HTTP/1.1",
+            "QUERY_STRING": "jwt=secret",
+            "PATH_INFO": "/stream/home",
+        }
+        atoms = AccessLogger(Config()).atoms(
+            FakeResponse(), [], environ, datetime.timedelta(seconds=1)
+        )
+        self.assertNotIn("secret", atoms["r"])
+        self.assertNotIn("secret", atoms["q"])
+
+    def test_uvicorn_access_log(self):
+        record = logging.LogRecord(
+            "uvicorn.access",
+            logging.INFO,
+            __file__,
+            1,
+            '%s - "%s %s HTTP/%s" %d',
+            ("127.0.0.1:1234", "GET", "/stream/home?jwt=secret", "1.1", 200),
+            None,
+        )
+        self.assertTrue(ScrubTokensFilter().filter(record))
+        self.assertNotIn("secret", record.getMessage())
+
+
+class FakeWorker:
+    pass
+
+
+class TestIdSlots(unittest.TestCase):
+    def arbiter(self, workers):
+        return mock.Mock(
+            num_workers=2, WORKERS={pid: worker for pid, worker in enumerate(workers)}
+        )
+
+    def test_reuses_the_lowest_free_slot(self):
+        running = [FakeWorker(), FakeWorker()]
+        running[0].id_slot, running[1].id_slot = 0, 2
+        worker = FakeWorker()
+        pre_fork(self.arbiter(running), worker)
+        self.assertEqual(worker.id_slot, 1)
+
+    def test_refuses_to_start_beyond_twice_the_workers(self):
+        worker = FakeWorker()
+        worker.id_slot = 4
+        with (
+            mock.patch("server.connection"),
+            mock.patch("server.passwords"),
+            mock.patch("server.ids") as ids,
+        ):
+            with self.assertRaises(SystemExit):
+                post_fork(self.arbiter([]), worker)
+        ids.configure.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
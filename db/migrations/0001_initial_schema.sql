@@ -1,4 +1,4 @@
-CREATE TABLE users (
+CREATE TABLE IF NOT EXISTS users (
     id SERIAL PRIMARY KEY,
     username VARCHAR NOT NULL,
     password_salt BYTEA NOT NULL,
@@ -6,21 +6,21 @@ CREATE TABLE users (
     UNIQUE(username)
 );
 
-CREATE TABLE blooms (
+CREATE TABLE IF NOT EXISTS blooms (
     id BIGSERIAL NOT NULL PRIMARY KEY,
     sender_id INT NOT NULL REFERENCES users(id),
     content TEXT NOT NULL,
     send_timestamp TIMESTAMP NOT NULL
 );
 
-CREATE TABLE follows (
+CREATE TABLE IF NOT EXISTS follows (
     id SERIAL PRIMARY KEY,
     follower INT NOT NULL REFERENCES users(id),
     followee INT NOT NULL REFERENCES users(id),
     UNIQUE(follower, followee)
 );
 
-CREATE TABLE hashtags (
+CREATE TABLE IF NOT EXISTS hashtags (
     id SERIAL PRIMARY KEY,
     hashtag VARCHAR NOT NULL,
     bloom_id BIGINT NOT NULL REFERENCES blooms(id),
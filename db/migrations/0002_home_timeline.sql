@@ -0,0 +1,6 @@
+CREATE TABLE IF NOT EXISTS home_timeline (
+    user_id INT NOT NULL REFERENCES users(id),
+    bloom_id BIGINT NOT NULL REFERENCES blooms(id),
+    send_timestamp TIMESTAMP NOT NULL,
+    PRIMARY KEY (user_id, send_timestamp, bloom_id)
+);
@@ -0,0 +1,7 @@
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id INT NOT NULL PRIMARY KEY REFERENCES users(id),
+    bloom_count INT NOT NULL DEFAULT 0,
+    follower_count INT NOT NULL DEFAULT 0,
+    following_count INT NOT NULL DEFAULT 0,
+    last_bloom_timestamp TIMESTAMP
+);
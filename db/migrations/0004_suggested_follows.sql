@@ -0,0 +1,6 @@
+CREATE TABLE IF NOT EXISTS suggested_follows (
+    user_id INT NOT NULL REFERENCES users(id),
+    suggested_user_id INT NOT NULL REFERENCES users(id),
+    score INT NOT NULL,
+    PRIMARY KEY (user_id, suggested_user_id)
+);
@@ -0,0 +1,10 @@
+-- Copy each bloom's send time onto its hashtags, so that hashtag pages can be
+-- read in time order straight from an index on hashtags.
+ALTER TABLE hashtags ADD COLUMN IF NOT EXISTS send_timestamp TIMESTAMP;
+
+UPDATE hashtags
+SET send_timestamp = blooms.send_timestamp
+FROM blooms
+WHERE blooms.id = hashtags.bloom_id AND hashtags.send_timestamp IS NULL;
+
+ALTER TABLE hashtags ALTER COLUMN send_timestamp SET NOT NULL;
@@ -0,0 +1,21 @@
+-- migrate: no-transaction
+
+-- get_blooms_for_user and the home timeline: one sender's blooms, newest first.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS blooms_sender_id_send_timestamp_idx
+    ON blooms (sender_id, send_timestamp DESC, id DESC);
+
+-- get_blooms_with_hashtag: one hashtag's blooms, newest first.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS hashtags_hashtag_send_timestamp_idx
+    ON hashtags (hashtag, send_timestamp DESC, bloom_id DESC);
+
+-- get_inverse_followed_usernames and fan-out: everyone following a user.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS follows_followee_idx
+    ON follows (followee, follower);
+
+-- Popular accounts, used to top up suggested follows.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS user_stats_follower_count_idx
+    ON user_stats (follower_count DESC, user_id);
+
+-- Reading a user's suggested follows, best first.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS suggested_follows_user_id_score_idx
+    ON suggested_follows (user_id, score DESC, suggested_user_id);
@@ -0,0 +1,12 @@
+-- migrate: no-transaction
+
+-- Full-text search over bloom content. The 'simple' configuration lower-cases words
+-- without stemming them or dropping stop words, so usernames, hashtags and words in
+-- any language are all searchable as written. Being a generated column, it's kept up
+-- to date by every insert. Adding it rewrites the table, so run this off-peak.
+ALTER TABLE blooms ADD COLUMN IF NOT EXISTS search_vector TSVECTOR
+    GENERATED ALWAYS AS (to_tsvector('simple', content)) STORED;
+
+-- search_blooms: blooms containing every word of the query.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS blooms_search_vector_idx
+    ON blooms USING GIN (search_vector);
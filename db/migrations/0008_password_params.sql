@@ -0,0 +1,6 @@
+-- Each password hash records the scrypt parameters it was made with, so stronger ones can
+-- be rolled out gradually: a password is rehashed with the current parameters when its
+-- user next logs in. Every hash made before this used n=8, r=8, p=1.
+ALTER TABLE users ADD COLUMN IF NOT EXISTS password_scrypt_n INT NOT NULL DEFAULT 8;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS password_scrypt_r INT NOT NULL DEFAULT 8;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS password_scrypt_p INT NOT NULL DEFAULT 1;
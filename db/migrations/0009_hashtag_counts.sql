@@ -0,0 +1,10 @@
+-- How many times each hashtag was used in each minute, hour and day, for /trending.
+-- Kept up to date as blooms are sent, and pruned to the buckets the trending windows
+-- read; `python3 admin.py rebuild-trends` recounts it from the hashtags table.
+CREATE TABLE IF NOT EXISTS hashtag_counts (
+    granularity TEXT NOT NULL,
+    bucket_start TIMESTAMP NOT NULL,
+    hashtag TEXT NOT NULL,
+    count INT NOT NULL,
+    PRIMARY KEY (granularity, bucket_start, hashtag)
+);
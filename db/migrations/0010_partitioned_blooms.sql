@@ -0,0 +1,103 @@
+-- Range-partition blooms and hashtags by month of send_timestamp, so the recent months
+-- almost every read touches have small indexes of their own, and old months can be
+-- archived by detaching whole partitions (`python3 admin.py archive-blooms`).
+--
+-- A partitioned table's unique constraints must include its partition key, so the primary
+-- keys become (id, send_timestamp), and hashtags and home_timeline can no longer have
+-- foreign keys to blooms. Bloom ids stay unique: data/ids.py generates them.
+--
+-- Partitions are named like blooms_y2025m01. Rows in months without one land in the
+-- default partitions; `python3 admin.py create-partitions` moves those into monthly
+-- partitions of their own, and creates partitions for the months ahead.
+--
+-- This copies both tables, so run it off-peak. Writes to blooms, hashtags and
+-- home_timeline wait until it commits, rather than landing in the old tables after they
+-- were copied and being dropped with them; reads carry on.
+DO $$
+DECLARE
+    partition_month DATE;
+    last_month DATE := date_trunc('month', now()) + interval '3 months';
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'blooms'::regclass) = 'p' THEN
+        RETURN;
+    END IF;
+
+    LOCK TABLE blooms, hashtags, home_timeline IN EXCLUSIVE MODE;
+
+    CREATE TABLE blooms_partitioned (
+        id BIGINT NOT NULL DEFAULT nextval('blooms_id_seq'),
+        sender_id INT NOT NULL REFERENCES users(id),
+        content TEXT NOT NULL,
+        send_timestamp TIMESTAMP NOT NULL,
+        search_vector TSVECTOR GENERATED ALWAYS AS (to_tsvector('simple', content)) STORED
+    ) PARTITION BY RANGE (send_timestamp);
+
+    CREATE TABLE hashtags_partitioned (
+        id INT NOT NULL DEFAULT nextval('hashtags_id_seq'),
+        hashtag VARCHAR NOT NULL,
+        bloom_id BIGINT NOT NULL,
+        send_timestamp TIMESTAMP NOT NULL
+    ) PARTITION BY RANGE (send_timestamp);
+
+    CREATE TABLE blooms_default PARTITION OF blooms_partitioned DEFAULT;
+    CREATE TABLE hashtags_default PARTITION OF hashtags_partitioned DEFAULT;
+
+    partition_month := LEAST(
+        date_trunc('month', (SELECT min(send_timestamp) FROM blooms)),
+        date_trunc('month', now())
+    );
+    WHILE partition_month <= last_month LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF blooms_partitioned FOR VALUES FROM (%L) TO (%L)',
+            'blooms_' || to_char(partition_month, '"y"YYYY"m"MM'),
+            partition_month,
+            partition_month + interval '1 month'
+        );
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF hashtags_partitioned FOR VALUES FROM (%L) TO (%L)',
+            'hashtags_' || to_char(partition_month, '"y"YYYY"m"MM'),
+            partition_month,
+            partition_month + interval '1 month'
+        );
+        partition_month := partition_month + interval '1 month';
+    END LOOP;
+
+    INSERT INTO blooms_partitioned (id, sender_id, content, send_timestamp)
+    SELECT id, sender_id, content, send_timestamp FROM blooms;
+
+    INSERT INTO hashtags_partitioned (id, hashtag, bloom_id, send_timestamp)
+    SELECT id, hashtag, bloom_id, send_timestamp FROM hashtags;
+
+    -- Keep the id sequences when the old tables are dropped.
+    ALTER SEQUENCE blooms_id_seq OWNED BY blooms_partitioned.id;
+    ALTER SEQUENCE hashtags_id_seq OWNED BY hashtags_partitioned.id;
+
+    ALTER TABLE home_timeline DROP CONSTRAINT IF EXISTS home_timeline_bloom_id_fkey;
+    DROP TABLE hashtags;
+    DROP TABLE blooms;
+    ALTER TABLE blooms_partitioned RENAME TO blooms;
+    ALTER TABLE hashtags_partitioned RENAME TO hashtags;
+
+    -- The same constraints and indexes as before (see 0006 and 0007), now on every partition.
+    ALTER TABLE blooms ADD CONSTRAINT blooms_pkey PRIMARY KEY (id, send_timestamp);
+    CREATE INDEX blooms_sender_id_send_timestamp_idx
+        ON blooms (sender_id, send_timestamp DESC, id DESC);
+    CREATE INDEX blooms_search_vector_idx ON blooms USING GIN (search_vector);
+
+    ALTER TABLE hashtags ADD CONSTRAINT hashtags_pkey PRIMARY KEY (id, send_timestamp);
+    ALTER TABLE hashtags ADD CONSTRAINT hashtags_hashtag_bloom_id_key
+        UNIQUE (hashtag, bloom_id, send_timestamp);
+    CREATE INDEX hashtags_hashtag_send_timestamp_idx
+        ON hashtags (hashtag, send_timestamp DESC, bloom_id DESC);
+END
+$$;
+
+-- Months whose partitions were exported to BLOOM_ARCHIVE_DIR and dropped.
+CREATE TABLE IF NOT EXISTS archived_months (
+    month DATE NOT NULL PRIMARY KEY,
+    bloom_count BIGINT NOT NULL,
+    hashtag_count BIGINT NOT NULL,
+    blooms_file TEXT NOT NULL,
+    hashtags_file TEXT NOT NULL,
+    archived_at TIMESTAMP NOT NULL DEFAULT now()
+);
@@ -24,8 +24,8 @@ function createProfile(template, {profileData, whoToFollow, isLoggedIn}) {
   usernameEl.querySelector("h2").textContent = profileData.username || "";
   usernameEl.setAttribute("href", `/profile/${profileData.username}`);
   bloomCountEl.textContent = profileData.total_blooms || 0;
-  followerCountEl.textContent = profileData.followers?.length || 0;
-  followingCountEl.textContent = profileData.follows?.length || 0;
+  followerCountEl.textContent = profileData.follower_count || 0;
+  followingCountEl.textContent = profileData.following_count || 0;
   followButtonEl.setAttribute("data-username", profileData.username || "");
   followButtonEl.hidden = profileData.is_self || profileData.is_following;
   followButtonEl.addEventListener("click", handleFollow);